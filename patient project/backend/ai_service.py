@@ -3,14 +3,22 @@ from google.genai import types
 import os
 import time
 import json
+import random
+import asyncio
+import threading
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
 API_KEY = os.getenv("gemini_api_key")
+# Only for pointing at a local stub (bench/gemini_stub.py) in load tests
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
 
-client = genai.Client(api_key=API_KEY)
+client = genai.Client(
+    api_key=API_KEY,
+    http_options=types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None,
+)
 
 # --- SYSTEM INSTRUCTIONS ---
 # Updated to include Priority Score for Triage
@@ -51,26 +59,275 @@ IMPORTANT JSON RULES (FOR DOCTOR REVIEW):
     "summary_note": "A 1-2 sentence clinical summary for the physician"
   }
 """
+
+
+# --- ADMISSION CONTROL ---
+# Every Gemini call goes through `admission`: a cap on in-flight requests plus
+# requests-per-minute and tokens-per-minute token buckets. Callers wait (up to
+# a deadline) for capacity; if the wait would blow the deadline the call is
+# shed with AIOverloadedError, which the routers turn into a 429. Upstream
+# 429/503 "overloaded" answers are retried with jittered exponential backoff.
+GEMINI_MAX_IN_FLIGHT = int(os.getenv("GEMINI_MAX_IN_FLIGHT", "8"))
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "60"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "250000"))
+GEMINI_MAX_QUEUE = int(os.getenv("GEMINI_MAX_QUEUE", "100"))
+GEMINI_QUEUE_TIMEOUT_SECONDS = float(os.getenv("GEMINI_QUEUE_TIMEOUT_SECONDS", "10"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+GEMINI_BACKOFF_BASE_SECONDS = float(os.getenv("GEMINI_BACKOFF_BASE_SECONDS", "1"))
+
+# Rough prompt-size estimate used to reserve TPM budget before a call;
+# corrected with the real usage_metadata once the response is back.
+CHARS_PER_TOKEN = 4
+EXPECTED_OUTPUT_TOKENS = 1024
+FILE_INPUT_TOKENS = 2000
+
+# How often a waiting caller re-checks for a free in-flight slot
+_ADMISSION_POLL_SECONDS = 0.05
+
+
+class AIOverloadedError(Exception):
+    """The AI backend is saturated; the request should be retried later (HTTP 429)."""
+
+    def __init__(self, message: str, retry_after: float = 5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight: int, rpm: int, tpm: int, max_queue: int):
+        self.max_in_flight = max_in_flight
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_queue = max_queue
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiting = 0
+        self._request_bucket = float(rpm)
+        self._token_bucket = float(tpm)
+        self._last_refill = time.monotonic()
+
+        self._metrics = {
+            "admitted": 0,
+            "shed": 0,
+            "upstream_retries": 0,
+            "queue_wait_seconds_total": 0.0,
+            "queue_wait_seconds_max": 0.0,
+            "tokens_used": 0,
+        }
+
+    def _refill(self, now: float):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._request_bucket = min(self.rpm, self._request_bucket + elapsed * self.rpm / 60)
+        self._token_bucket = min(self.tpm, self._token_bucket + elapsed * self.tpm / 60)
+
+    def _try_admit(self, tokens: int):
+        """
+        Takes a slot and reserves budget if possible (returns 0), otherwise returns
+        how long to wait before trying again. Must be called with the lock held.
+        """
+        self._refill(time.monotonic())
+
+        if self._in_flight >= self.max_in_flight:
+            return _ADMISSION_POLL_SECONDS
+
+        tokens = min(tokens, self.tpm)
+        wait = 0.0
+        if self._request_bucket < 1:
+            wait = max(wait, (1 - self._request_bucket) * 60 / self.rpm)
+        if self._token_bucket < tokens:
+            wait = max(wait, (tokens - self._token_bucket) * 60 / self.tpm)
+        if wait:
+            return wait
+
+        self._request_bucket -= 1
+        self._token_bucket -= tokens
+        self._in_flight += 1
+        return 0.0
+
+    def _admit_or_wait(self, tokens: int, started: float, deadline: float):
+        """Returns 0 once admitted, or the time to sleep; raises if the deadline can't be met."""
+        with self._lock:
+            wait = self._try_admit(tokens)
+            now = time.monotonic()
+            if not wait:
+                self._record_wait(now - started)
+                return 0.0
+            if now + wait > deadline:
+                self._metrics["shed"] += 1
+                raise AIOverloadedError(
+                    "AI service is busy. Please try again in a moment.",
+                    retry_after=max(1, round(wait)),
+                )
+            return wait
+
+    def _record_wait(self, waited: float):
+        self._metrics["admitted"] += 1
+        self._metrics["queue_wait_seconds_total"] += waited
+        self._metrics["queue_wait_seconds_max"] = max(
+            self._metrics["queue_wait_seconds_max"], waited
+        )
+
+    def _enter_queue(self):
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                self._metrics["shed"] += 1
+                raise AIOverloadedError("AI request queue is full.")
+            self._waiting += 1
+
+    def _leave_queue(self):
+        with self._lock:
+            self._waiting -= 1
+
+    def acquire(self, tokens: int, timeout: float = None):
+        """Blocks (in a worker thread) until the call is admitted."""
+        timeout = GEMINI_QUEUE_TIMEOUT_SECONDS if timeout is None else timeout
+        started = time.monotonic()
+        self._enter_queue()
+        try:
+            while True:
+                wait = self._admit_or_wait(tokens, started, started + timeout)
+                if not wait:
+                    return
+                time.sleep(wait)
+        finally:
+            self._leave_queue()
+
+    async def acquire_async(self, tokens: int, timeout: float = None):
+        """Same as acquire() but waits on the event loop instead of a thread."""
+        timeout = GEMINI_QUEUE_TIMEOUT_SECONDS if timeout is None else timeout
+        started = time.monotonic()
+        self._enter_queue()
+        try:
+            while True:
+                wait = self._admit_or_wait(tokens, started, started + timeout)
+                if not wait:
+                    return
+                await asyncio.sleep(wait)
+        finally:
+            self._leave_queue()
+
+    def release(self, reserved_tokens: int, used_tokens: int = None):
+        """Frees the in-flight slot and corrects the TPM bucket with real usage."""
+        with self._lock:
+            self._in_flight -= 1
+            if used_tokens is not None:
+                # May go negative: the overspend is paid back before new calls
+                self._token_bucket -= used_tokens - min(reserved_tokens, self.tpm)
+                self._metrics["tokens_used"] += used_tokens
+
+    def record_retry(self):
+        with self._lock:
+            self._metrics["upstream_retries"] += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            admitted = self._metrics["admitted"]
+            return {
+                **self._metrics,
+                "queue_wait_seconds_avg": (
+                    self._metrics["queue_wait_seconds_total"] / admitted
+                    if admitted
+                    else 0.0
+                ),
+                "in_flight": self._in_flight,
+                "waiting": self._waiting,
+            }
+
+
+admission = AdmissionController(
+    GEMINI_MAX_IN_FLIGHT, GEMINI_RPM, GEMINI_TPM, GEMINI_MAX_QUEUE
+)
+
+
+def get_metrics() -> dict:
+    return {**admission.metrics(), "context_cache": context_cache.metrics()}
+
+
+def estimate_tokens(*texts, files: int = 0) -> int:
+    chars = sum(len(t) for t in texts if t)
+    return chars // CHARS_PER_TOKEN + files * FILE_INPUT_TOKENS + EXPECTED_OUTPUT_TOKENS
+
+
+def _used_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "total_token_count", None) if usage else None
+
+
+def _is_overloaded(error: Exception) -> bool:
+    text = str(error).lower()
+    return any(
+        marker in text
+        for marker in ("503", "429", "overloaded", "unavailable", "resource_exhausted")
+    )
+
+
+def _backoff_delay(attempt: int) -> float:
+    # "Full jitter": uniform between 0 and the exponential cap
+    return random.uniform(0, GEMINI_BACKOFF_BASE_SECONDS * (2**attempt))
+
+
+def call_gemini(fn, estimated_tokens: int):
+    """
+    Runs `fn()` (one Gemini request) under admission control, retrying
+    overloaded answers with jittered exponential backoff.
+    """
+    for attempt in range(GEMINI_MAX_RETRIES):
+        admission.acquire(estimated_tokens)
+        response = None
+        try:
+            response = fn()
+            return response
+        except Exception as e:
+            if not _is_overloaded(e) or attempt == GEMINI_MAX_RETRIES - 1:
+                raise
+            admission.record_retry()
+        finally:
+            admission.release(estimated_tokens, _used_tokens(response))
+        time.sleep(_backoff_delay(attempt))
+
+
+async def call_gemini_async(fn, estimated_tokens: int):
+    """Async twin of call_gemini(): `fn()` returns an awaitable, waits never block a thread."""
+    for attempt in range(GEMINI_MAX_RETRIES):
+        await admission.acquire_async(estimated_tokens)
+        response = None
+        try:
+            response = await fn()
+            return response
+        except Exception as e:
+            if not _is_overloaded(e) or attempt == GEMINI_MAX_RETRIES - 1:
+                raise
+            admission.record_retry()
+        finally:
+            admission.release(estimated_tokens, _used_tokens(response))
+        await asyncio.sleep(_backoff_delay(attempt))
+
+
 def analyze_medical_image(file_path: str) -> str:
     # Upload file using your existing client
     upload = client.files.upload(file=file_path)
 
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=[
-            types.Content(
-                role="user",
-                parts=[
-                    types.Part.from_uri(
-                        file_uri=upload.uri, mime_type=upload.mime_type
-                    ),
-                    types.Part.from_text(
-                        # 👇 UPDATED PROMPT: Handles both text documents and visual symptoms
-                        text="Analyze this medical image. If it is a document, test report, or prescription, extract the text and summarize key findings. If it is a photograph of a physical symptom (like a rash, wound, or swelling), describe the visual findings in detail to assist a doctor in triage. Be professional and objective."
-                    ),
-                ],
-            )
-        ],
+    response = call_gemini(
+        lambda: client.models.generate_content(
+            model="gemini-2.5-flash",
+            contents=[
+                types.Content(
+                    role="user",
+                    parts=[
+                        types.Part.from_uri(
+                            file_uri=upload.uri, mime_type=upload.mime_type
+                        ),
+                        types.Part.from_text(
+                            # 👇 UPDATED PROMPT: Handles both text documents and visual symptoms
+                            text="Analyze this medical image. If it is a document, test report, or prescription, extract the text and summarize key findings. If it is a photograph of a physical symptom (like a rash, wound, or swelling), describe the visual findings in detail to assist a doctor in triage. Be professional and objective."
+                        ),
+                    ],
+                )
+            ],
+        ),
+        estimate_tokens(files=1),
     )
     return response.text
 
@@ -97,63 +354,515 @@ def analyze_medical_image(file_path: str) -> str:
 #     return response.text
 
 
-def get_ai_response(db_history: list, new_user_message: str) -> str:
-    """
-    1. Converts Database History -> New SDK History Format
-    2. Sends message to AI
-    3. Returns AI text response
-    """
+# --- CONTEXT WINDOW HELPERS (see context_service.py) ---
+DOCUMENT_START = "*** EXTRACTED DOCUMENT CONTENT ***"
+DOCUMENT_END = "**********************************"
+# How much of an older uploaded document's analysis stays in the prompt
+DOCUMENT_EXCERPT_CHARS = int(os.getenv("DOCUMENT_EXCERPT_CHARS", "1200"))
+
+CONTEXT_SUMMARY_PROMPT = """
+You maintain a running clinical summary of a patient's triage chat so the
+conversation can continue without the full transcript.
+Merge the PREVIOUS SUMMARY with the NEW MESSAGES into one updated summary.
+Keep every clinically relevant fact: symptoms, onset and duration, severity,
+medications, allergies, history, reported vitals, red flags, findings from
+uploaded documents, and questions the assistant already asked.
+Write plain English prose, at most 250 words. Output only the summary.
+"""
+
+
+def condense_document_text(text: str) -> str:
+    """Shortens an injected EXTRACTED DOCUMENT CONTENT block to an excerpt."""
+    start = text.find(DOCUMENT_START)
+    if start == -1:
+        return text
+
+    body_start = start + len(DOCUMENT_START)
+    end = text.find(DOCUMENT_END, body_start)
+    if end == -1:
+        end = len(text)
+
+    body = text[body_start:end].strip()
+    if len(body) <= DOCUMENT_EXCERPT_CHARS:
+        return text
+
+    excerpt = body[:DOCUMENT_EXCERPT_CHARS].rsplit(" ", 1)[0]
+    return (
+        f"{text[:body_start]}\n{excerpt}\n"
+        f"[... rest of the document omitted; the full analysis is in the patient's files ...]\n"
+        f"{text[end:]}"
+    )
+
+
+def prompt_text(db_history: list, index: int) -> str:
+    """Text of message `index` as it is sent to Gemini (only the newest document stays whole)."""
+    text = db_history[index].get("text") or ""
+    if index == len(db_history) - 1:
+        return text
+    return condense_document_text(text)
+
+
+def count_text_tokens(*texts) -> int:
+    return sum(len(t) for t in texts if t) // CHARS_PER_TOKEN
+
+
+def _document_reference(text: str) -> str:
+    # Keeps the "[System: User uploaded file ...]" line; the content is in the cache
+    header = text.split("\n", 1)[0]
+    return f"{header}\n(The full extracted content is provided in the cached context above.)"
+
 
-    # Step A: Convert DB History to New SDK Format
+def _build_chat_history(
+    db_history: list, context_summary: str = None, cached_seqs=()
+) -> list:
     # The new SDK uses 'role' and 'parts' inside a Content object
     chat_history = []
 
-    for msg in db_history:
+    # Older turns folded away by context_service come first, as a summary
+    if context_summary:
+        chat_history.append(
+            types.Content(
+                role="user",
+                parts=[
+                    types.Part.from_text(
+                        text=f"[Summary of the earlier conversation]\n{context_summary}"
+                    )
+                ],
+            )
+        )
+        chat_history.append(
+            types.Content(role="model", parts=[types.Part.from_text(text="Understood.")])
+        )
+
+    for i, msg in enumerate(db_history):
         role = "user" if msg.get("sender") == "patient" else "model"
-        if msg.get("text"):
+        if msg.get("seq") in cached_seqs:
+            text = _document_reference(msg.get("text") or "")
+        else:
+            text = prompt_text(db_history, i)
+        if text:
             chat_history.append(
-                types.Content(role=role, parts=[types.Part.from_text(text=msg["text"])])
+                types.Content(role=role, parts=[types.Part.from_text(text=text)])
             )
+    return chat_history
+
+
+def _chat_config(cache_name: str = None):
+    if cache_name:
+        # The system instruction lives in the cached content
+        return types.GenerateContentConfig(cached_content=cache_name, temperature=0.7)
+    return types.GenerateContentConfig(
+        system_instruction=SYSTEM_PROMPT,
+        temperature=0.7,
+    )
+
+
+def _estimate_chat_tokens(
+    db_history: list, new_user_message: str, context_summary: str = None
+) -> int:
+    return estimate_tokens(
+        SYSTEM_PROMPT,
+        new_user_message,
+        context_summary,
+        *(prompt_text(db_history, i) for i in range(len(db_history))),
+    )
+
+
+def summarize_conversation(previous_summary: str, messages: list) -> str:
+    """Folds `messages` into the rolling context summary and returns the new summary."""
+    transcript = "\n".join(
+        f"{msg.get('sender', 'ai').upper()}: {condense_document_text(msg.get('text') or '')}"
+        for msg in messages
+        if msg.get("text")
+    )
+    prompt = (
+        f"PREVIOUS SUMMARY:\n{previous_summary or 'None'}\n\n"
+        f"NEW MESSAGES:\n{transcript}"
+    )
+
+    response = call_gemini(
+        lambda: client.models.generate_content(
+            model="gemini-2.5-flash",
+            contents=prompt,
+            config=types.GenerateContentConfig(
+                system_instruction=CONTEXT_SUMMARY_PROMPT, temperature=0.2
+            ),
+        ),
+        estimate_tokens(CONTEXT_SUMMARY_PROMPT, prompt),
+    )
+    return response.text.strip()
+
+
+# --- CONTEXT CACHING ---
+# SYSTEM_PROMPT and a session's uploaded documents are identical on every turn,
+# so they are stored once as Gemini cached content and each turn only refers to
+# the cache by name. Handles are kept per process and their TTL is extended
+# shortly before it runs out. Gemini rejects caches below a minimum size, so
+# smaller contents (SYSTEM_PROMPT alone, today) are never sent for caching; a
+# creation that fails anyway is remembered for a while and the call falls back
+# to sending everything inline.
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CACHE_TTL_SECONDS", "3600"))
+CONTEXT_CACHE_REFRESH_SECONDS = int(os.getenv("GEMINI_CACHE_REFRESH_SECONDS", "300"))
+CONTEXT_CACHE_RETRY_SECONDS = int(os.getenv("GEMINI_CACHE_RETRY_SECONDS", "900"))
+# Gemini's minimum cached-content size for the model (prompt + contents)
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CACHE_MIN_TOKENS", "1024"))
+# Creates/refreshes for the same key are serialized on one of these locks
+_CACHE_CREATE_LOCKS = 64
+# Per-session caches only pay off once the documents are sizeable
+SESSION_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_SESSION_CACHE_MIN_TOKENS", "2048"))
+SYSTEM_CACHE_KEY = "system"
+
 
-    # Step B: Create Chat Session
+class ContextCache:
+    def __init__(self, ttl_seconds: int, refresh_seconds: int, retry_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self.refresh_seconds = refresh_seconds
+        self.retry_seconds = retry_seconds
+
+        self._lock = threading.Lock()
+        self._create_locks = [threading.Lock() for _ in range(_CACHE_CREATE_LOCKS)]
+        self._entries = {}  # key -> {"name", "fingerprint", "expires_at"}
+        self._failed_until = {}  # key -> monotonic time of the next attempt
+        self._metrics = {
+            "hits": 0,
+            "creates": 0,
+            "refreshes": 0,
+            "evictions": 0,
+            "failures": 0,
+            "too_small": 0,
+        }
+
+    def get(self, key: str, fingerprint=None, contents: list = None):
+        """
+        Returns the name of a cache holding SYSTEM_PROMPT (+ `contents`) for
+        `key`, creating or refreshing it as needed, or None to go uncached.
+        A different `fingerprint` means the contents changed: the cache is replaced.
+        """
+        if count_text_tokens(SYSTEM_PROMPT, *_content_texts(contents)) < CONTEXT_CACHE_MIN_TOKENS:
+            # Gemini would reject it; don't spend a request finding out
+            with self._lock:
+                self._metrics["too_small"] += 1
+            return None
+
+        found, name, entry = self._lookup(key, fingerprint)
+        if found:
+            return name
+
+        # Concurrent misses for a key wait here and then reuse the winner's
+        # cache, instead of each creating one and deleting the others'
+        with self._create_locks[hash(key) % _CACHE_CREATE_LOCKS]:
+            found, name, entry = self._lookup(key, fingerprint)
+            if found:
+                return name
+            return self._renew(key, fingerprint, contents, entry)
+
+    def _lookup(self, key: str, fingerprint):
+        """
+        Returns (found, name, entry). `found` means no Gemini call is needed:
+        `name` is a fresh cache, or None while creation backs off after a
+        failure. Otherwise `entry` is the current handle if it can be refreshed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._failed_until.get(key, 0) > now:
+                return True, None, None
+            entry = self._entries.get(key)
+            if entry and (entry["fingerprint"] != fingerprint or entry["expires_at"] <= now):
+                entry = None
+            if entry and entry["expires_at"] - now > self.refresh_seconds:
+                self._metrics["hits"] += 1
+                return True, entry["name"], entry
+        return False, None, entry
+
+    def _renew(self, key: str, fingerprint, contents: list, entry):
+        if entry and self._refresh(entry["name"]):
+            name, metric = entry["name"], "refreshes"
+        else:
+            name, metric = self._create(key, contents), "creates"
+
+        if not name:
+            with self._lock:
+                self._metrics["failures"] += 1
+                self._failed_until[key] = time.monotonic() + self.retry_seconds
+            return None
+
+        with self._lock:
+            previous = self._entries.get(key)
+            self._entries[key] = {
+                "name": name,
+                "fingerprint": fingerprint,
+                "expires_at": time.monotonic() + self.ttl_seconds,
+            }
+            self._failed_until.pop(key, None)
+            self._metrics[metric] += 1
+            self._prune_locked()
+
+        if previous and previous["name"] != name:
+            self._delete(previous["name"])
+        return name
+
+    def evict(self, key: str):
+        """Drops the cache for `key` now instead of waiting for its TTL."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            self._failed_until.pop(key, None)
+            if entry:
+                self._metrics["evictions"] += 1
+        if entry:
+            self._delete(entry["name"])
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {**self._metrics, "entries": len(self._entries)}
+
+    def _prune_locked(self):
+        # Expired on Gemini's side already — just forget the handles
+        now = time.monotonic()
+        for key in [k for k, e in self._entries.items() if e["expires_at"] <= now]:
+            del self._entries[key]
+        for key in [k for k, t in self._failed_until.items() if t <= now]:
+            del self._failed_until[key]
+
+    def _create(self, key: str, contents: list):
+        texts = _content_texts(contents)
+        try:
+            cache = call_gemini(
+                lambda: client.caches.create(
+                    model="gemini-2.5-flash",
+                    config=types.CreateCachedContentConfig(
+                        display_name=f"patient-portal-{key}",
+                        system_instruction=SYSTEM_PROMPT,
+                        contents=contents or None,
+                        ttl=f"{self.ttl_seconds}s",
+                    ),
+                ),
+                estimate_tokens(SYSTEM_PROMPT, *texts),
+            )
+            return cache.name
+        except Exception as e:
+            print(f"Context cache create error ({key}): {e}")
+            return None
+
+    def _refresh(self, name: str) -> bool:
+        try:
+            client.caches.update(
+                name=name,
+                config=types.UpdateCachedContentConfig(ttl=f"{self.ttl_seconds}s"),
+            )
+            return True
+        except Exception as e:
+            print(f"Context cache refresh error ({name}): {e}")
+            return False
+
+    def _delete(self, name: str):
+        try:
+            client.caches.delete(name=name)
+        except Exception as e:
+            print(f"Context cache delete error ({name}): {e}")
+
+
+def _content_texts(contents: list) -> list:
+    return [part.text for content in contents or [] for part in content.parts]
+
+
+context_cache = ContextCache(
+    CONTEXT_CACHE_TTL_SECONDS, CONTEXT_CACHE_REFRESH_SECONDS, CONTEXT_CACHE_RETRY_SECONDS
+)
+
+
+def _session_cache_key(session_id: str) -> str:
+    return f"session:{session_id}"
+
+
+def resolve_context_cache(session_id: str = None, documents: list = None):
+    """
+    Returns (cache_name or None, seqs of the documents inside that cache).
+    Sessions with large uploaded documents get their own cache (system prompt +
+    full document text); everything else shares the system-prompt cache, as
+    long as SYSTEM_PROMPT alone reaches CONTEXT_CACHE_MIN_TOKENS.
+    """
+    documents = [d for d in documents or [] if d.get("text")]
+    if session_id and count_text_tokens(*(d["text"] for d in documents)) >= SESSION_CACHE_MIN_TOKENS:
+        name = context_cache.get(
+            _session_cache_key(session_id),
+            fingerprint=tuple(d["seq"] for d in documents),
+            contents=[
+                types.Content(role="user", parts=[types.Part.from_text(text=d["text"])])
+                for d in documents
+            ],
+        )
+        if name:
+            return name, {d["seq"] for d in documents}
+
+    return context_cache.get(SYSTEM_CACHE_KEY), set()
+
+
+def evict_session_cache(session_id: str):
+    """Called when a session ends (its clinical summary was generated)."""
+    context_cache.evict(_session_cache_key(session_id))
+
+
+def get_ai_response(
+    db_history: list,
+    new_user_message: str,
+    context_summary: str = None,
+    session_id: str = None,
+    documents: list = None,
+) -> str:
+    """
+    1. Converts Database History -> New SDK History Format
+    2. Sends message to AI
+    3. Returns AI text response
+    """
+
+    # Step A + B: Convert DB History to New SDK Format and create the chat session
+    # (system prompt and the session's documents come from the context cache)
+    cache_name, cached_seqs = resolve_context_cache(session_id, documents)
     chat = client.chats.create(
         model="gemini-2.5-flash",
-        config=types.GenerateContentConfig(
-            system_instruction=SYSTEM_PROMPT,
-            temperature=0.7,
-        ),
-        history=chat_history,
+        config=_chat_config(cache_name),
+        history=_build_chat_history(db_history, context_summary, cached_seqs),
+    )
+
+    # Step C: Send Message (admission control + backoff retries live in call_gemini)
+    estimated = _estimate_chat_tokens(db_history, new_user_message, context_summary)
+    try:
+        response = call_gemini(lambda: chat.send_message(new_user_message), estimated)
+        return response.text
+    except AIOverloadedError:
+        raise
+    except Exception as e:
+        return f"Error: System is currently busy. Please try again in a moment. ({str(e)})"
+
+
+async def get_ai_response_async(
+    db_history: list,
+    new_user_message: str,
+    context_summary: str = None,
+    session_id: str = None,
+    documents: list = None,
+) -> str:
+    """Same as get_ai_response(), on the SDK's async client (no thread is held while waiting)."""
+    # Usually an in-memory lookup; only a cache create/refresh touches the network
+    cache_name, cached_seqs = await asyncio.to_thread(
+        resolve_context_cache, session_id, documents
+    )
+    chat = client.aio.chats.create(
+        model="gemini-2.5-flash",
+        config=_chat_config(cache_name),
+        history=_build_chat_history(db_history, context_summary, cached_seqs),
+    )
+
+    estimated = _estimate_chat_tokens(db_history, new_user_message, context_summary)
+    try:
+        response = await call_gemini_async(
+            lambda: chat.send_message(new_user_message), estimated
+        )
+        return response.text
+    except AIOverloadedError:
+        raise
+    except Exception as e:
+        return f"Error: System is currently busy. Please try again in a moment. ({str(e)})"
+
+
+async def open_ai_stream(
+    db_history: list,
+    new_user_message: str,
+    context_summary: str = None,
+    session_id: str = None,
+    documents: list = None,
+):
+    """
+    Starts a streamed chat reply and returns an async iterator of text deltas.
+    Admission, the upstream request and its overload retries happen here,
+    before the first token, so callers can still answer 429 instead of opening
+    a stream. The returned
+    iterator holds the in-flight slot until it is exhausted or closed (e.g. the
+    client disconnected) — always iterate it to the end or `aclose()` it.
+    """
+    cache_name, cached_seqs = await asyncio.to_thread(
+        resolve_context_cache, session_id, documents
+    )
+    chat = client.aio.chats.create(
+        model="gemini-2.5-flash",
+        config=_chat_config(cache_name),
+        history=_build_chat_history(db_history, context_summary, cached_seqs),
     )
 
-    # Step C: Send Message
-    max_retries = 3
-    for attempt in range(max_retries):
+    estimated = _estimate_chat_tokens(db_history, new_user_message, context_summary)
+    # The SDK only sends the request when the first chunk is read, so that
+    # read is part of "opening" and retried like call_gemini_async() does.
+    for attempt in range(GEMINI_MAX_RETRIES):
+        await admission.acquire_async(estimated)
+        upstream = None
         try:
-            response = chat.send_message(new_user_message)
-            return response.text
+            upstream = await chat.send_message_stream(new_user_message)
+            first = await upstream.__anext__()
+            return _relay_stream(upstream, estimated, first)
+        except StopAsyncIteration:
+            return _relay_stream(upstream, estimated, None)
         except Exception as e:
-            # Check if it's a 503 error (Overloaded)
-            if "503" in str(e) or "overloaded" in str(e).lower():
-                if attempt < max_retries - 1:
-                    time.sleep(2)  # Wait 2 seconds before trying again
-                    continue
-            return f"Error: System is currently busy. Please try again in a moment. ({str(e)})"
+            if hasattr(upstream, "aclose"):
+                await upstream.aclose()
+            admission.release(estimated)
+            if not _is_overloaded(e) or attempt == GEMINI_MAX_RETRIES - 1:
+                raise
+            admission.record_retry()
+        await asyncio.sleep(_backoff_delay(attempt))
+
+
+async def _relay_stream(upstream, estimated: int, first):
+    used = None
+    try:
+        if first is not None:
+            used = _used_tokens(first)
+            if first.text:
+                yield first.text
+            async for chunk in upstream:
+                used = _used_tokens(chunk) or used
+                if chunk.text:
+                    yield chunk.text
+    finally:
+        # Runs on normal completion, errors and client disconnects alike:
+        # close the upstream HTTP stream and give the slot back.
+        if hasattr(upstream, "aclose"):
+            await upstream.aclose()
+        admission.release(estimated, used)
+
+
+TRANSCRIPTION_PROMPT = """
+        You are a highly accurate medical transcription AI. 
+        Listen to the provided audio. 
+        
+        1. Transcribe the spoken text accurately. 
+        2. If the user is speaking in a regional language (like Hindi, Gujarati, or Spanish), write it using the English alphabet (Hinglish/Roman Script). Example: 'Tum kaise ho?' 'Tame kem cho?' 
+        3. If the user is speaking English, just transcribe exactly what they said.
+        4. Fix any obvious medical spelling errors, but do not change the underlying meaning of the patient's symptoms.
+        5. Output ONLY the final transcribed/translated text. Do not include markdown formatting, introductory conversational text, or quotes.
+        """
+
 
+def _audio_upload_config(file, mime_type: str = None):
+    if mime_type:
+        return types.UploadFileConfig(mime_type=mime_type)
+    if isinstance(file, str) and file.endswith(".webm"):
+        return types.UploadFileConfig(mime_type="audio/webm")
+    return None
 
-def transcribe_audio(file_path: str) -> str:
+
+def transcribe_audio(file, mime_type: str = None) -> str:
     """
     Uploads audio to Gemini and returns the transcription.
+    `file` is a path, or a file-like object (then `mime_type` is required).
     """
     try:
-        print(f"Uploading {file_path} to Gemini...")
+        print(f"Uploading {file if isinstance(file, str) else 'audio stream'} to Gemini...")
 
         # 1. EXPLICITLY TELL GEMINI IT IS AN AUDIO FILE to prevent the 500 Crash
-        upload_config = None
-        if file_path.endswith(".webm"):
-            upload_config = types.UploadFileConfig(mime_type="audio/webm")
+        upload_config = _audio_upload_config(file, mime_type)
 
         # Upload the file with the config
-        upload_result = client.files.upload(file=file_path, config=upload_config)
+        upload_result = client.files.upload(file=file, config=upload_config)
 
         # 2. Wait for processing (Audio takes a few seconds)
         while upload_result.state.name == "PROCESSING":
@@ -168,24 +877,54 @@ def transcribe_audio(file_path: str) -> str:
         print("Audio ready. Generating transcript...")
 
         # 3. Generate Content
-        prompt = """
-        You are a highly accurate medical transcription AI. 
-        Listen to the provided audio. 
-        
-        1. Transcribe the spoken text accurately. 
-        2. If the user is speaking in a regional language (like Hindi, Gujarati, or Spanish), write it using the English alphabet (Hinglish/Roman Script). Example: 'Tum kaise ho?' 'Tame kem cho?' 
-        3. If the user is speaking English, just transcribe exactly what they said.
-        4. Fix any obvious medical spelling errors, but do not change the underlying meaning of the patient's symptoms.
-        5. Output ONLY the final transcribed/translated text. Do not include markdown formatting, introductory conversational text, or quotes.
-        """
+        prompt = TRANSCRIPTION_PROMPT
 
         # The new SDK allows us to pass the File object directly into the contents array!
-        response = client.models.generate_content(
-            model="gemini-2.5-flash", contents=[upload_result, prompt]
+        response = call_gemini(
+            lambda: client.models.generate_content(
+                model="gemini-2.5-flash", contents=[upload_result, prompt]
+            ),
+            estimate_tokens(prompt, files=1),
+        )
+
+        return response.text
+
+    except AIOverloadedError:
+        raise
+    except Exception as e:
+        print(f"Transcription Error: {e}")
+        return f"Error processing audio: {str(e)}"
+
+
+async def transcribe_audio_async(file, mime_type: str = None) -> str:
+    """
+    Async twin of transcribe_audio() for request handlers (uses client.aio).
+    The SDK reads file-like objects synchronously, so pass a path or in-memory
+    bytes (io.BytesIO), never an UploadFile's spooled temp file.
+    """
+    try:
+        upload_result = await client.aio.files.upload(
+            file=file, config=_audio_upload_config(file, mime_type)
         )
 
+        while upload_result.state.name == "PROCESSING":
+            await asyncio.sleep(1)
+            upload_result = await client.aio.files.get(name=upload_result.name)
+
+        if upload_result.state.name == "FAILED":
+            return "Audio processing failed by Gemini."
+
+        response = await call_gemini_async(
+            lambda: client.aio.models.generate_content(
+                model="gemini-2.5-flash",
+                contents=[upload_result, TRANSCRIPTION_PROMPT],
+            ),
+            estimate_tokens(TRANSCRIPTION_PROMPT, files=1),
+        )
         return response.text
 
+    except AIOverloadedError:
+        raise
     except Exception as e:
         print(f"Transcription Error: {e}")
         return f"Error processing audio: {str(e)}"
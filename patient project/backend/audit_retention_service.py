@@ -0,0 +1,147 @@
+# backend/audit_retention_service.py
+"""
+Upkeep for the audit_logs table, which is range-partitioned by month on
+`timestamp` (one child table per month, e.g. audit_logs_2026_10). Queries that
+filter on timestamp only touch the matching months, and expired months are
+dropped whole instead of DELETEd row by row.
+
+- `ensure_partitions()` creates this month's partition and the next
+  AUDIT_PARTITION_MONTHS_AHEAD. Inserts fail for a month with no partition,
+  so it runs at startup and daily from the scheduler in main.py.
+- `archive_expired_partitions()` exports every partition older than
+  AUDIT_RETENTION_MONTHS to AUDIT_ARCHIVE_DIR/<partition>.jsonl.gz, then
+  detaches and drops it.
+"""
+import gzip
+import json
+import os
+import re
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+from db import engine
+
+AUDIT_PARTITION_MONTHS_AHEAD = int(os.getenv("AUDIT_PARTITION_MONTHS_AHEAD", "3"))
+# HIPAA asks for six years
+AUDIT_RETENTION_MONTHS = int(os.getenv("AUDIT_RETENTION_MONTHS", "72"))
+AUDIT_ARCHIVE_DIR = os.getenv("AUDIT_ARCHIVE_DIR", "audit_archive")
+
+PARTITION_NAME = re.compile(r"^audit_logs_(\d{4})_(\d{2})$")
+# Serializes partition DDL between API processes starting at the same time
+PARTITION_LOCK_KEY = 7_204_311
+
+
+def _add_months(year: int, month: int, months: int):
+    index = year * 12 + (month - 1) + months
+    return index // 12, index % 12 + 1
+
+
+def _partition_name(year: int, month: int) -> str:
+    return f"audit_logs_{year:04d}_{month:02d}"
+
+
+def _month_start(year: int, month: int) -> str:
+    return f"{year:04d}-{month:02d}-01 00:00:00+00"
+
+
+def _existing_partitions(conn) -> list:
+    return list(
+        conn.execute(
+            text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = 'audit_logs'::regclass"
+            )
+        ).scalars()
+    )
+
+
+def ensure_partitions(months_ahead: int = AUDIT_PARTITION_MONTHS_AHEAD):
+    """Creates any missing partition from this month to `months_ahead` from now."""
+    now = datetime.now(timezone.utc)
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+        existing = set(_existing_partitions(conn))
+
+        for offset in range(months_ahead + 1):
+            year, month = _add_months(now.year, now.month, offset)
+            name = _partition_name(year, month)
+            if name in existing:
+                continue
+            next_year, next_month = _add_months(year, month, 1)
+            conn.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF audit_logs "
+                    f"FOR VALUES FROM ('{_month_start(year, month)}') "
+                    f"TO ('{_month_start(next_year, next_month)}')"
+                )
+            )
+            print(f"Audit log partition {name} created")
+
+
+def _export_partition(conn, name: str) -> str:
+    """Writes every row of the partition to a gzipped JSON-lines file."""
+    os.makedirs(AUDIT_ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(AUDIT_ARCHIVE_DIR, f"{name}.jsonl.gz")
+    partial = path + ".partial"
+
+    rows = conn.execution_options(stream_results=True, yield_per=1000).execute(
+        text(f"SELECT * FROM {name} ORDER BY timestamp, id")
+    )
+    count = 0
+    with gzip.open(partial, "wt", encoding="utf-8") as out:
+        for row in rows.mappings():
+            out.write(json.dumps(dict(row), default=str) + "\n")
+            count += 1
+
+    # Only a complete export gets the final name
+    os.replace(partial, path)
+    print(f"Audit log partition {name}: {count} rows archived to {path}")
+    return path
+
+
+def archive_expired_partitions(retention_months: int = AUDIT_RETENTION_MONTHS) -> list:
+    """
+    Archives and drops partitions that ended more than `retention_months`
+    ago. Returns the archive file paths written.
+    """
+    now = datetime.now(timezone.utc)
+    cutoff = _add_months(now.year, now.month, -retention_months)
+    archived = []
+
+    with engine.connect() as conn:
+        names = sorted(_existing_partitions(conn))
+
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if not match:
+            continue
+        ends = _add_months(int(match.group(1)), int(match.group(2)), 1)
+        if ends > cutoff:
+            continue
+
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY}
+                )
+                if name not in _existing_partitions(conn):
+                    continue  # another process got here first
+                archived.append(_export_partition(conn, name))
+                conn.execute(text(f"ALTER TABLE audit_logs DETACH PARTITION {name}"))
+                conn.execute(text(f"DROP TABLE {name}"))
+        except Exception as e:
+            # The partition stays in place; the next run tries again
+            print(f"Audit log archive error ({name}): {e}")
+
+    return archived
+
+
+def run_maintenance():
+    """Scheduler entry point."""
+    try:
+        ensure_partitions()
+        archive_expired_partitions()
+    except Exception as e:
+        print(f"Audit log maintenance error: {e}")
@@ -1,7 +1,159 @@
 # backend/audit_service.py
+"""
+HIPAA audit trail.
+
+`log_action()` doesn't write inside the request: it drops the entry into a
+bounded in-memory buffer, and the `writer` thread (started in main.py's
+lifespan) inserts whatever has piled up with one multi-row INSERT every
+AUDIT_FLUSH_INTERVAL_SECONDS, or sooner once AUDIT_FLUSH_BATCH entries wait.
+The request's own session is never committed for an audit row.
+
+If the buffer is full, or the writer isn't running (worker.py, scripts), the
+entry is inserted synchronously instead. Stopping the writer flushes
+everything still buffered; only a database that is down at shutdown loses
+entries (and they are counted in the log).
+
+A batch the database rejects is retried row by row, so one bad entry can't
+hold up the rest: rows that still fail are logged and dropped (`dropped`),
+while a connection failure keeps them buffered for the next flush.
+"""
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
+
+from db import engine
 import models
 
+AUDIT_BUFFER_SIZE = int(os.getenv("AUDIT_BUFFER_SIZE", "10000"))
+AUDIT_FLUSH_INTERVAL_SECONDS = float(os.getenv("AUDIT_FLUSH_INTERVAL_SECONDS", "1.0"))
+AUDIT_FLUSH_BATCH = int(os.getenv("AUDIT_FLUSH_BATCH", "500"))
+
+
+def _insert(entries: list):
+    with engine.begin() as conn:
+        conn.execute(insert(models.AuditLog).values(entries))
+
+
+class AuditWriter:
+    """Background thread batching buffered audit entries into the database."""
+
+    def __init__(self):
+        self._buffer = queue.Queue(maxsize=AUDIT_BUFFER_SIZE)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.sync_writes = 0  # entries that had to bypass the buffer
+        self.dropped = 0  # entries the database rejected even on their own
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def submit(self, entry: dict):
+        if not self.running:
+            _insert([entry])
+            return
+        try:
+            self._buffer.put_nowait(entry)
+        except queue.Full:
+            # Falling behind (or the database is down): make this request pay
+            # for its own row rather than lose it
+            self.sync_writes += 1
+            _insert([entry])
+            return
+        if self._buffer.qsize() >= AUDIT_FLUSH_BATCH:
+            self._wake.set()
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the thread once everything buffered has been written."""
+        thread, self._thread = self._thread, None
+        if not thread:
+            return
+        self._stop.set()
+        self._wake.set()
+        thread.join()
+
+        # Anything submitted while the thread was finishing up
+        unwritten = self._flush([])
+        if unwritten or not self._buffer.empty():
+            print(
+                f"Audit writer stopped with "
+                f"{len(unwritten) + self._buffer.qsize()} unwritten entries"
+            )
+
+    def _take_batch(self) -> list:
+        batch = []
+        while len(batch) < AUDIT_FLUSH_BATCH:
+            try:
+                batch.append(self._buffer.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch: list) -> list:
+        """Writes batches until the buffer is empty. Returns a batch that failed."""
+        while True:
+            batch = batch or self._take_batch()
+            if not batch:
+                return []
+            try:
+                _insert(batch)
+            except Exception as e:
+                print(f"Audit flush error ({len(batch)} entries): {e}")
+                batch = self._insert_each(batch)
+                if batch:
+                    return batch
+            batch = []
+
+    def _insert_each(self, batch: list) -> list:
+        """
+        Inserts a failed batch one row at a time. Returns the rows not yet
+        written if the database can't be reached; rejected rows are dropped.
+        """
+        for i, entry in enumerate(batch):
+            try:
+                _insert([entry])
+            except OperationalError as e:
+                print(f"Audit flush error, retrying {len(batch) - i} entries later: {e}")
+                return batch[i:]
+            except Exception as e:
+                self.dropped += 1
+                print(
+                    f"Audit entry dropped ({entry.get('action')}, "
+                    f"actor {entry.get('actor_id')}, {entry.get('timestamp')}): {e}"
+                )
+        return []
+
+    def _run(self):
+        failed = []
+        while not self._stop.is_set():
+            self._wake.wait(AUDIT_FLUSH_INTERVAL_SECONDS)
+            self._wake.clear()
+            # Entries kept back by a connection failure go before taking more
+            failed = self._flush(failed)
+        # Final attempt; stop() reports whatever is still left
+        failed = self._flush(failed)
+        for entry in failed:
+            try:
+                self._buffer.put_nowait(entry)
+            except queue.Full:
+                break
+
+
+writer = AuditWriter()
+
 
 def log_action(
     db: Session,
@@ -11,15 +163,18 @@ def log_action(
     resource_type: str = None,
     resource_id: str = None,
 ):
-    """Saves a HIPAA-compliant audit log to the database."""
-    audit_entry = models.AuditLog(
-        actor_id=actor_id,
-        patient_id=patient_id,
-        action=action,
-        resource_type=resource_type,
-        resource_id=str(resource_id) if resource_id else None,
+    """
+    Records a HIPAA audit log entry. `db` is accepted for compatibility but not
+    used: the entry is written outside the request's transaction.
+    """
+    writer.submit(
+        {
+            "actor_id": actor_id,
+            "patient_id": patient_id,
+            "action": action,
+            "resource_type": resource_type,
+            "resource_id": str(resource_id) if resource_id else None,
+            # When it happened, not when the batch was flushed
+            "timestamp": datetime.now(timezone.utc),
+        }
     )
-    db.add(audit_entry)
-    db.commit()
-    db.refresh(audit_entry)
-    return audit_entry
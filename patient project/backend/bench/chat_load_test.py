@@ -0,0 +1,148 @@
+# backend/bench/chat_load_test.py
+"""
+Concurrent chat load test. Two modes:
+
+  ai   (default) drives N concurrent ai_service.get_ai_response_async() calls
+       in-process against a local Gemini stub (bench/gemini_stub.py), so no
+       API key or database is needed:
+
+           python bench/chat_load_test.py --chats 300 --latency 2.0
+
+  http hits a running API's POST /chat/ (start it with GEMINI_BASE_URL set
+       to a stub from `python bench/gemini_stub.py`):
+
+           python bench/chat_load_test.py --mode http --url http://127.0.0.1:8000 \\
+               --token <patient JWT> --session-id <id> --chats 200
+
+Reports throughput, latency percentiles, how many model calls the stub was
+answering at once, and the admission counters (ai mode). With one in-flight
+slot per concurrent chat, wall time stays close to one stub latency however
+many chats run; lower GEMINI_MAX_IN_FLIGHT to watch queueing and shedding.
+Without aiohttp installed the SDK's async client uses httpx's default pool,
+which caps one process at 100 concurrent model calls (see "stub peak in
+flight"); past that, chats wait for a connection rather than fail.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gemini_stub import GeminiStub  # noqa: E402
+
+MESSAGE = "I have had a headache and a mild fever since yesterday."
+
+
+def _percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def _report(latencies: list, errors: list, elapsed: float, stub: GeminiStub = None):
+    print(f"chats:             {len(latencies) + len(errors)}")
+    print(f"succeeded:         {len(latencies)}")
+    print(f"failed:            {len(errors)}")
+    if errors:
+        print(f"  first error:     {errors[0]}")
+    print(f"wall time:         {elapsed:.2f} s")
+    print(f"throughput:        {len(latencies) / elapsed:.1f} chats/s")
+    if latencies:
+        print(f"latency p50:       {_percentile(latencies, 0.50) * 1000:.0f} ms")
+        print(f"latency p95:       {_percentile(latencies, 0.95) * 1000:.0f} ms")
+        print(f"latency max:       {max(latencies) * 1000:.0f} ms")
+    if stub:
+        print(f"stub peak in flight: {stub.peak_in_flight}")
+        print(f"stub requests:     {dict(stub.requests)}")
+
+
+async def _timed(coro_factory, latencies: list, errors: list):
+    started = time.perf_counter()
+    try:
+        await coro_factory()
+        latencies.append(time.perf_counter() - started)
+    except Exception as e:
+        errors.append(repr(e))
+
+
+async def run_ai(args):
+    stub = GeminiStub(latency=args.latency).start()
+    os.environ["GEMINI_BASE_URL"] = stub.url
+    os.environ.setdefault("gemini_api_key", "load-test")
+    os.environ.setdefault("GEMINI_MAX_IN_FLIGHT", str(args.chats))
+    os.environ.setdefault("GEMINI_MAX_QUEUE", str(args.chats))
+    os.environ.setdefault("GEMINI_RPM", str(args.chats * 60))
+    os.environ.setdefault("GEMINI_TPM", str(args.chats * 60 * 4000))
+
+    import ai_service  # after the env vars are set
+
+    history = [
+        {"role": "user", "content": "Hello"},
+        {"role": "assistant", "content": "Hi, what brings you in today?"},
+    ]
+    latencies, errors = [], []
+
+    async def chat(i):
+        reply = await ai_service.get_ai_response_async(
+            history, MESSAGE, session_id=f"load-{i}"
+        )
+        if reply.startswith("Error:"):
+            raise RuntimeError(reply)
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(_timed(lambda i=i: chat(i), latencies, errors) for i in range(args.chats))
+    )
+    elapsed = time.perf_counter() - started
+
+    _report(latencies, errors, elapsed, stub)
+    admission = ai_service.admission.metrics()
+    print(f"admitted / shed:   {admission['admitted']} / {admission['shed']}")
+    print(f"queue wait max:    {admission['queue_wait_seconds_max'] * 1000:.0f} ms")
+    stub.stop()
+
+
+async def run_http(args):
+    import httpx
+
+    latencies, errors = [], []
+    headers = {"Authorization": f"Bearer {args.token}"}
+    limits = httpx.Limits(max_connections=args.chats)
+    async with httpx.AsyncClient(
+        base_url=args.url, headers=headers, limits=limits, timeout=120
+    ) as http:
+
+        async def chat():
+            response = await http.post(
+                "/chat/", json={"session_id": args.session_id, "message": MESSAGE}
+            )
+            response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(_timed(chat, latencies, errors) for _ in range(args.chats))
+        )
+        elapsed = time.perf_counter() - started
+
+    _report(latencies, errors, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=("ai", "http"), default="ai")
+    parser.add_argument("--chats", type=int, default=300, help="concurrent chats")
+    parser.add_argument("--latency", type=float, default=2.0, help="stub seconds per reply")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--token", default="")
+    parser.add_argument("--session-id", default="")
+    args = parser.parse_args()
+
+    if args.mode == "http" and not (args.token and args.session_id):
+        parser.error("--mode http needs --token and --session-id")
+
+    asyncio.run(run_ai(args) if args.mode == "ai" else run_http(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# backend/bench/context_cache_check.py
+"""
+Checks ai_service's context cache against a local Gemini stub
+(bench/gemini_stub.py), which like Gemini rejects caches below
+--min-cache-tokens:
+
+    python bench/context_cache_check.py --chats 50
+
+1. Chats without documents: SYSTEM_PROMPT alone is below the minimum, so no
+   cache create is attempted at all.
+2. --chats concurrent chats on one session with a large document: exactly one
+   cache is created, nothing is deleted, and every call refers to it.
+3. A second document arrives: the cache is replaced once (one create, one
+   delete of the old one).
+
+Exits non-zero on the first failed check.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gemini_stub import GeminiStub  # noqa: E402
+
+
+def _document(seq: int, chars: int) -> dict:
+    body = " ".join(f"Finding {i}: haemoglobin 13.{i % 10} g/dL." for i in range(chars // 35))
+    return {
+        "seq": seq,
+        "sender": "patient",
+        "is_file": True,
+        "text": (
+            f"[System: User uploaded file 'report_{seq}.pdf']\n"
+            f"*** EXTRACTED DOCUMENT CONTENT ***\n{body}\n"
+            f"**********************************\n(Please analyze this medical data)"
+        ),
+    }
+
+
+def check(label: str, ok: bool, detail: str):
+    print(f"[{'ok' if ok else 'FAIL'}] {label}: {detail}")
+    if not ok:
+        sys.exit(1)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--min-cache-tokens", type=int, default=1024)
+    parser.add_argument("--doc-chars", type=int, default=12000)
+    args = parser.parse_args()
+
+    stub = GeminiStub(latency=0.2, min_cache_tokens=args.min_cache_tokens).start()
+    os.environ["GEMINI_BASE_URL"] = stub.url
+    os.environ.setdefault("gemini_api_key", "cache-check")
+    os.environ["GEMINI_CACHE_MIN_TOKENS"] = str(args.min_cache_tokens)
+    os.environ.setdefault("GEMINI_MAX_IN_FLIGHT", str(args.chats))
+    os.environ.setdefault("GEMINI_MAX_QUEUE", str(args.chats))
+    os.environ.setdefault("GEMINI_RPM", str(args.chats * 60))
+
+    import ai_service
+
+    history = [{"seq": 1, "sender": "patient", "text": "Hello"}]
+
+    # 1. No documents: nothing worth caching
+    for _ in range(10):
+        await ai_service.get_ai_response_async(history, "I feel dizzy.", session_id="plain")
+    check(
+        "system prompt alone",
+        stub.requests["cachedContents.create"] == 0,
+        f"{stub.requests['cachedContents.create']} creates for 10 chats "
+        f"(SYSTEM_PROMPT ~{ai_service.count_text_tokens(ai_service.SYSTEM_PROMPT)} tokens)",
+    )
+
+    # 2. Concurrent turns on a session with a large document share one cache
+    documents = [_document(2, args.doc_chars)]
+    replies = await asyncio.gather(
+        *(
+            ai_service.get_ai_response_async(
+                history + documents, "What do my results mean?",
+                session_id="with-docs", documents=documents,
+            )
+            for _ in range(args.chats)
+        )
+    )
+    cache_names = set(stub.caches)
+    used = stub.last_requests["generateContent"].get("cachedContent")
+    check(
+        "concurrent session turns",
+        stub.requests["cachedContents.create"] == 1
+        and stub.requests["cachedContents.delete"] == 0
+        and used in cache_names,
+        f"{stub.requests['cachedContents.create']} create, "
+        f"{stub.requests['cachedContents.delete']} deletes for {len(replies)} chats, "
+        f"calls use {used}",
+    )
+
+    # 3. A new document replaces the session's cache exactly once
+    documents.append(_document(3, args.doc_chars))
+    await asyncio.gather(
+        *(
+            ai_service.get_ai_response_async(
+                history + documents, "And the new report?",
+                session_id="with-docs", documents=documents,
+            )
+            for _ in range(args.chats)
+        )
+    )
+    check(
+        "document added",
+        stub.requests["cachedContents.create"] == 2
+        and stub.requests["cachedContents.delete"] == 1
+        and len(stub.caches) == 1,
+        f"{stub.requests['cachedContents.create']} creates, "
+        f"{stub.requests['cachedContents.delete']} delete, {len(stub.caches)} live cache",
+    )
+
+    print(f"cache metrics: {ai_service.context_cache.metrics()}")
+    stub.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
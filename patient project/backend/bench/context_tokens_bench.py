@@ -0,0 +1,116 @@
+# backend/bench/context_tokens_bench.py
+"""
+Prompt tokens per turn vs session length: the whole transcript (what was sent
+before context_service) against context_service.build_context(), with folds
+answered by a local Gemini stub (bench/gemini_stub.py).
+
+    python bench/context_tokens_bench.py --turns 200 --doc-every 10
+
+Each simulated turn builds the context (the request path), appends a patient
+message and an AI reply, then runs the fold the "chat.fold_context" job would
+run, as the worker does after the reply is saved. Every --doc-every turns the
+patient uploads a document with a large EXTRACTED DOCUMENT CONTENT block.
+"""
+import argparse
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gemini_stub import GeminiStub  # noqa: E402
+
+PATIENT_TEXT = (
+    "The pain is still there, mostly on the left side, and it gets worse "
+    "after meals. I took paracetamol twice today. "
+)
+AI_TEXT = (
+    "Thank you. Does the pain spread to your back or shoulder, and have you "
+    "noticed any fever, vomiting or change in your stools? "
+)
+
+
+def _document(turn: int, chars: int) -> str:
+    body = " ".join(f"Finding {i}: value within reference range." for i in range(chars // 40))
+    return (
+        f"[System: User uploaded file 'report_{turn}.pdf']\n"
+        f"*** EXTRACTED DOCUMENT CONTENT ***\n{body}\n"
+        f"**********************************\n(Please analyze this medical data)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--doc-every", type=int, default=10)
+    parser.add_argument("--doc-chars", type=int, default=12000)
+    parser.add_argument("--fold-latency", type=float, default=0.0, help="stub seconds per fold")
+    args = parser.parse_args()
+
+    stub = GeminiStub(latency=args.fold_latency).start()
+    os.environ["GEMINI_BASE_URL"] = stub.url
+    os.environ.setdefault("gemini_api_key", "bench")
+    # context_service imports models; nothing touches the database here
+    os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+    import ai_service
+    import context_service
+
+    record = SimpleNamespace(
+        session_id="bench", context_summary=None, context_summary_seq=0, messages=[]
+    )
+
+    def add(sender: str, text: str, **extra):
+        record.messages.append(
+            {"seq": len(record.messages) + 1, "sender": sender, "text": text, **extra}
+        )
+
+    report_at = {t for t in (1, 5, 10, 25, 50, 100, 150, 200, 300, 500) if t <= args.turns}
+    report_at.add(args.turns)
+    build_ms_max = 0.0
+    folds = 0
+
+    print(f"{'turn':>5} {'messages':>9} {'full transcript':>16} {'build_context':>14} {'summary seq':>12}")
+    for turn in range(1, args.turns + 1):
+        started = time.perf_counter()
+        context = context_service.build_context(None, record)
+        build_ms_max = max(build_ms_max, (time.perf_counter() - started) * 1000)
+
+        full = ai_service.count_text_tokens(
+            ai_service.SYSTEM_PROMPT, *(m["text"] for m in record.messages), PATIENT_TEXT
+        )
+        sent = ai_service.count_text_tokens(
+            ai_service.SYSTEM_PROMPT,
+            context["context_summary"],
+            *(
+                ai_service.prompt_text(context["db_history"], i)
+                for i in range(len(context["db_history"]))
+            ),
+            PATIENT_TEXT,
+        )
+        if turn in report_at:
+            print(
+                f"{turn:>5} {len(record.messages):>9} {full:>16} {sent:>14} "
+                f"{record.context_summary_seq:>12}"
+            )
+
+        if args.doc_every and turn % args.doc_every == 0:
+            add("patient", _document(turn, args.doc_chars), is_file=True)
+        add("patient", PATIENT_TEXT)
+        add("ai", AI_TEXT)
+
+        # What the chat.fold_context job does once the turn is saved
+        if context_service.needs_fold(record):
+            record.context_summary, record.context_summary_seq = context_service.next_fold(record)
+            folds += 1
+
+    print()
+    print(f"fold calls:             {folds} ({stub.requests['generateContent']} to the stub)")
+    print(f"build_context max time: {build_ms_max:.2f} ms (no Gemini call on the request path)")
+    print(f"token budget:           {context_service.CONTEXT_TOKEN_BUDGET} (+ system prompt)")
+    stub.stop()
+
+
+if __name__ == "__main__":
+    main()
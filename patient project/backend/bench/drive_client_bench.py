@@ -0,0 +1,96 @@
+# backend/bench/drive_client_bench.py
+"""
+Counts OAuth token refreshes and Drive client builds per N file operations
+(drive_service.get_drive_service), against a local fake token endpoint.
+
+    python bench/drive_client_bench.py --ops 1000 --threads 8 --expires-in 3600
+
+With a long-lived token, expect 1 refresh and one build per thread however
+many operations run. Pass a short --expires-in (e.g. 2) with --op-delay to
+watch refreshes happen only as the token nears expiry.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def start_fake_token_server(expires_in: int):
+    hits = {"count": 0}
+
+    class TokenHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            hits["count"] += 1
+            body = json.dumps(
+                {
+                    "access_token": f"fake-token-{hits['count']}",
+                    "expires_in": expires_in,
+                    "token_type": "Bearer",
+                }
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TokenHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, hits
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--expires-in", type=int, default=3600)
+    parser.add_argument("--op-delay", type=float, default=0.0, help="seconds per op")
+    args = parser.parse_args()
+
+    server, hits = start_fake_token_server(args.expires_in)
+    os.environ["GOOGLE_DRIVE_TOKEN"] = json.dumps(
+        {
+            "refresh_token": "fake-refresh-token",
+            "token_uri": f"http://127.0.0.1:{server.server_port}/token",
+            "client_id": "bench",
+            "client_secret": "bench",
+            "scopes": ["https://www.googleapis.com/auth/drive.file"],
+        }
+    )
+
+    import drive_service  # after the env var is set
+
+    def operation(_):
+        service = drive_service.get_drive_service()
+        assert service is not None
+        if args.op_delay:
+            time.sleep(args.op_delay)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(operation, range(args.ops)))
+    elapsed = time.perf_counter() - started
+
+    stats = drive_service.stats
+    print(f"operations:            {args.ops} on {args.threads} threads")
+    print(f"token endpoint hits:   {hits['count']}")
+    print(f"credential refreshes:  {stats['refreshes']}")
+    print(f"service builds:        {stats['builds']}")
+    print(f"refreshes per 1,000:   {stats['refreshes'] * 1000 / args.ops:.2f}")
+    print(f"builds per 1,000:      {stats['builds'] * 1000 / args.ops:.2f}")
+    print(f"avg per op:            {elapsed / args.ops * 1000:.3f} ms")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
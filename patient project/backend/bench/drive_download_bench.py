@@ -0,0 +1,102 @@
+# backend/bench/drive_download_bench.py
+"""
+Time-to-first-byte and peak chunk size of drive_service.get_file_stream(),
+against a local fake Drive server that trickles the file out.
+
+    python bench/drive_download_bench.py --size-mb 50 --chunk-kb 1024
+
+The fake server sends the file in 64 KiB writes with a small pause between
+them, so a buffering implementation shows up as TTFB ~= total time.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from drive_client_bench import start_fake_token_server  # noqa: E402
+
+WRITE_SIZE = 64 * 1024
+
+
+def start_fake_drive_server(size: int, write_delay: float):
+    class MediaHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            start, end = 0, size - 1
+            range_header = self.headers.get("Range")
+            if range_header:
+                first, last = range_header.split("=", 1)[1].split("-")
+                start, end = int(first), min(int(last), size - 1)
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(end - start + 1))
+            self.end_headers()
+
+            remaining = end - start + 1
+            try:
+                while remaining > 0:
+                    n = min(WRITE_SIZE, remaining)
+                    self.wfile.write(b"x" * n)
+                    remaining -= n
+                    time.sleep(write_delay)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MediaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=float, default=50)
+    parser.add_argument("--chunk-kb", type=int, default=1024)
+    parser.add_argument("--write-delay", type=float, default=0.001)
+    args = parser.parse_args()
+
+    size = int(args.size_mb * 1024 * 1024)
+    token_server, _ = start_fake_token_server(3600)
+    drive_server = start_fake_drive_server(size, args.write_delay)
+    os.environ["GOOGLE_DRIVE_TOKEN"] = (
+        '{"refresh_token": "x", "client_id": "bench", "client_secret": "bench", '
+        f'"token_uri": "http://127.0.0.1:{token_server.server_port}/token", '
+        '"scopes": ["https://www.googleapis.com/auth/drive.file"]}'
+    )
+
+    import drive_service
+
+    drive_service.DRIVE_MEDIA_URL = (
+        f"http://127.0.0.1:{drive_server.server_port}/files/{{file_id}}"
+    )
+
+    started = time.perf_counter()
+    stream = drive_service.get_file_stream("bench-file", chunk_size=args.chunk_kb * 1024)
+    assert stream is not None
+    ttfb = None
+    total = largest = 0
+    for chunk in stream:
+        if ttfb is None:
+            ttfb = time.perf_counter() - started
+        total += len(chunk)
+        largest = max(largest, len(chunk))
+    elapsed = time.perf_counter() - started
+
+    print(f"file size:        {size / 1024 / 1024:.1f} MiB")
+    print(f"bytes received:   {total}")
+    print(f"time to 1st byte: {ttfb * 1000:.1f} ms")
+    print(f"total time:       {elapsed * 1000:.1f} ms")
+    print(f"largest chunk:    {largest / 1024:.0f} KiB (limit {args.chunk_kb} KiB)")
+    drive_server.shutdown()
+    token_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
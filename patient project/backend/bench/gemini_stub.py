@@ -0,0 +1,226 @@
+# backend/bench/gemini_stub.py
+"""
+A local stand-in for the Gemini API, for load tests and cache checks.
+Point the backend at it with GEMINI_BASE_URL=http://127.0.0.1:<port>.
+
+    python bench/gemini_stub.py --port 8765 --latency 2.0
+
+Answers generateContent and streamGenerateContent (SSE) after `latency`
+seconds, and keeps cachedContents in memory. `requests` counts calls per
+endpoint, `last_requests` keeps each endpoint's last JSON body (so scripts
+can check what was actually sent) and `peak_in_flight` is the most model
+calls that were being answered at once. Like Gemini, cachedContents below
+`min_cache_tokens` (text length / 4) are rejected with a 400. `overload(endpoint, times)` makes
+the next `times` calls to an endpoint answer 429 RESOURCE_EXHAUSTED.
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY_TEXT = "Thanks for the details. How long have you had these symptoms?"
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default listen backlog (5) resets connections under a load test
+    request_queue_size = 1024
+
+
+class GeminiStub:
+    def __init__(
+        self,
+        latency: float = 0.5,
+        stream_chunks: int = 5,
+        port: int = 0,
+        min_cache_tokens: int = 1024,
+    ):
+        self.latency = latency
+        self.min_cache_tokens = min_cache_tokens
+        self.stream_chunks = stream_chunks
+        self.requests = Counter()
+        self.last_requests = {}
+        self.caches = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._overloads = Counter()
+        self._lock = threading.Lock()
+        self._server = _Server(("127.0.0.1", port), self._handler())
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+    def _record(self, endpoint: str, body: dict):
+        with self._lock:
+            self.requests[endpoint] += 1
+            self.last_requests[endpoint] = body
+
+    def overload(self, endpoint: str, times: int = 1):
+        with self._lock:
+            self._overloads[endpoint] += times
+
+    def _take_overload(self, endpoint: str) -> bool:
+        with self._lock:
+            if self._overloads[endpoint] <= 0:
+                return False
+            self._overloads[endpoint] -= 1
+            return True
+
+    def _enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _body(self) -> dict:
+                length = int(self.headers.get("Content-Length", 0))
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def _json(self, payload: dict, status: int = 200):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _error(self, code: int, status: str, message: str):
+                self._json(
+                    {"error": {"code": code, "message": message, "status": status}}, code
+                )
+
+            def _cache_resource(self, name: str, body: dict) -> dict:
+                return {
+                    "name": name,
+                    "model": body.get("model", "models/gemini-2.5-flash"),
+                    "displayName": body.get("displayName", ""),
+                    "expireTime": "2099-01-01T00:00:00Z",
+                }
+
+            def do_POST(self):
+                path = self.path.split("?", 1)[0]
+                body = self._body()
+                endpoint = path.rsplit(":", 1)[-1]
+                if stub._take_overload(endpoint):
+                    stub._record(endpoint, body)
+                    self._error(429, "RESOURCE_EXHAUSTED", "Resource has been exhausted.")
+                elif path.endswith(":generateContent"):
+                    stub._record("generateContent", body)
+                    stub._enter()
+                    try:
+                        time.sleep(stub.latency)
+                        self._json(_response(REPLY_TEXT))
+                    finally:
+                        stub._leave()
+                elif path.endswith(":streamGenerateContent"):
+                    stub._record("streamGenerateContent", body)
+                    stub._enter()
+                    try:
+                        self._stream()
+                    finally:
+                        stub._leave()
+                elif path.endswith("/cachedContents"):
+                    stub._record("cachedContents.create", body)
+                    if len(json.dumps(body)) // 4 < stub.min_cache_tokens:
+                        self._error(400, "INVALID_ARGUMENT", "Cached content is too small.")
+                        return
+                    name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+                    stub.caches[name] = body
+                    self._json(self._cache_resource(name, body))
+                elif path.endswith(":countTokens"):
+                    stub._record("countTokens", body)
+                    self._json({"totalTokens": len(json.dumps(body)) // 4})
+                else:
+                    self._error(404, "NOT_FOUND", path)
+
+            def do_PATCH(self):
+                name = self.path.split("?", 1)[0].split("/v1beta/", 1)[-1]
+                body = self._body()
+                stub._record("cachedContents.update", body)
+                if name not in stub.caches:
+                    self._error(404, "NOT_FOUND", name)
+                    return
+                self._json(self._cache_resource(name, stub.caches[name]))
+
+            def do_DELETE(self):
+                name = self.path.split("?", 1)[0].split("/v1beta/", 1)[-1]
+                stub._record("cachedContents.delete", {"name": name})
+                stub.caches.pop(name, None)
+                self._json({})
+
+            def _stream(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                words = REPLY_TEXT.split(" ")
+                per_chunk = max(1, len(words) // stub.stream_chunks)
+                pieces = [
+                    " ".join(words[i : i + per_chunk]) + " "
+                    for i in range(0, len(words), per_chunk)
+                ]
+                try:
+                    for piece in pieces:
+                        time.sleep(stub.latency / len(pieces))
+                        event = f"data: {json.dumps(_response(piece))}\r\n\r\n".encode()
+                        self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+                        self.wfile.flush()
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def _response(text: str) -> dict:
+    return {
+        "candidates": [
+            {
+                "content": {"role": "model", "parts": [{"text": text}]},
+                "finishReason": "STOP",
+            }
+        ],
+        "usageMetadata": {
+            "promptTokenCount": 100,
+            "candidatesTokenCount": 20,
+            "totalTokenCount": 120,
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=2.0)
+    args = parser.parse_args()
+
+    stub = GeminiStub(latency=args.latency, port=args.port).start()
+    print(f"Gemini stub on {stub.url} (latency {args.latency}s). Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
@@ -0,0 +1,178 @@
+# backend/bench/timeline_bench.py
+"""
+Doctor timeline (GET /doctor/patients/{id}/summaries) page times at 10k and
+100k items per patient, keyset vs OFFSET vs the old load-everything-and-sort.
+
+    DATABASE_URL=postgresql://... python bench/timeline_bench.py --rows 10000 100000
+
+Needs a Postgres database with the schema applied (python migrate_db.py).
+For each size it creates a throwaway patient with half triage summaries and
+half files, times the pages, then deletes everything it created. --explain
+prints the plan of the first page (it should be two index scans on the
+(patient_id, created_at) indexes, not a sort of the whole history).
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import Response  # noqa: E402
+from sqlalchemy import delete, event, insert, text  # noqa: E402
+
+import audit_service  # noqa: E402
+import models  # noqa: E402
+import schemas  # noqa: E402
+from db import SessionLocal  # noqa: E402
+from routers import doctor  # noqa: E402
+
+INSERT_BATCH = 5000
+PAGE = 20
+RUNS = 5
+
+# Time the queries, not the audit write every call makes
+audit_service.log_action = lambda **_: None
+
+
+def _seed(db, rows: int) -> int:
+    patient = models.User(
+        email=f"timeline-bench-{uuid.uuid4().hex[:8]}@example.invalid",
+        role=models.UserRole.PATIENT,
+    )
+    db.add(patient)
+    db.commit()
+
+    start = datetime.now(timezone.utc)
+    half = rows // 2
+    for table, make in (
+        (
+            models.ChatHistory.__table__,
+            lambda i: {
+                "patient_id": patient.id,
+                "session_id": f"bench-{i}",
+                "summary": {"chief_complaint": "Headache", "priority_score": i % 10},
+                "priority_score": i % 10,
+                "created_at": start - timedelta(minutes=2 * i),
+            },
+        ),
+        (
+            models.MedicalMedia.__table__,
+            lambda i: {
+                "patient_id": patient.id,
+                "file_name": f"report_{i}.pdf",
+                "file_type": "application/pdf",
+                "transcript": "Within normal limits.",
+                "created_at": start - timedelta(minutes=2 * i + 1),
+            },
+        ),
+    ):
+        for first in range(0, half, INSERT_BATCH):
+            db.execute(
+                insert(table), [make(i) for i in range(first, min(first + INSERT_BATCH, half))]
+            )
+        db.commit()
+    db.execute(text("ANALYZE chat_history; ANALYZE medical_media"))
+    return patient.id
+
+
+def _cleanup(db, patient_id: int):
+    db.execute(delete(models.MedicalMedia).where(models.MedicalMedia.patient_id == patient_id))
+    db.execute(delete(models.ChatHistory).where(models.ChatHistory.patient_id == patient_id))
+    db.execute(delete(models.User).where(models.User.id == patient_id))
+    db.commit()
+
+
+def _timeline(db, patient_id: int, **params):
+    response = Response()
+    items = doctor.get_patient_timeline(
+        patient_id=patient_id,
+        response=response,
+        skip=params.get("skip", 0),
+        limit=PAGE,
+        before=params.get("before"),
+        item_type=None,
+        db=db,
+        current_doctor=schemas.TokenData(user_id=None),
+    )
+    return items, response.headers.get("X-Next-Cursor")
+
+
+def _load_everything(db, patient_id: int, skip: int):
+    """What the endpoint used to do: every row of both tables, sorted in Python."""
+    timeline = [
+        {"id": f"chat_{s.id}", "created_at": s.created_at, "content": s.summary}
+        for s in db.query(models.ChatHistory).filter(
+            models.ChatHistory.patient_id == patient_id,
+            models.ChatHistory.summary.isnot(None),
+        )
+    ] + [
+        {"id": f"file_{f.id}", "created_at": f.created_at, "content": f.transcript}
+        for f in db.query(models.MedicalMedia).filter(
+            models.MedicalMedia.patient_id == patient_id
+        )
+    ]
+    timeline.sort(key=lambda item: item["created_at"], reverse=True)
+    return timeline[skip : skip + PAGE]
+
+
+def _median_ms(fn) -> float:
+    timings = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--explain", action="store_true")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        for rows in args.rows:
+            print(f"\n== {rows:,} timeline items ==")
+            patient_id = _seed(db, rows)
+            try:
+                deep = rows // 2
+                _, deep_cursor = _timeline(db, patient_id, skip=deep)
+
+                results = {
+                    "keyset page 1": lambda: _timeline(db, patient_id),
+                    f"keyset page at item {deep:,}": lambda: _timeline(
+                        db, patient_id, before=deep_cursor
+                    ),
+                    f"OFFSET {deep:,}": lambda: _timeline(db, patient_id, skip=deep),
+                    "load everything, page 1": lambda: _load_everything(db, patient_id, 0),
+                }
+                for label, fn in results.items():
+                    db.expire_all()
+                    print(f"{label:<32} {_median_ms(fn):9.1f} ms")
+
+                if args.explain:
+                    statements = []
+
+                    @event.listens_for(db.bind, "before_cursor_execute")
+                    def _capture(conn, cursor, statement, parameters, context, many):
+                        statements.append((statement, parameters))
+
+                    _timeline(db, patient_id)
+                    event.remove(db.bind, "before_cursor_execute", _capture)
+                    statement, parameters = statements[0]
+                    cursor = db.connection().connection.cursor()
+                    cursor.execute("EXPLAIN ANALYZE " + statement, parameters)
+                    print("\n".join(row[0] for row in cursor.fetchall()))
+            finally:
+                _cleanup(db, patient_id)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
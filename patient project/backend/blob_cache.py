@@ -0,0 +1,168 @@
+# backend/blob_cache.py
+"""
+Local on-disk LRU cache in front of Drive.
+
+Files are stored under a content-addressed path derived from their
+drive_file_id (Drive IDs are immutable — a replaced file always gets a new ID),
+so a cache entry never goes stale; it only has to be dropped when the file is
+deleted or replaced to free the space early.
+"""
+import os
+import hashlib
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+
+CACHE_DIR = os.getenv(
+    "BLOB_CACHE_DIR", os.path.join(tempfile.gettempdir(), "patient_portal_blob_cache")
+)
+MAX_BYTES = int(os.getenv("BLOB_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Huge scans would evict everything else, so they are streamed but never cached
+MAX_OBJECT_BYTES = int(os.getenv("BLOB_CACHE_MAX_OBJECT_BYTES", str(32 * 1024 * 1024)))
+
+
+class BlobCache:
+    def __init__(self, directory: str, max_bytes: int, max_object_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_object_bytes = min(max_object_bytes, max_bytes)
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size, least recently used first
+        self._total_bytes = 0
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "bytes_served_from_cache": 0,
+            "bytes_served_from_origin": 0,
+            "stores": 0,
+            "evictions": 0,
+        }
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    # --- internals ---
+    def _key(self, file_id: str) -> str:
+        return hashlib.sha256(file_id.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _load_index(self):
+        """Rebuilds the LRU order from what is already on disk (oldest access first)."""
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".part"):
+                    # Leftover from a download that was interrupted by a restart
+                    os.remove(os.path.join(root, name))
+                    continue
+                st = os.stat(os.path.join(root, name))
+                found.append((st.st_atime, name, st.st_size))
+
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict_locked()
+
+    def _evict_locked(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self._stats["evictions"] += 1
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    # --- public API ---
+    def get_path(self, file_id: str):
+        """Returns the local path of a cached file (marking it recently used), or None."""
+        key = self._key(file_id)
+        with self._lock:
+            if key in self._entries and os.path.exists(self._path(key)):
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return self._path(key)
+
+            if key in self._entries:
+                # Removed from disk behind our back
+                self._total_bytes -= self._entries.pop(key)
+            self._stats["misses"] += 1
+            return None
+
+    def record_served(self, nbytes: int):
+        with self._lock:
+            self._stats["bytes_served_from_cache"] += nbytes
+
+    def tee(self, file_id: str, chunks):
+        """
+        Wraps a chunk iterator coming from Drive: every chunk is passed through to
+        the client and written to a temporary file at the same time. The file only
+        becomes a cache entry once the whole download completed successfully.
+        """
+        key = self._key(file_id)
+        final_path = self._path(key)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        temp_path = f"{final_path}.{uuid.uuid4().hex[:8]}.part"
+
+        written = 0
+        out = open(temp_path, "wb")
+        completed = False
+        try:
+            for chunk in chunks:
+                with self._lock:
+                    self._stats["bytes_served_from_origin"] += len(chunk)
+                if out and written + len(chunk) <= self.max_object_bytes:
+                    out.write(chunk)
+                    written += len(chunk)
+                elif out:
+                    # Too big to be worth caching — keep streaming, stop writing
+                    out.close()
+                    out = None
+                    os.remove(temp_path)
+                yield chunk
+            completed = True
+        finally:
+            if out:
+                out.close()
+                if completed:
+                    self._store(key, temp_path, final_path, written)
+                else:
+                    os.remove(temp_path)
+
+    def _store(self, key: str, temp_path: str, final_path: str, size: int):
+        os.replace(temp_path, final_path)
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = size
+            self._total_bytes += size
+            self._stats["stores"] += 1
+            self._evict_locked()
+
+    def invalidate(self, file_id: str):
+        key = self._key(file_id)
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": (self._stats["hits"] / lookups) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes_cached": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+cache = BlobCache(CACHE_DIR, MAX_BYTES, MAX_OBJECT_BYTES)
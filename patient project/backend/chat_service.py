@@ -0,0 +1,103 @@
+# backend/chat_service.py
+"""
+Writes to the chat_messages table, and to a chat's triage summary.
+
+A message's position is its `seq` within the chat. Seqs are handed out by an
+atomic `UPDATE chat_history SET message_count = message_count + n RETURNING`,
+so concurrent writers to the same chat (a chat turn and an upload job, say)
+get distinct ranges instead of overwriting each other. The caller commits.
+"""
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import flag_modified
+
+import models
+
+MESSAGE_FIELDS = ("sender", "text", "is_file", "file_url", "status")
+
+# What the AI writes in "red_flags" when there are none
+NO_RED_FLAGS = {"", "none", "none identified", "not reported", "n/a", "no"}
+
+
+def _reserve_seqs(db: Session, chat_id: int, count: int) -> int:
+    """Returns the first of `count` consecutive seqs reserved for this chat."""
+    last = db.execute(
+        update(models.ChatHistory)
+        .where(models.ChatHistory.id == chat_id)
+        .values(message_count=models.ChatHistory.message_count + count)
+        .returning(models.ChatHistory.message_count)
+        .execution_options(synchronize_session=False)
+    ).scalar_one()
+    return last - count + 1
+
+
+def append_messages(db: Session, chat_id: int, *messages: dict) -> list:
+    """Inserts the message dicts at the end of the chat. Returns the new ChatMessage rows."""
+    if not messages:
+        return []
+
+    first_seq = _reserve_seqs(db, chat_id, len(messages))
+    rows = [
+        models.ChatMessage(
+            chat_id=chat_id,
+            seq=first_seq + i,
+            **{k: message[k] for k in MESSAGE_FIELDS if k in message},
+        )
+        for i, message in enumerate(messages)
+    ]
+    db.add_all(rows)
+    return rows
+
+
+def replace_message(db: Session, chat_id: int, seq: int, message: dict) -> bool:
+    """
+    Overwrites the message at `seq` in place (used to turn the "processing"
+    placeholder into the real result). Returns False if it no longer exists.
+    """
+    row = db.get(models.ChatMessage, (chat_id, seq))
+    if not row:
+        return False
+
+    for field in MESSAGE_FIELDS:
+        setattr(row, field, message.get(field))
+
+    # Appends bump the chat's change_seq through _reserve_seqs; do the same here
+    # so session-level sync/ETags see the edit too
+    db.execute(
+        update(models.ChatHistory)
+        .where(models.ChatHistory.id == chat_id)
+        .values(change_seq=models.chat_change_seq.next_value())
+        .execution_options(synchronize_session=False)
+    )
+    return True
+
+
+def _priority_score(summary: dict):
+    try:
+        return int(summary.get("priority_score"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _has_red_flags(summary: dict) -> bool:
+    red_flags = str(summary.get("red_flags") or "").strip(" .").lower()
+    return red_flags not in NO_RED_FLAGS
+
+
+def set_summary(history_record: models.ChatHistory, summary: dict):
+    """Stores the AI's triage summary along with its indexed triage columns."""
+    history_record.summary = summary
+    flag_modified(history_record, "summary")
+    if not isinstance(summary, dict):
+        summary = {}
+    history_record.priority_score = _priority_score(summary)
+    history_record.red_flags_present = _has_red_flags(summary)
+    history_record.reviewed = bool(summary.get("reviewed"))
+
+
+def mark_reviewed(history_record: models.ChatHistory):
+    """Takes the session off the unreviewed triage queue."""
+    if isinstance(history_record.summary, dict):
+        history_record.summary["reviewed"] = True
+        flag_modified(history_record, "summary")
+    history_record.reviewed = True
@@ -0,0 +1,130 @@
+# backend/context_service.py
+"""
+Decides what part of a chat is sent to Gemini on each turn.
+
+The prompt is: rolling summary of older turns + the most recent messages
+verbatim, kept under CONTEXT_TOKEN_BUDGET. Messages up to
+ChatHistory.context_summary_seq are already folded into
+ChatHistory.context_summary. Newer messages that slide out of the recent
+window are folded in batches (one extra Gemini call every few turns rather
+than every turn), so prompt size stays flat however long the session runs.
+
+Building the context never calls Gemini: once a fold is due, the saved turn
+queues a "chat.fold_context" job (fold_context() below) and the next turns
+keep using the existing summary until that job has stored the new one.
+"""
+import os
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+import ai_service
+import models
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+# Messages (patient + AI, so two per turn) always kept verbatim, budget permitting
+CONTEXT_RECENT_MESSAGES = int(os.getenv("CONTEXT_RECENT_MESSAGES", "12"))
+# Older messages are only folded once at least this many have piled up
+CONTEXT_FOLD_BATCH = int(os.getenv("CONTEXT_FOLD_BATCH", "8"))
+
+
+def _message_tokens(messages: list) -> int:
+    return ai_service.count_text_tokens(
+        *(ai_service.prompt_text(messages, i) for i in range(len(messages)))
+    )
+
+
+def _recent_window(messages: list, budget: int) -> list:
+    """The newest messages (at most CONTEXT_RECENT_MESSAGES) that fit in `budget`."""
+    window = messages[-CONTEXT_RECENT_MESSAGES:]
+    while len(window) > 1 and _message_tokens(window) > budget:
+        window = window[1:]
+    return window
+
+
+def _split_pending(history_record: models.ChatHistory, messages: list):
+    """
+    Splits the messages not yet in the summary into (pending, recent, older,
+    over_budget): `recent` fits the budget next to the summary, `older` is what
+    slid out of the recent window and is waiting to be folded.
+    """
+    folded_seq = history_record.context_summary_seq or 0
+    pending = [m for m in messages if m.get("seq", 0) > folded_seq]
+
+    budget = CONTEXT_TOKEN_BUDGET - ai_service.count_text_tokens(
+        history_record.context_summary
+    )
+    recent = _recent_window(pending, budget)
+    older = pending[: len(pending) - len(recent)]
+    over_budget = bool(older) and _message_tokens(pending) > budget
+    return pending, recent, older, over_budget
+
+
+def _fold_due(older: list, over_budget: bool) -> bool:
+    # Below a batch (and within budget) a summarization call isn't worth it yet
+    return bool(older) and (len(older) >= CONTEXT_FOLD_BATCH or over_budget)
+
+
+def build_context(db: Session, history_record: models.ChatHistory) -> dict:
+    """
+    Returns the context for the next Gemini call on this chat as keyword
+    arguments for ai_service.get_ai_response(): db_history, context_summary,
+    and the session's documents (for ai_service's context cache).
+    """
+    messages = history_record.messages
+    pending, recent, _, over_budget = _split_pending(history_record, messages)
+    return {
+        # Past the budget, messages still waiting for the fold job are left
+        # out so the prompt stays bounded; until then they're sent as they are
+        "db_history": recent if over_budget else pending,
+        "context_summary": history_record.context_summary,
+        "session_id": history_record.session_id,
+        "documents": [m for m in messages if m.get("is_file")],
+    }
+
+
+def needs_fold(history_record: models.ChatHistory) -> bool:
+    """Whether enough messages slid out of the recent window to queue fold_context()."""
+    _, _, older, over_budget = _split_pending(history_record, history_record.messages)
+    return _fold_due(older, over_budget)
+
+
+def next_fold(history_record: models.ChatHistory):
+    """
+    Summarizes the messages waiting to be folded (one Gemini call). Returns
+    (new summary, seq it covers up to), or None if no fold is due.
+    """
+    _, _, older, over_budget = _split_pending(history_record, history_record.messages)
+    if not _fold_due(older, over_budget):
+        return None
+    summary = ai_service.summarize_conversation(history_record.context_summary, older)
+    return summary, older[-1]["seq"]
+
+
+def fold_context(db: Session, chat_id: int):
+    """
+    Body of the "chat.fold_context" job. Raises on Gemini errors so the queue
+    retries; meanwhile turns go on with the previous summary.
+    """
+    history_record = db.get(models.ChatHistory, chat_id)
+    if not history_record:
+        return
+
+    folded_seq = history_record.context_summary_seq or 0
+    fold = next_fold(history_record)
+    if not fold:
+        # An earlier job already caught up
+        return
+
+    summary, summary_seq = fold
+    # Only applied if no other fold moved the summary on in the meantime
+    db.execute(
+        update(models.ChatHistory)
+        .where(
+            models.ChatHistory.id == chat_id,
+            models.ChatHistory.context_summary_seq == folded_seq,
+        )
+        .values(context_summary=summary, context_summary_seq=summary_seq)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
@@ -0,0 +1,97 @@
+# backend/delivery_service.py
+"""Builds the HTTP response for a stored file: cache lookup, revalidation and byte ranges."""
+import os
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+import http_cache
+import storage_service
+from storage_service import storage
+
+
+def _iter_local_range(path: str, start: int, end: int):
+    for chunk in storage_service.iter_file_range(path, start, end):
+        _record_local_read(len(chunk))
+        yield chunk
+
+
+def _record_local_read(nbytes: int):
+    if storage.cache:
+        storage.cache.record_served(nbytes)
+
+
+def serve_file(
+    request: Request,
+    file_id: str,
+    mime_type: str,
+    etag: str,
+    last_modified: Optional[datetime] = None,
+    cache_control: str = "private, no-cache",
+    not_found_status: int = 500,
+    not_found_detail: str = "Could not retrieve file from Cloud",
+):
+    """
+    Serves `file_id` with ETag/Last-Modified revalidation and single-range support.
+    Files with a local copy (blob cache hit, or the local backend) are sent with
+    FileResponse so the server can use sendfile where it supports it; anything
+    else is streamed from the storage backend.
+    """
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": cache_control,
+    }
+    if last_modified:
+        headers["Last-Modified"] = http_cache.http_date(last_modified)
+
+    # Revalidation: answered without touching storage at all
+    if http_cache.is_not_modified(request.headers, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    local_path = storage.local_path(file_id)
+    range_header = http_cache.range_requested(request.headers, etag)
+
+    if range_header:
+        if local_path:
+            size = os.path.getsize(local_path)
+        else:
+            metadata = storage.stat(file_id)
+            if not metadata:
+                raise HTTPException(status_code=not_found_status, detail=not_found_detail)
+            size = metadata["size"]
+
+        try:
+            byte_range = http_cache.parse_range(range_header, size)
+        except http_cache.RangeNotSatisfiable:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+
+        if byte_range:
+            start, end = byte_range
+            if local_path:
+                file_stream = _iter_local_range(local_path, start, end)
+            else:
+                file_stream = storage.read_range(file_id, start, end)
+                if not file_stream:
+                    raise HTTPException(
+                        status_code=not_found_status, detail=not_found_detail
+                    )
+
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                file_stream, status_code=206, media_type=mime_type, headers=headers
+            )
+
+    if local_path:
+        _record_local_read(os.path.getsize(local_path))
+        return FileResponse(local_path, media_type=mime_type, headers=headers)
+
+    file_stream = storage.stream(file_id)
+    if not file_stream:
+        raise HTTPException(status_code=not_found_status, detail=not_found_detail)
+
+    return StreamingResponse(file_stream, media_type=mime_type, headers=headers)
@@ -1,11 +1,14 @@
 # backend/drive_service.py
 import os
 import json
-import io
+import threading
 from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
+from google.auth.transport.requests import Request, AuthorizedSession
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
+from googleapiclient.http import (
+    MediaFileUpload,
+    MediaIoBaseUpload,
+)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 TOKEN_FILE = os.path.join(BASE_DIR, "token.json")
@@ -32,9 +35,9 @@ def _load_credentials():
         print("Error: No Drive credentials found. Set GOOGLE_DRIVE_TOKEN env var or add token.json.")
         return None
 
-    # Build credentials using only the refresh_token (token=None forces immediate refresh)
-    # This means it always gets a fresh access token in-memory — no stale token issues.
-    creds = Credentials(
+    # Build credentials using only the refresh_token (token=None means the first
+    # call to _get_credentials() fetches a fresh access token in-memory).
+    return Credentials(
         token=None,
         refresh_token=info["refresh_token"],
         token_uri=info["token_uri"],
@@ -43,67 +46,294 @@ def _load_credentials():
         scopes=info["scopes"],
     )
 
-    # Refresh in-memory right now — no disk write required
-    creds.refresh(Request())
-    return creds
+
+# --- PROCESS-WIDE CLIENT CACHE ---
+# Credentials are shared by every thread and only refreshed when the access
+# token is missing or about to expire (google-auth's `valid` already applies a
+# refresh margin before `expiry`). The built service is NOT thread-safe
+# (httplib2 underneath), so each worker thread keeps its own instance built
+# from the shared credentials — the discovery document is only parsed once
+# per thread instead of once per file operation.
+_creds_lock = threading.Lock()
+_credentials = None
+_thread_local = threading.local()
+
+# Simple counters so load tests can check how often we hit the token endpoint
+stats = {"refreshes": 0, "builds": 0}
+
+
+def _get_credentials():
+    global _credentials
+
+    with _creds_lock:
+        if _credentials is None:
+            _credentials = _load_credentials()
+            if _credentials is None:
+                return None
+
+        if not _credentials.valid:
+            _credentials.refresh(Request())
+            stats["refreshes"] += 1
+
+        return _credentials
 
 
 def get_drive_service():
-    """Returns an authenticated Google Drive API service instance."""
+    """Returns an authenticated Google Drive API service instance (cached per thread)."""
     try:
-        creds = _load_credentials()
+        creds = _get_credentials()
         if not creds:
             return None
-        return build("drive", "v3", credentials=creds)
+
+        service = getattr(_thread_local, "service", None)
+        if service is None:
+            service = build("drive", "v3", credentials=creds, cache_discovery=False)
+            _thread_local.service = service
+            with _creds_lock:
+                stats["builds"] += 1
+        return service
     except Exception as e:
         print(f"Drive Auth Error: {e}")
         return None
 
 
+
+# Uploads are sent as a resumable session in chunks of this size.
+# Drive requires every chunk except the last to be a multiple of 256 KiB.
+UPLOAD_CHUNK_GRANULARITY = 256 * 1024
+UPLOAD_CHUNK_SIZE = 32 * UPLOAD_CHUNK_GRANULARITY  # 8 MiB
+
+RESUMABLE_UPLOAD_URL = (
+    "https://www.googleapis.com/upload/drive/v3/files?uploadType=resumable&fields=id"
+)
+
+
+def _execute_upload(service, media, file_name: str):
+    file_metadata = {"name": file_name, "parents": [DRIVE_FOLDER_ID]}
+    request = service.files().create(
+        body=file_metadata, media_body=media, fields="id"
+    )
+
+    file = None
+    while file is None:
+        _, file = request.next_chunk()
+
+    print(f"File Uploaded to Drive. ID: {file.get('id')}")
+    return {"file_id": file.get("id"), "view_link": ""}
+
+
 def upload_to_drive(file_path: str, file_name: str, mime_type: str):
     service = get_drive_service()
     if not service:
         return None
 
     try:
-        file_metadata = {"name": file_name, "parents": [DRIVE_FOLDER_ID]}
-        media = MediaFileUpload(file_path, mimetype=mime_type)
-
-        file = (
-            service.files()
-            .create(body=file_metadata, media_body=media, fields="id")
-            .execute()
+        media = MediaFileUpload(
+            file_path, mimetype=mime_type, chunksize=UPLOAD_CHUNK_SIZE, resumable=True
         )
-
-        print(f"File Uploaded to Drive. ID: {file.get('id')}")
-        return {"file_id": file.get("id"), "view_link": ""}
+        return _execute_upload(service, media, file_name)
 
     except Exception as e:
         print(f"Drive upload error: {e}")
         return None
 
 
-def get_file_stream(file_id: str):
+def upload_stream_to_drive(fileobj, file_name: str, mime_type: str):
+    """
+    Uploads straight from a file-like object (e.g. UploadFile.file) in
+    UPLOAD_CHUNK_SIZE pieces — no intermediate copy on our disk.
+    """
     service = get_drive_service()
     if not service:
         return None
 
     try:
-        request = service.files().get_media(fileId=file_id)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
+        media = MediaIoBaseUpload(
+            fileobj, mimetype=mime_type, chunksize=UPLOAD_CHUNK_SIZE, resumable=True
+        )
+        return _execute_upload(service, media, file_name)
+
+    except Exception as e:
+        print(f"Drive upload error: {e}")
+        return None
+
+
+# --- CLIENT-DRIVEN RESUMABLE SESSIONS ---
+# Used when the browser uploads a large file in several requests: we open a
+# Drive resumable session once and forward each client chunk to it, so a
+# dropped connection only costs the chunk that was in flight.
+def _authorized_session():
+    creds = _get_credentials()
+    if not creds:
+        raise Exception("No Drive credentials available")
+
+    session = getattr(_thread_local, "http_session", None)
+    if session is None:
+        session = AuthorizedSession(creds)
+        _thread_local.http_session = session
+    return session
+
+
+def _committed_offset(response) -> int:
+    # 308 responses carry "Range: bytes=0-N" once any bytes were persisted
+    range_header = response.headers.get("Range")
+    if not range_header:
+        return 0
+    return int(range_header.split("-")[-1]) + 1
 
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
 
-        fh.seek(0)
-        return fh
+def start_resumable_upload(file_name: str, mime_type: str, total_size: int) -> str:
+    """Opens a Drive resumable session and returns its session URI."""
+    response = _authorized_session().post(
+        RESUMABLE_UPLOAD_URL,
+        json={"name": file_name, "parents": [DRIVE_FOLDER_ID]},
+        headers={
+            "X-Upload-Content-Type": mime_type,
+            "X-Upload-Content-Length": str(total_size),
+        },
+    )
+    response.raise_for_status()
+    return response.headers["Location"]
+
+
+def upload_resumable_chunk(session_uri: str, offset: int, data: bytes, total_size: int):
+    """
+    Sends bytes offset..offset+len(data)-1 to the session.
+    Returns (committed_offset, file_id); file_id is None until the upload is complete.
+    """
+    end = offset + len(data) - 1
+    response = _authorized_session().put(
+        session_uri,
+        data=data,
+        headers={"Content-Range": f"bytes {offset}-{end}/{total_size}"},
+    )
+    if response.status_code in (200, 201):
+        return total_size, response.json()["id"]
+    if response.status_code == 308:
+        return _committed_offset(response), None
+    response.raise_for_status()
+    raise Exception(f"Unexpected Drive response: {response.status_code}")
+
+
+def get_resumable_offset(session_uri: str, total_size: int):
+    """Asks Drive how much of the session it has persisted. Returns (offset, file_id)."""
+    response = _authorized_session().put(
+        session_uri, headers={"Content-Range": f"bytes */{total_size}"}
+    )
+    if response.status_code in (200, 201):
+        return total_size, response.json()["id"]
+    if response.status_code == 308:
+        return _committed_offset(response), None
+    response.raise_for_status()
+    raise Exception(f"Unexpected Drive response: {response.status_code}")
+
 
+# Largest piece yielded while streaming a download.
+# Memory per in-flight download is bounded by this value.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+DRIVE_MEDIA_URL = "https://www.googleapis.com/drive/v3/files/{file_id}?alt=media"
+
+
+def _open_media(file_id: str, byte_range=None):
+    """
+    Starts a streaming GET of the file's content, or of bytes
+    byte_range = (start, end) inclusive. Returns (session, response).
+    The session is made for this one download rather than taken from the
+    thread-local clients above: Starlette resumes the generator reading it on
+    whichever threadpool thread is free, and those clients are not thread-safe.
+    """
+    creds = _get_credentials()
+    if not creds:
+        raise Exception("No Drive credentials available")
+
+    headers = {"Range": f"bytes={byte_range[0]}-{byte_range[1]}"} if byte_range else {}
+    session = AuthorizedSession(creds)
+    try:
+        response = session.get(
+            DRIVE_MEDIA_URL.format(file_id=file_id), headers=headers, stream=True
+        )
+        response.raise_for_status()
+    except Exception:
+        session.close()
+        raise
+    return session, response
+
+
+def _start_stream(file_id: str, chunk_size: int, byte_range=None):
+    try:
+        session, response = _open_media(file_id, byte_range)
     except Exception as e:
         print(f"Drive download error: {e}")
         return None
 
+    chunks = response.iter_content(chunk_size)
+    try:
+        first_chunk = next(chunks, b"")
+    except Exception as e:
+        print(f"Drive download error: {e}")
+        response.close()
+        session.close()
+        return None
+
+    return _iter_chunks(session, response, chunks, first_chunk)
+
+
+def get_file_stream(file_id: str, chunk_size: int = DOWNLOAD_CHUNK_SIZE):
+    """
+    Returns a generator that yields the file from Drive chunk by chunk, or None
+    if the download cannot be started. The first chunk is fetched eagerly so
+    callers can still return a proper error before the response has begun.
+    """
+    return _start_stream(file_id, chunk_size)
+
+
+def _iter_chunks(session, response, chunks, first_chunk: bytes):
+    try:
+        yield first_chunk
+        for chunk in chunks:
+            yield chunk
+    except Exception as e:
+        # Headers are already sent — all we can do is cut the stream short
+        print(f"Drive download error mid-stream: {e}")
+    finally:
+        # Also runs when the client disconnects and the generator is closed
+        response.close()
+        session.close()
+
+
+def get_file_metadata(file_id: str):
+    """Returns {"size", "mime_type", "modified_time"} for a Drive file, or None."""
+    service = get_drive_service()
+    if not service:
+        return None
+
+    try:
+        meta = (
+            service.files()
+            .get(fileId=file_id, fields="size, mimeType, modifiedTime")
+            .execute()
+        )
+        return {
+            "size": int(meta.get("size", 0)),
+            "mime_type": meta.get("mimeType"),
+            "modified_time": meta.get("modifiedTime"),
+        }
+
+    except Exception as e:
+        print(f"Drive metadata error: {e}")
+        return None
+
+
+def get_file_range_stream(
+    file_id: str, start: int, end: int, chunk_size: int = DOWNLOAD_CHUNK_SIZE
+):
+    """
+    Like get_file_stream(), but only yields bytes start..end (inclusive),
+    forwarding the range to Drive so we never download more than was asked for.
+    """
+    return _start_stream(file_id, chunk_size, (start, end))
+
 
 def delete_file_from_drive(file_id: str):
     service = get_drive_service()
@@ -0,0 +1,149 @@
+# backend/events_service.py
+"""
+Per-user push events: "media.ready" / "media.failed", "chat.updated",
+"chat.ai_replied" and "prescription.issued". Clients receive them on the
+/ws/events WebSocket (routers/events.py) and re-fetch what changed.
+
+`publish()` can be called from anywhere — request handlers, job threads in
+worker.py, any process. With EVENTS_BACKEND=postgres (the default) it sends a
+Postgres NOTIFY, and every API process's `listener` thread hands the event to
+its local WebSocket subscribers, whichever process produced it.
+EVENTS_BACKEND=local skips Postgres and only reaches subscribers in the
+publishing process (single-process dev setups).
+
+Payloads stay small (ids only): NOTIFY payloads are capped at 8000 bytes.
+"""
+import asyncio
+import json
+import os
+import select
+import threading
+
+from sqlalchemy import text
+
+from db import engine
+
+EVENTS_BACKEND = os.getenv("EVENTS_BACKEND", "postgres").lower()
+EVENTS_CHANNEL = "patient_events"
+LISTEN_POLL_SECONDS = 5
+LISTEN_RETRY_SECONDS = 5
+# Events are dropped for a client that stops reading; it resyncs on reconnect
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class EventBus:
+    """In-process fan-out from any thread to asyncio queues of WebSocket handlers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # user_id -> list of (event loop, asyncio.Queue)
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._subscribers.setdefault(user_id, []).append((loop, queue))
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        with self._lock:
+            remaining = [
+                sub for sub in self._subscribers.get(user_id, []) if sub[1] is not queue
+            ]
+            if remaining:
+                self._subscribers[user_id] = remaining
+            else:
+                self._subscribers.pop(user_id, None)
+
+    def deliver(self, message: dict):
+        with self._lock:
+            targets = list(self._subscribers.get(message.get("user_id"), []))
+        for loop, queue in targets:
+            loop.call_soon_threadsafe(_offer, queue, message)
+
+
+def _offer(queue: asyncio.Queue, message: dict):
+    if not queue.full():
+        queue.put_nowait(message)
+
+
+bus = EventBus()
+
+
+def publish(user_id: int, event: str, **data):
+    """Sends `event` to every open connection of `user_id`. Never raises."""
+    if not user_id:
+        return
+    message = {"user_id": user_id, "event": event, "data": data}
+
+    if EVENTS_BACKEND != "postgres":
+        bus.deliver(message)
+        return
+
+    try:
+        with engine.begin() as conn:
+            conn.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": EVENTS_CHANNEL, "payload": json.dumps(message, default=str)},
+            )
+    except Exception as e:
+        # A lost notification only delays the update until the next sync
+        print(f"Event publish error ({event}): {e}")
+
+
+class Listener:
+    """Background thread relaying NOTIFYs on EVENTS_CHANNEL into `bus`."""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if EVENTS_BACKEND != "postgres" or self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="events-listener", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=LISTEN_POLL_SECONDS + 1)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                print(f"Events listener error: {e}")
+                self._stop.wait(LISTEN_RETRY_SECONDS)
+
+    def _listen(self):
+        # A dedicated connection: LISTEN state must not leak back into the pool
+        pooled = engine.raw_connection()
+        pooled.detach()
+        conn = pooled.dbapi_connection
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {EVENTS_CHANNEL}")
+
+            while not self._stop.is_set():
+                readable, _, _ = select.select([conn], [], [], LISTEN_POLL_SECONDS)
+                if not readable:
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        bus.deliver(json.loads(notify.payload))
+                    except ValueError:
+                        print(f"Events listener: bad payload {notify.payload[:100]}")
+        finally:
+            pooled.close()
+
+
+listener = Listener()
@@ -0,0 +1,106 @@
+# backend/http_cache.py
+"""Small helpers for ETag / Last-Modified revalidation and single byte-range requests."""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional, Tuple
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag derived from values that change whenever the content changes."""
+    raw = ":".join(str(p) for p in parts)
+    return '"' + hashlib.sha1(raw.encode()).hexdigest()[:20] + '"'
+
+
+def http_date(value: Optional[datetime]) -> Optional[str]:
+    if not value:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def is_not_modified(headers, etag: str, last_modified: Optional[datetime]) -> bool:
+    """
+    True when the client's cached copy is still fresh (the request should get a 304).
+    If-None-Match takes precedence over If-Modified-Since, as per RFC 9110.
+    """
+    if_none_match = headers.get("if-none-match")
+    if if_none_match:
+        return _etag_matches(if_none_match, etag)
+
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+
+    return False
+
+
+def range_requested(headers, etag: str) -> Optional[str]:
+    """Returns the Range header if it should be honoured (If-Range must still match)."""
+    range_header = headers.get("range")
+    if not range_header:
+        return None
+
+    if_range = headers.get("if-range")
+    if if_range and if_range.strip() != etag:
+        return None
+
+    return range_header
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parses a single "bytes=start-end" range against a file of `size` bytes.
+    Returns an inclusive (start, end) tuple, or None if the header should be
+    ignored (malformed or multi-range — we then serve the whole file).
+    Raises RangeNotSatisfiable when the caller should answer 416.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+
+    start_str, sep, end_str = spec.strip().partition("-")
+    if not sep:
+        return None
+
+    try:
+        if not start_str:
+            # Suffix range: "bytes=-500" means the last 500 bytes
+            length = int(end_str)
+            start = max(size - length, 0)
+            end = size - 1
+            if length <= 0:
+                raise RangeNotSatisfiable()
+        else:
+            start = int(start_str)
+            end = int(end_str) if end_str else size - 1
+    except ValueError:
+        return None
+
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+
+    return start, min(end, size - 1)
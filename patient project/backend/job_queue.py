@@ -0,0 +1,202 @@
+# backend/job_queue.py
+"""
+Durable background job queue backed by the `jobs` table.
+
+Request handlers only `enqueue()` a row; a separate `python worker.py` process
+claims and runs them. Jobs therefore survive restarts and never compete with
+API requests for the web server's threadpool.
+
+- Claiming uses SELECT ... FOR UPDATE SKIP LOCKED, so any number of worker
+  processes can poll the same table without handing out a job twice.
+- A claimed job is invisible to other workers until `locked_until`
+  (the visibility timeout). If a worker dies mid-job, the job becomes
+  claimable again once that passes, unless it has used up its attempts
+  (a job that keeps killing its worker is failed, not re-run forever).
+- Failures are retried with jittered exponential backoff up to `max_attempts`,
+  then the handler's `on_failure` hook runs and the job is marked failed.
+"""
+import os
+import random
+import traceback
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+import models
+from db import SessionLocal
+
+POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1.0"))
+BACKOFF_BASE_SECONDS = float(os.getenv("JOB_BACKOFF_BASE_SECONDS", "5"))
+BACKOFF_MAX_SECONDS = float(os.getenv("JOB_BACKOFF_MAX_SECONDS", "600"))
+
+
+class JobHandler:
+    def __init__(self, func, concurrency, max_attempts, visibility_timeout, on_failure):
+        self.func = func
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.visibility_timeout = visibility_timeout
+        self.on_failure = on_failure
+
+
+# job_type -> JobHandler, filled in by the @job_handler decorators at import time
+handlers = {}
+
+
+def _env_int(job_type: str, setting: str, default: int) -> int:
+    # e.g. JOB_CONCURRENCY_MEDIA_ANALYZE_DOCUMENT=4
+    key = f"JOB_{setting}_{job_type.upper().replace('.', '_')}"
+    return int(os.getenv(key, default))
+
+
+def job_handler(
+    job_type: str,
+    concurrency: int = 1,
+    max_attempts: int = 3,
+    visibility_timeout: int = 600,
+    on_failure=None,
+):
+    """
+    Registers the decorated function as the handler for `job_type`.
+    The handler is called with the job's payload as keyword arguments and should
+    raise to trigger a retry. `on_failure(error=..., **payload)` runs once all
+    attempts are exhausted. Concurrency and attempts can be overridden per type
+    with JOB_CONCURRENCY_<TYPE> / JOB_MAX_ATTEMPTS_<TYPE>.
+    """
+
+    def decorator(func):
+        handlers[job_type] = JobHandler(
+            func,
+            concurrency=_env_int(job_type, "CONCURRENCY", concurrency),
+            max_attempts=_env_int(job_type, "MAX_ATTEMPTS", max_attempts),
+            visibility_timeout=_env_int(
+                job_type, "VISIBILITY_TIMEOUT", visibility_timeout
+            ),
+            on_failure=on_failure,
+        )
+        return func
+
+    return decorator
+
+
+def enqueue(db: Session, job_type: str, **payload) -> models.Job:
+    """Persists a job; it is picked up by the next idle worker for its type."""
+    handler = handlers.get(job_type)
+    job = models.Job(
+        job_type=job_type,
+        payload=payload,
+        status=models.JobStatus.QUEUED,
+        attempts=0,
+        max_attempts=handler.max_attempts if handler else 3,
+        run_after=datetime.now(timezone.utc),
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def claim(db: Session, job_type: str):
+    """Atomically takes the next runnable job of this type, or returns None."""
+    now = datetime.now(timezone.utc)
+    handler = handlers[job_type]
+
+    while True:
+        job = (
+            db.query(models.Job)
+            .filter(
+                models.Job.job_type == job_type,
+                or_(
+                    (models.Job.status == models.JobStatus.QUEUED)
+                    & (models.Job.run_after <= now),
+                    # Worker died while holding it: visibility timeout expired
+                    (models.Job.status == models.JobStatus.RUNNING)
+                    & (models.Job.locked_until < now),
+                ),
+            )
+            .order_by(models.Job.run_after)
+            .with_for_update(skip_locked=True)
+            .first()
+        )
+        if not job:
+            db.rollback()
+            return None
+
+        exhausted = (job.attempts or 0) >= job.max_attempts
+        if job.status == models.JobStatus.RUNNING and exhausted:
+            # Its last attempt never reported back (the worker died)
+            job.last_error = "Worker stopped during the final attempt"
+            _fail(db, job, handler, job.last_error)
+            continue
+        break
+
+    job.status = models.JobStatus.RUNNING
+    job.attempts = (job.attempts or 0) + 1
+    job.locked_until = now + timedelta(seconds=handler.visibility_timeout)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def _backoff_seconds(attempts: int) -> float:
+    delay = min(BACKOFF_BASE_SECONDS * (2 ** (attempts - 1)), BACKOFF_MAX_SECONDS)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _fail(db: Session, job: models.Job, handler: JobHandler, error: str):
+    """Marks the job failed for good and runs its on_failure hook."""
+    job.status = models.JobStatus.FAILED
+    job.locked_until = None
+    db.commit()
+    if handler.on_failure:
+        try:
+            handler.on_failure(error=error, **dict(job.payload or {}))
+        except Exception as hook_err:
+            print(f"Job {job.id} on_failure hook error: {hook_err}")
+
+
+def run(db: Session, job: models.Job):
+    """Executes a claimed job and records the outcome."""
+    handler = handlers[job.job_type]
+    payload = dict(job.payload or {})
+
+    try:
+        handler.func(**payload)
+    except Exception as e:
+        print(f"Job {job.id} ({job.job_type}) attempt {job.attempts} failed: {e}")
+        job.last_error = traceback.format_exc()[-4000:]
+
+        if job.attempts < job.max_attempts:
+            job.status = models.JobStatus.QUEUED
+            job.run_after = datetime.now(timezone.utc) + timedelta(
+                seconds=_backoff_seconds(job.attempts)
+            )
+            job.locked_until = None
+            db.commit()
+            return
+
+        _fail(db, job, handler, str(e))
+        return
+
+    job.status = models.JobStatus.DONE
+    job.locked_until = None
+    db.commit()
+
+
+def work_loop(job_type: str, stop_event):
+    """One worker thread: claim, run, repeat until `stop_event` is set."""
+    while not stop_event.is_set():
+        db = SessionLocal()
+        try:
+            job = claim(db, job_type)
+            if job:
+                run(db, job)
+                continue
+        except Exception as e:
+            print(f"Job worker error ({job_type}): {e}")
+            db.rollback()
+        finally:
+            db.close()
+
+        stop_event.wait(POLL_INTERVAL_SECONDS)
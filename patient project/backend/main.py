@@ -12,30 +12,46 @@ from contextlib import asynccontextmanager
 from db import engine, SessionLocal
 import models
 
-from routers import auth, chat, user, doctor, media, appointment
+from routers import auth, chat, user, doctor, media, appointment, events, admin
+import events_service
+import audit_service
+import audit_retention_service
+from scheduler_service import scheduler
 from routers.appointment import mark_past_appointments_completed
 
-from apscheduler.schedulers.background import BackgroundScheduler
-
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
 
 
 # ── Scheduler setup ───────────────────────────────────────────────────────────
+# Only the leader process runs these (see scheduler_service.py)
 def run_completion_job():
     db = SessionLocal()
-    mark_past_appointments_completed(db)
+    try:
+        mark_past_appointments_completed(db)
+    finally:
+        db.close()
 
 
-scheduler = BackgroundScheduler()
-scheduler.add_job(run_completion_job, "interval", minutes=1)  # runs every 5 minutes
+scheduler.register("complete_past_appointments", run_completion_job, minutes=1)
+scheduler.register(
+    "audit_log_maintenance", audit_retention_service.run_maintenance, hours=24
+)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Every process needs this month's audit partition before it can log;
+    # archiving old ones is left to the scheduler leader
+    audit_retention_service.ensure_partitions()
     scheduler.start()
+    events_service.listener.start()
+    audit_service.writer.start()
     yield
-    scheduler.shutdown()
+    # Flushes buffered audit entries before the process exits
+    audit_service.writer.stop()
+    events_service.listener.stop()
+    scheduler.stop()
 
 
 app = FastAPI(title="Patient Portal API", lifespan=lifespan)
@@ -46,6 +62,8 @@ app.include_router(user.router)
 app.include_router(doctor.router)
 app.include_router(media.router)
 app.include_router(appointment.router)
+app.include_router(events.router)
+app.include_router(admin.router)
 
 # --- CORS SETTINGS ---
 app.add_middleware(
@@ -54,4 +72,6 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets the frontend read ETags for If-None-Match revalidation of polls
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
@@ -0,0 +1,77 @@
+# backend/media_service.py
+import os
+from sqlalchemy.orm import Session
+import models
+import events_service
+from db import SessionLocal
+from storage_service import storage
+
+PLACEHOLDER_FILE_IDS = ("processing...", "local_error")
+
+
+def find_duplicate_media(db: Session, patient_id: int, content_sha256: str):
+    """
+    Returns this patient's already-processed upload with the same content hash,
+    or None. Uploads that are still processing or failed are never reused.
+    """
+    if not content_sha256:
+        return None
+
+    return (
+        db.query(models.MedicalMedia)
+        .filter(
+            models.MedicalMedia.patient_id == patient_id,
+            models.MedicalMedia.content_sha256 == content_sha256,
+            models.MedicalMedia.processing_status == "ready",
+        )
+        .order_by(models.MedicalMedia.created_at.desc())
+        .first()
+    )
+
+
+def get_media(db: Session, media_id: int):
+    return (
+        db.query(models.MedicalMedia).filter(models.MedicalMedia.id == media_id).first()
+    )
+
+
+def store_pending_upload(
+    db: Session, media_record, temp_path: str, unique_name: str, mime_type: str
+):
+    """
+    Uploads a spilled file for a placeholder record and saves the file ID right
+    away, so a job retried after a later failure (e.g. Gemini) does not upload
+    the same file again.
+    """
+    if media_record.drive_file_id not in PLACEHOLDER_FILE_IDS:
+        return
+
+    drive_data = storage.upload(temp_path, unique_name, mime_type)
+    if not drive_data:
+        raise Exception("Storage upload failed")
+
+    media_record.drive_file_id = drive_data["file_id"]
+    media_record.drive_view_link = f"http://127.0.0.1:8000/media/view/{media_record.id}"
+    db.commit()
+
+
+def remove_temp_file(temp_path: str):
+    if temp_path and os.path.exists(temp_path):
+        os.remove(temp_path)
+
+
+def mark_media_failed(media_id: int, message: str, temp_path: str = None):
+    """Final-failure hook for media jobs: surfaces the error to the patient."""
+    db = SessionLocal()
+    try:
+        media_record = get_media(db, media_id)
+        if media_record:
+            media_record.transcript = message
+            media_record.processing_status = "failed"
+            db.commit()
+            events_service.publish(
+                media_record.patient_id, "media.failed", media_id=media_id
+            )
+    finally:
+        db.close()
+        remove_temp_file(temp_path)
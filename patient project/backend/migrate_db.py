@@ -0,0 +1,269 @@
+# backend/migrate_db.py
+"""
+Brings an existing database up to date with models.py without dropping data.
+`Base.metadata.create_all` (run on startup) only creates missing tables, so
+columns and indexes added to existing tables are applied here. Every step is
+idempotent — safe to run on every deploy.
+
+    python migrate_db.py
+"""
+from sqlalchemy import text
+
+from db import engine
+import models
+import audit_retention_service
+
+MIGRATIONS = [
+    (
+        "Add medical_media.content_sha256",
+        "ALTER TABLE medical_media ADD COLUMN IF NOT EXISTS content_sha256 VARCHAR(64)",
+    ),
+    (
+        "Index medical_media (patient_id, content_sha256)",
+        "CREATE INDEX IF NOT EXISTS ix_medical_media_patient_sha256 "
+        "ON medical_media (patient_id, content_sha256)",
+    ),
+    (
+        "Add medical_media.processing_status",
+        "ALTER TABLE medical_media ADD COLUMN IF NOT EXISTS processing_status "
+        "VARCHAR DEFAULT 'ready'",
+    ),
+    (
+        # Rows from before processing_status defaulted to 'ready'; don't let
+        # duplicate detection reuse their error text or placeholders
+        "Mark old failed/unfinished medical_media rows",
+        "UPDATE medical_media SET processing_status = 'failed' "
+        "WHERE processing_status = 'ready' AND (transcript LIKE 'ERROR%' "
+        "OR drive_file_id IN ('processing...', 'local_error'))",
+    ),
+    (
+        "Add chat_history.message_count",
+        "ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS message_count "
+        "INTEGER NOT NULL DEFAULT 0",
+    ),
+    (
+        "Copy chat_history.messages JSON into chat_messages",
+        "INSERT INTO chat_messages "
+        "(chat_id, seq, sender, text, is_file, file_url, status, timestamp) "
+        "SELECT h.id, m.ord, m.value->>'sender', m.value->>'text', "
+        "COALESCE((m.value->>'is_file')::boolean, false), "
+        "m.value->>'file_url', m.value->>'status', h.created_at "
+        "FROM chat_history h, "
+        "json_array_elements(h.messages) WITH ORDINALITY AS m(value, ord) "
+        "WHERE json_typeof(h.messages) = 'array' "
+        "ON CONFLICT (chat_id, seq) DO NOTHING",
+    ),
+    (
+        "Sync chat_history.message_count with chat_messages",
+        "UPDATE chat_history h SET message_count = sub.max_seq "
+        "FROM (SELECT chat_id, MAX(seq) AS max_seq FROM chat_messages GROUP BY chat_id) sub "
+        "WHERE sub.chat_id = h.id AND h.message_count < sub.max_seq",
+    ),
+    (
+        "Clear migrated chat_history.messages JSON",
+        "UPDATE chat_history SET messages = NULL WHERE messages IS NOT NULL",
+    ),
+    (
+        "Add chat_history.context_summary",
+        "ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS context_summary TEXT",
+    ),
+    (
+        "Add chat_history.context_summary_seq",
+        "ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS context_summary_seq "
+        "INTEGER NOT NULL DEFAULT 0",
+    ),
+    (
+        "Create chat_change_seq",
+        "CREATE SEQUENCE IF NOT EXISTS chat_change_seq",
+    ),
+    (
+        "Add chat_history.change_seq",
+        "ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS change_seq "
+        "BIGINT NOT NULL DEFAULT nextval('chat_change_seq')",
+    ),
+    (
+        "Add chat_messages.change_seq",
+        "ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS change_seq "
+        "BIGINT NOT NULL DEFAULT nextval('chat_change_seq')",
+    ),
+    (
+        "Index chat_history (patient_id, change_seq)",
+        "CREATE INDEX IF NOT EXISTS ix_chat_history_patient_change_seq "
+        "ON chat_history (patient_id, change_seq)",
+    ),
+    (
+        "Index chat_messages (change_seq)",
+        "CREATE INDEX IF NOT EXISTS ix_chat_messages_change_seq "
+        "ON chat_messages (change_seq)",
+    ),
+    (
+        "Index medical_media (patient_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_medical_media_patient_created "
+        "ON medical_media (patient_id, created_at)",
+    ),
+    (
+        "Index chat_history (patient_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_chat_history_patient_created "
+        "ON chat_history (patient_id, created_at)",
+    ),
+    (
+        "Add chat_history.priority_score",
+        "ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS priority_score INTEGER",
+    ),
+    (
+        "Add chat_history.reviewed",
+        "ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS reviewed "
+        "BOOLEAN NOT NULL DEFAULT false",
+    ),
+    (
+        "Add chat_history.red_flags_present",
+        "ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS red_flags_present "
+        "BOOLEAN NOT NULL DEFAULT false",
+    ),
+    (
+        # Same rules as chat_service.set_summary(); rows already backfilled
+        # (or with nothing to extract) are left alone
+        "Backfill chat_history triage columns from summary",
+        "UPDATE chat_history SET "
+        "priority_score = CASE WHEN summary->>'priority_score' ~ '^[0-9]+$' "
+        "THEN (summary->>'priority_score')::int END, "
+        "reviewed = COALESCE(summary->>'reviewed', 'false') = 'true', "
+        "red_flags_present = lower(btrim(COALESCE(summary->>'red_flags', ''), ' .')) "
+        "NOT IN ('', 'none', 'none identified', 'not reported', 'n/a', 'no') "
+        "WHERE summary IS NOT NULL AND priority_score IS NULL "
+        "AND NOT reviewed AND NOT red_flags_present",
+    ),
+    (
+        "Index chat_history unreviewed sessions by priority",
+        "CREATE INDEX IF NOT EXISTS ix_chat_history_unreviewed_priority "
+        "ON chat_history (priority_score DESC NULLS LAST, created_at DESC) "
+        "WHERE summary IS NOT NULL AND NOT reviewed",
+    ),
+    (
+        # Rebuilds an old plain audit_logs table as the monthly-partitioned
+        # one in models.py, with a partition for every month it has rows for
+        "Partition audit_logs by month",
+        """
+        DO $$
+        DECLARE
+            month_start timestamp;
+            last_month timestamp;
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_class
+                WHERE relname = 'audit_logs' AND relkind = 'r'
+            ) THEN
+                RETURN;
+            END IF;
+
+            UPDATE audit_logs SET timestamp = now() WHERE timestamp IS NULL;
+            ALTER TABLE audit_logs RENAME TO audit_logs_unpartitioned;
+
+            CREATE TABLE audit_logs (
+                LIKE audit_logs_unpartitioned INCLUDING DEFAULTS,
+                PRIMARY KEY (id, timestamp)
+            ) PARTITION BY RANGE (timestamp);
+            ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs.id;
+
+            SELECT date_trunc('month', min(timestamp) AT TIME ZONE 'UTC'),
+                   date_trunc('month', now() AT TIME ZONE 'UTC')
+            INTO month_start, last_month
+            FROM audit_logs_unpartitioned;
+            month_start := coalesce(month_start, last_month);
+
+            WHILE month_start <= last_month LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF audit_logs '
+                    'FOR VALUES FROM (%L) TO (%L)',
+                    'audit_logs_' || to_char(month_start, 'YYYY_MM'),
+                    to_char(month_start, 'YYYY-MM-DD') || ' 00:00:00+00',
+                    to_char(month_start + interval '1 month', 'YYYY-MM-DD')
+                        || ' 00:00:00+00'
+                );
+                month_start := month_start + interval '1 month';
+            END LOOP;
+
+            INSERT INTO audit_logs SELECT * FROM audit_logs_unpartitioned;
+            DROP TABLE audit_logs_unpartitioned;
+
+            ALTER TABLE audit_logs
+                ADD FOREIGN KEY (actor_id) REFERENCES users (id),
+                ADD FOREIGN KEY (patient_id) REFERENCES users (id);
+        END
+        $$
+        """,
+    ),
+    (
+        "Index audit_logs (patient_id, timestamp DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_audit_logs_patient_timestamp "
+        "ON audit_logs (patient_id, timestamp DESC)",
+    ),
+    (
+        "Index audit_logs (actor_id, timestamp DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_audit_logs_actor_timestamp "
+        "ON audit_logs (actor_id, timestamp DESC)",
+    ),
+    (
+        "Index audit_logs (action, timestamp DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_audit_logs_action_timestamp "
+        "ON audit_logs (action, timestamp DESC)",
+    ),
+    (
+        "Drop single-column audit_logs indexes (covered by the ones above)",
+        "DROP INDEX IF EXISTS ix_audit_logs_actor_id; "
+        "DROP INDEX IF EXISTS ix_audit_logs_patient_id",
+    ),
+    (
+        "Index appointments still SCHEDULED by scheduled_time",
+        "CREATE INDEX IF NOT EXISTS ix_appointments_scheduled_due "
+        "ON appointments (scheduled_time) WHERE status = 'SCHEDULED'",
+    ),
+    (
+        "Add chat_history.change_xid",
+        "ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS change_xid "
+        "BIGINT NOT NULL DEFAULT txid_current()",
+    ),
+    (
+        "Add chat_messages.change_xid",
+        "ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS change_xid "
+        "BIGINT NOT NULL DEFAULT txid_current()",
+    ),
+    (
+        "Index chat_history (patient_id, change_xid)",
+        "CREATE INDEX IF NOT EXISTS ix_chat_history_patient_change_xid "
+        "ON chat_history (patient_id, change_xid)",
+    ),
+    (
+        "Index chat_messages (change_xid) in place of (change_seq)",
+        "CREATE INDEX IF NOT EXISTS ix_chat_messages_change_xid "
+        "ON chat_messages (change_xid); "
+        "DROP INDEX IF EXISTS ix_chat_messages_change_seq",
+    ),
+    (
+        "Let deleting a file clear upload_sessions.media_id",
+        "ALTER TABLE upload_sessions "
+        "DROP CONSTRAINT IF EXISTS upload_sessions_media_id_fkey, "
+        "ADD CONSTRAINT upload_sessions_media_id_fkey FOREIGN KEY (media_id) "
+        "REFERENCES medical_media (id) ON DELETE SET NULL",
+    ),
+]
+
+
+def run_migrations():
+    # New tables first, so later steps can reference them
+    models.Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as conn:
+        for description, statement in MIGRATIONS:
+            print(f"🛠️  {description}...")
+            conn.execute(text(statement))
+
+    # The partitioned audit_logs table needs this month's partition (and the
+    # next few) before anything can be logged
+    audit_retention_service.ensure_partitions()
+
+    print("✅  Database schema is up to date!")
+
+
+if __name__ == "__main__":
+    run_migrations()
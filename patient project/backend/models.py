@@ -1,6 +1,7 @@
 from sqlalchemy import (
     Column,
     Integer,
+    BigInteger,
     String,
     ForeignKey,
     Enum,
@@ -8,9 +9,11 @@ from sqlalchemy import (
     Text,
     JSON,
     DateTime,
+    Index,
+    Sequence,
 )
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from db import Base
 import enum
 
@@ -28,6 +31,13 @@ class MedicalStatus(str, enum.Enum):
     PAST_RECORD = "past_record"
 
 
+class JobStatus(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
 # --- USERS TABLE ---
 class User(Base):
     __tablename__ = "users"
@@ -79,11 +89,95 @@ class MedicalMedia(Base):
     drive_view_link = Column(String)
     transcript = Column(Text, nullable=True)
 
+    # "processing" while a background job works on it, then "ready" or "failed"
+    processing_status = Column(String, default="ready", server_default="ready")
+
+    # SHA-256 of the uploaded bytes, so a patient re-uploading the same report
+    # reuses the stored file and its analysis instead of paying for both again
+    content_sha256 = Column(String(64), nullable=True)
+
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Matches User.media
     patient = relationship("User", back_populates="media")
 
+    __table_args__ = (
+        Index("ix_medical_media_patient_sha256", "patient_id", "content_sha256"),
+        # Doctor timeline: newest-first keyset pages per patient
+        Index("ix_medical_media_patient_created", "patient_id", "created_at"),
+    )
+
+
+# --- BACKGROUND JOBS ---
+# Durable queue consumed by worker.py (see job_queue.py)
+class Job(Base):
+    __tablename__ = "jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    job_type = Column(String, index=True)
+    payload = Column(JSON)
+
+    status = Column(Enum(JobStatus), default=JobStatus.QUEUED)
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+
+    # Not claimable before this (used for retry backoff)
+    run_after = Column(DateTime(timezone=True), server_default=func.now())
+    # Visibility timeout: while RUNNING, other workers leave it alone until then
+    locked_until = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+    __table_args__ = (Index("ix_jobs_claim", "job_type", "status", "run_after"),)
+
+
+# --- RESUMABLE UPLOAD SESSIONS ---
+# One row per client-driven chunked upload, so an interrupted upload can be
+# resumed (even after a server restart) from the last committed byte.
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+    id = Column(String, primary_key=True, index=True)
+    patient_id = Column(Integer, ForeignKey("users.id"), index=True)
+
+    file_name = Column(String)
+    mime_type = Column(String)
+    total_size = Column(BigInteger)
+    received_bytes = Column(BigInteger, default=0)
+
+    # Which storage backend owns the session and its reference there
+    # (Drive resumable session URI, or the local partial-file ID)
+    backend = Column(String)
+    backend_session = Column(Text)
+
+    # Filled in once the last chunk lands and the media record is created
+    # (cleared again if the patient deletes that file)
+    media_id = Column(
+        Integer, ForeignKey("medical_media.id", ondelete="SET NULL"), nullable=True
+    )
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+# Bumped on every insert/update of a chat or one of its messages (session
+# ETags and the chat index are derived from it)
+chat_change_seq = Sequence("chat_change_seq", metadata=Base.metadata)
+
+
+# Id of the transaction that last wrote a chat or message row. Unlike
+# change_seq it can be compared with a snapshot's xmin, so GET
+# /users/me/chats/sync can't miss a write that commits out of order.
+def _change_xid_column(**kwargs):
+    return Column(
+        BigInteger,
+        server_default=func.txid_current(),
+        onupdate=func.txid_current(),
+        nullable=False,
+        **kwargs,
+    )
+
 
 # --- CHAT HISTORY TABLE ---
 class ChatHistory(Base):
@@ -92,17 +186,104 @@ class ChatHistory(Base):
     patient_id = Column(Integer, ForeignKey("users.id"))
     session_id = Column(String, index=True)
 
-    # Stores the raw conversation (User: Hi, AI: Hello...)
-    messages = Column(JSON)
+    # Old storage for the conversation (one JSON array rewritten on every turn).
+    # Only read by migrate_db.py, which moves it into chat_messages.
+    legacy_messages = Column("messages", JSON, nullable=True)
+
+    # Last seq handed out in chat_messages (see chat_service.append_messages)
+    message_count = Column(Integer, default=0, server_default="0", nullable=False)
+
+    # Rolling summary of the turns that no longer fit in the AI prompt
+    # (see context_service.py); covers every message with seq <= context_summary_seq
+    context_summary = Column(Text, nullable=True)
+    context_summary_seq = Column(Integer, default=0, server_default="0", nullable=False)
 
     # NEW: Stores the final structured report for the doctor
     # This will be NULL until the patient says "SUMMARIZE"
     summary = Column(JSON, nullable=True)
 
+    # Copies of summary fields the doctor's triage queue sorts and filters on,
+    # kept in step by chat_service.set_summary() / mark_reviewed()
+    priority_score = Column(Integer, nullable=True)
+    reviewed = Column(Boolean, default=False, server_default="false", nullable=False)
+    red_flags_present = Column(
+        Boolean, default=False, server_default="false", nullable=False
+    )
+
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    change_seq = Column(
+        BigInteger,
+        server_default=chat_change_seq.next_value(),
+        onupdate=chat_change_seq.next_value(),
+        nullable=False,
+    )
+    change_xid = _change_xid_column()
 
     # Matches User.chat_history
     patient = relationship("User", back_populates="chat_history")
+    message_rows = relationship(
+        "ChatMessage", order_by="ChatMessage.seq", back_populates="chat"
+    )
+
+    @property
+    def messages(self) -> list:
+        """The raw conversation (User: Hi, AI: Hello...) as a list of dicts."""
+        return [row.to_dict() for row in self.message_rows]
+
+    __table_args__ = (
+        Index("ix_chat_history_patient_change_seq", "patient_id", "change_seq"),
+        Index("ix_chat_history_patient_change_xid", "patient_id", "change_xid"),
+        Index("ix_chat_history_patient_created", "patient_id", "created_at"),
+        # "Most urgent unreviewed sessions first" is a plain index scan
+        Index(
+            "ix_chat_history_unreviewed_priority",
+            priority_score.desc().nulls_last(),
+            created_at.desc(),
+            postgresql_where=(summary.isnot(None) & ~reviewed),
+        ),
+    )
+
+
+# --- CHAT MESSAGES TABLE ---
+# Append-only: one row per message, so a turn is an INSERT instead of a rewrite
+# of the whole conversation.
+class ChatMessage(Base):
+    __tablename__ = "chat_messages"
+    chat_id = Column(Integer, ForeignKey("chat_history.id"), primary_key=True)
+    seq = Column(Integer, primary_key=True)
+
+    sender = Column(String)  # "patient", "ai" or "system"
+    text = Column(Text)
+    is_file = Column(Boolean, default=False)
+    file_url = Column(String, nullable=True)
+    # "processing" on the placeholder shown while an upload is analyzed
+    status = Column(String, nullable=True)
+
+    timestamp = Column(DateTime(timezone=True), server_default=func.now())
+    change_seq = Column(
+        BigInteger,
+        server_default=chat_change_seq.next_value(),
+        onupdate=chat_change_seq.next_value(),
+        nullable=False,
+    )
+    change_xid = _change_xid_column(index=True)
+
+    # Matches ChatHistory.message_rows
+    chat = relationship("ChatHistory", back_populates="message_rows")
+
+    def to_dict(self) -> dict:
+        message = {
+            "seq": self.seq,
+            "sender": self.sender,
+            "text": self.text,
+            "timestamp": self.timestamp,
+        }
+        if self.is_file:
+            message["is_file"] = True
+            message["file_url"] = self.file_url
+        if self.status:
+            message["status"] = self.status
+        return message
 
 
 # Add this enum to your other enums at the top
@@ -132,17 +313,36 @@ class Appointment(Base):
     patient = relationship("User", foreign_keys=[patient_id])
     doctor = relationship("User", foreign_keys=[doctor_id])
 
+    __table_args__ = (
+        # Only still-scheduled appointments, which is all the completion job
+        # looks at (the Enum column stores member names)
+        Index(
+            "ix_appointments_scheduled_due",
+            "scheduled_time",
+            postgresql_where=text("status = 'SCHEDULED'"),
+        ),
+    )
+
 
 class AuditLog(Base):
     __tablename__ = "audit_logs"
-
-    id = Column(Integer, primary_key=True, index=True)
+    # One partition per month, managed by audit_retention_service.py. Postgres
+    # needs the partition key in the primary key, hence (id, timestamp).
+    __table_args__ = (
+        # The filters of /admin/audit, newest first
+        Index("ix_audit_logs_patient_timestamp", "patient_id", text("timestamp DESC")),
+        Index("ix_audit_logs_actor_timestamp", "actor_id", text("timestamp DESC")),
+        Index("ix_audit_logs_action_timestamp", "action", text("timestamp DESC")),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
 
     # 'actor_id' is the person performing the action (usually the Doctor)
-    actor_id = Column(Integer, ForeignKey("users.id"), index=True)
+    actor_id = Column(Integer, ForeignKey("users.id"))
 
     # 'patient_id' is the person whose data is being accessed
-    patient_id = Column(Integer, ForeignKey("users.id"), index=True)
+    patient_id = Column(Integer, ForeignKey("users.id"))
 
     # What did they do? (e.g., "VIEWED_TIMELINE", "DOWNLOADED_PRESCRIPTION")
     action = Column(String)
@@ -153,7 +353,9 @@ class AuditLog(Base):
     # The ID of the specific file or chat they looked at
     resource_id = Column(String, nullable=True)
 
-    timestamp = Column(DateTime(timezone=True), server_default=func.now())
+    timestamp = Column(
+        DateTime(timezone=True), server_default=func.now(), primary_key=True
+    )
 
     # Relationships so we can easily join user data later
     actor = relationship("User", foreign_keys=[actor_id])
@@ -1,5 +1,6 @@
 from db import engine
 from models import Base
+import audit_retention_service
 
 # This command deletes ALL tables in your database
 print("⚠️  Dropping old tables...")
@@ -9,4 +10,5 @@ print("✅  Old tables dropped.")
 # This command recreates them with the NEW columns
 print("🛠️  Recreating tables with new schema...")
 Base.metadata.create_all(bind=engine)
+audit_retention_service.ensure_partitions()
 print("✅  Database is now fresh and ready!")
\ No newline at end of file
@@ -0,0 +1,190 @@
+# backend/routers/admin.py
+import csv
+import io
+import json
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import Session
+
+import ai_service
+import audit_service
+import models
+import schemas
+from db import engine, get_db
+from security import get_current_admin
+from routers.appointment import completion_metrics
+from scheduler_service import scheduler
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["Admin"],
+    dependencies=[Depends(get_current_admin)],
+)
+
+AUDIT_COLUMNS = (
+    "id",
+    "timestamp",
+    "actor_id",
+    "patient_id",
+    "action",
+    "resource_type",
+    "resource_id",
+)
+# Rows fetched from the server-side cursor (and written out) at a time
+EXPORT_CHUNK_ROWS = 1000
+
+
+def _audit_cursor(entry) -> str:
+    return f"{entry.timestamp.isoformat()}|{entry.id}"
+
+
+def _parse_audit_cursor(cursor: str):
+    """"<timestamp ISO>|<id>" -> (timestamp, id)"""
+    try:
+        timestamp, entry_id = cursor.rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(entry_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid audit cursor")
+
+
+def _audit_query(
+    patient_id: Optional[int],
+    actor_id: Optional[int],
+    action: Optional[str],
+    since: Optional[datetime],
+    until: Optional[datetime],
+):
+    """
+    Audit rows matching the filters, newest first. Each filter column leads one
+    of the (column, timestamp DESC) indexes, and a time range keeps the scan to
+    the matching monthly partitions.
+    """
+    log = models.AuditLog
+    query = select(*(getattr(log, c) for c in AUDIT_COLUMNS))
+    if patient_id is not None:
+        query = query.where(log.patient_id == patient_id)
+    if actor_id is not None:
+        query = query.where(log.actor_id == actor_id)
+    if action:
+        query = query.where(log.action == action)
+    if since:
+        query = query.where(log.timestamp >= since)
+    if until:
+        query = query.where(log.timestamp < until)
+    return query.order_by(log.timestamp.desc(), log.id.desc())
+
+
+@router.get("/audit", response_model=List[schemas.AuditLogRead])
+def get_audit_log(
+    response: Response,
+    patient_id: Optional[int] = None,
+    actor_id: Optional[int] = None,
+    action: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    before: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    current_admin: schemas.TokenData = Depends(get_current_admin),
+):
+    """
+    Audit entries, newest first. `since` is inclusive and `until` exclusive.
+    Page with `before` (the X-Next-Cursor header of the previous page).
+    """
+    audit_service.log_action(
+        db=db,
+        actor_id=current_admin.user_id,
+        patient_id=patient_id,
+        action="VIEWED_AUDIT_LOG",
+    )
+
+    query = _audit_query(patient_id, actor_id, action, since, until)
+    if before:
+        c_timestamp, c_id = _parse_audit_cursor(before)
+        query = query.where(
+            tuple_(models.AuditLog.timestamp, models.AuditLog.id)
+            < tuple_(c_timestamp, c_id)
+        )
+
+    entries = db.execute(query.limit(limit)).all()
+    if len(entries) == limit:
+        response.headers["X-Next-Cursor"] = _audit_cursor(entries[-1])
+    return entries
+
+
+def _export_rows(query, export_format: str):
+    # Own connection: the response body is streamed after the request's
+    # session is gone. stream_results keeps a server-side cursor, so only
+    # one chunk of rows is in memory at a time.
+    with engine.connect() as conn:
+        result = conn.execution_options(
+            stream_results=True, yield_per=EXPORT_CHUNK_ROWS
+        ).execute(query)
+
+        if export_format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(AUDIT_COLUMNS)
+            for rows in result.partitions():
+                writer.writerows(
+                    [row.id, row.timestamp.isoformat(), *row[2:]] for row in rows
+                )
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue()
+        else:
+            for rows in result.partitions():
+                yield "".join(
+                    json.dumps(dict(row._mapping), default=str) + "\n" for row in rows
+                )
+
+
+@router.get("/audit/export")
+def export_audit_log(
+    patient_id: Optional[int] = None,
+    actor_id: Optional[int] = None,
+    action: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    db: Session = Depends(get_db),
+    current_admin: schemas.TokenData = Depends(get_current_admin),
+):
+    """Every matching entry as NDJSON or CSV, streamed row chunk by row chunk."""
+    audit_service.log_action(
+        db=db,
+        actor_id=current_admin.user_id,
+        patient_id=patient_id,
+        action="EXPORTED_AUDIT_LOG",
+        resource_type=export_format,
+    )
+
+    query = _audit_query(patient_id, actor_id, action, since, until)
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        _export_rows(query, export_format),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="audit_log.{export_format}"'
+        },
+    )
+
+
+@router.get("/metrics")
+def get_metrics():
+    """In-process counters of this API worker (each process keeps its own)."""
+    return {
+        "ai": ai_service.get_metrics(),
+        "appointment_completion": completion_metrics,
+        "audit_writer": {
+            "sync_writes": audit_service.writer.sync_writes,
+            "dropped": audit_service.writer.dropped,
+        },
+        "scheduler": scheduler.metrics(),
+    }
@@ -9,8 +9,9 @@ import calendar_service  # <-- IMPORT OUR NEW SERVICE
 from db import get_db
 from security import get_current_user, get_current_doctor
 from datetime import timedelta
-from sqlalchemy import and_
+from sqlalchemy import and_, update
 from datetime import datetime, timezone
+import time
 
 
 router = APIRouter(prefix="/appointments", tags=["Appointments & Scheduling"])
@@ -188,20 +189,45 @@ def cancel_appointment(
     return appointment
 
 
+# Exposed on /admin/metrics
+completion_metrics = {
+    "runs": 0,
+    "completed_total": 0,
+    "last_completed": 0,
+    "last_run_at": None,
+    "last_duration_ms": None,
+}
+
+
 def mark_past_appointments_completed(db: Session):
     """Called by the scheduler. Marks any SCHEDULED appointment whose
     scheduled_time is in the past as COMPLETED."""
+    started = time.monotonic()
     now = datetime.now(timezone.utc)
-    updated = (
-        db.query(models.Appointment)
-        .filter(
-            models.Appointment.status == models.AppointmentStatus.SCHEDULED,
-            models.Appointment.scheduled_time < now,
+    # One set-based UPDATE (served by ix_appointments_scheduled_due) instead of
+    # loading every overdue appointment into the session
+    completed_ids = (
+        db.execute(
+            update(models.Appointment)
+            .where(
+                models.Appointment.status == models.AppointmentStatus.SCHEDULED,
+                models.Appointment.scheduled_time < now,
+            )
+            .values(status=models.AppointmentStatus.COMPLETED)
+            .returning(models.Appointment.id)
+            .execution_options(synchronize_session=False)
         )
+        .scalars()
         .all()
     )
-    for appt in updated:
-        appt.status = models.AppointmentStatus.COMPLETED
-    if updated:
-        db.commit()
-    db.close()
\ No newline at end of file
+    db.commit()
+
+    completion_metrics["runs"] += 1
+    completion_metrics["completed_total"] += len(completed_ids)
+    completion_metrics["last_completed"] = len(completed_ids)
+    completion_metrics["last_run_at"] = now.isoformat()
+    completion_metrics["last_duration_ms"] = round(
+        (time.monotonic() - started) * 1000, 1
+    )
+    if completed_ids:
+        print(f"Marked {len(completed_ids)} past appointment(s) completed")
@@ -6,84 +6,268 @@ from fastapi import (
     UploadFile,
     File,
     Form,
-    BackgroundTasks,
+    Request,
 )
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy.orm.attributes import flag_modified
-import shutil
+import io
 import os
+import json
 import uuid
 
 import models
 import schemas
 import ai_service
-import drive_service
-from db import get_db
+import chat_service
+import context_service
+import storage_service
+import media_service
+import job_queue
+import events_service
+from db import get_db, SessionLocal
 from security import get_current_user
 
 # The prefix "/chat" means every route in here automatically starts with /chat
 router = APIRouter(prefix="/chat", tags=["AI Chat"])
 
 
-@router.post("/")
-def chat_with_doctor(
-    request: schemas.ChatRequest,
-    db: Session = Depends(get_db),
-    current_user: schemas.TokenData = Depends(get_current_user),
-):
-    secure_user_id = current_user.user_id
+def _too_many_requests(error: ai_service.AIOverloadedError):
+    # Load shedding from the AI admission controller — the client should back off
+    return HTTPException(
+        status_code=429,
+        detail=str(error),
+        headers={"Retry-After": str(int(error.retry_after))},
+    )
 
-    # 1. Fetch History OR Create a new one
+
+def _load_chat_history(db: Session, session_id: str, user_id: int):
+    """
+    Fetches the session (creating it if new) and returns (record, context),
+    `context` being the AI context for the next turn (see context_service).
+    """
     history_record = (
         db.query(models.ChatHistory)
-        .filter(models.ChatHistory.session_id == request.session_id)
+        .filter(models.ChatHistory.session_id == session_id)
         .first()
     )
 
     if not history_record:
-        messages = []
-        history_record = models.ChatHistory(
-            patient_id=secure_user_id, session_id=request.session_id, messages=messages
-        )
+        history_record = models.ChatHistory(patient_id=user_id, session_id=session_id)
         db.add(history_record)
         db.commit()
         db.refresh(history_record)
-    else:
-        if history_record.patient_id != secure_user_id:
-            raise HTTPException(
-                status_code=403, detail="Not authorized to access this chat"
-            )
-        messages = list(history_record.messages) if history_record.messages else []
+        return history_record, {"db_history": [], "session_id": session_id}
 
-    # 2. Call AI
-    # (Gemini already knows about uploaded files because the background
-    # task injects the file transcripts directly into the 'messages' array!)
-    ai_response_text = ai_service.get_ai_response(messages, request.message)
+    if history_record.patient_id != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this chat")
+    return history_record, context_service.build_context(db, history_record)
 
-    # 3. Intercept the SUMMARIZE request
-    is_summary_request = (
-        "SUMMARIZE" in request.message.upper() or "SUMMARY" in request.message.upper()
-    )
 
-    if is_summary_request:
+def _is_summary_request(message: str) -> bool:
+    return "SUMMARIZE" in message.upper() or "SUMMARY" in message.upper()
+
+
+def _save_chat_turn(
+    db: Session, history_record, user_message: str, ai_response_text: str
+) -> str:
+    """Stores the summary (if one was asked for) and both messages. Returns the reply to show."""
+    # Intercept the SUMMARIZE request
+    if _is_summary_request(user_message):
         summary_json = ai_service.clean_ai_json(ai_response_text)
         if summary_json:
-            history_record.summary = summary_json
-            flag_modified(history_record, "summary")
+            chat_service.set_summary(history_record, summary_json)
+            # The session is done — free its cached document context
+            ai_service.evict_session_cache(history_record.session_id)
             # Replace raw JSON with a friendly UI message
             ai_response_text = "I have successfully generated a clinical summary of this session. Your doctor can now review it on their dashboard."
 
-    # 4. Save messages to DB
-    messages.append({"sender": "patient", "text": request.message})
-    messages.append({"sender": "ai", "text": ai_response_text})
-
-    history_record.messages = messages
-    flag_modified(history_record, "messages")
+    chat_service.append_messages(
+        db,
+        history_record.id,
+        {"sender": "patient", "text": user_message},
+        {"sender": "ai", "text": ai_response_text},
+    )
     db.commit()
+    _queue_context_fold(db, history_record)
+    return ai_response_text
+
+
+def _queue_context_fold(db: Session, history_record):
+    # Summarizing older turns is a Gemini call of its own — keep it off the
+    # request path (the next turns use the current summary until it's done)
+    if context_service.needs_fold(history_record):
+        job_queue.enqueue(db, "chat.fold_context", chat_id=history_record.id)
+
+
+@job_queue.job_handler("chat.fold_context", concurrency=1)
+def fold_chat_context_in_background(chat_id: int):
+    db = SessionLocal()
+    try:
+        context_service.fold_context(db, chat_id)
+    finally:
+        db.close()
+
+
+@router.post("/")
+async def chat_with_doctor(
+    request: schemas.ChatRequest,
+    db: Session = Depends(get_db),
+    current_user: schemas.TokenData = Depends(get_current_user),
+):
+    # Async endpoint: the multi-second Gemini round-trip is awaited on the event
+    # loop instead of pinning one of the ~40 threadpool workers. The (short,
+    # blocking) DB work is offloaded to the threadpool.
+
+    # 1. Fetch History OR Create a new one
+    history_record, context = await run_in_threadpool(
+        _load_chat_history, db, request.session_id, current_user.user_id
+    )
+
+    # 2. Call AI
+    # (Gemini already knows about uploaded files because the background
+    # job injects the file transcripts directly into the chat's messages!)
+    try:
+        ai_response_text = await ai_service.get_ai_response_async(
+            new_user_message=request.message, **context
+        )
+    except ai_service.AIOverloadedError as e:
+        raise _too_many_requests(e)
+
+    # 3. Save summary + messages to DB
+    ai_response_text = await run_in_threadpool(
+        _save_chat_turn, db, history_record, request.message, ai_response_text
+    )
 
     return {"response": ai_response_text}
 
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _persist_streamed_turn(history_id: int, user_message: str, ai_response_text: str):
+    # The stream outlives the request's DB session, so it gets its own
+    db = SessionLocal()
+    try:
+        history_record = (
+            db.query(models.ChatHistory).filter(models.ChatHistory.id == history_id).first()
+        )
+        return _save_chat_turn(db, history_record, user_message, ai_response_text)
+    finally:
+        db.close()
+
+
+@router.post("/stream")
+async def stream_chat_with_doctor(
+    request: schemas.ChatRequest,
+    http_request: Request,
+    db: Session = Depends(get_db),
+    current_user: schemas.TokenData = Depends(get_current_user),
+):
+    """
+    Same as POST /chat/ but relays the reply as Server-Sent Events:
+      event: token  data: {"text": "..."}      (one per streamed delta)
+      event: done   data: {"response": "..."}  (final text, after it is saved)
+      event: error  data: {"detail": "..."}
+    The turn is only persisted once the stream completes.
+    """
+    history_record, context = await run_in_threadpool(
+        _load_chat_history, db, request.session_id, current_user.user_id
+    )
+    history_id = history_record.id
+
+    try:
+        tokens = await ai_service.open_ai_stream(
+            new_user_message=request.message, **context
+        )
+    except ai_service.AIOverloadedError as e:
+        raise _too_many_requests(e)
+    except Exception as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"System is currently busy. Please try again in a moment. ({str(e)})",
+        )
+
+    # A summary reply is raw JSON — don't stream it into the chat bubble
+    hide_tokens = _is_summary_request(request.message)
+
+    async def event_stream():
+        parts = []
+        try:
+            async for text in tokens:
+                if await http_request.is_disconnected():
+                    # finally below closes the upstream Gemini stream
+                    return
+                parts.append(text)
+                if not hide_tokens:
+                    yield _sse("token", {"text": text})
+
+            final_text = await run_in_threadpool(
+                _persist_streamed_turn, history_id, request.message, "".join(parts)
+            )
+            yield _sse("done", {"response": final_text})
+
+        except Exception as e:
+            print(f"Chat stream error: {e}")
+            yield _sse("error", {"detail": "The AI reply was interrupted. Please try again."})
+        finally:
+            await tokens.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _chat_upload_failed(
+    error: str,
+    media_id: int,
+    temp_path: str,
+    session_id: str,
+    filename: str,
+    placeholder_seq: int = None,
+    **_,
+):
+    media_service.mark_media_failed(
+        media_id, f"ERROR PROCESSING FILE: {error}", temp_path
+    )
+
+    # Replace the "processing" bubble so the chat doesn't spin forever
+    db = SessionLocal()
+    try:
+        history = (
+            db.query(models.ChatHistory)
+            .filter(models.ChatHistory.session_id == session_id)
+            .first()
+        )
+        if history:
+            _replace_placeholder(
+                db,
+                history.id,
+                placeholder_seq,
+                {"sender": "system", "text": f"Could not analyze {filename}. Please try uploading it again."},
+            )
+            db.commit()
+            events_service.publish(
+                history.patient_id, "chat.updated", session_id=session_id
+            )
+    finally:
+        db.close()
+
+
+def _replace_placeholder(db: Session, chat_id: int, placeholder_seq, message: dict):
+    # Jobs queued before placeholders had a seq fall back to appending
+    if placeholder_seq is None or not chat_service.replace_message(
+        db, chat_id, placeholder_seq, message
+    ):
+        chat_service.append_messages(db, chat_id, message)
+
+
+@job_queue.job_handler(
+    "chat.analyze_upload", concurrency=2, on_failure=_chat_upload_failed
+)
 def process_chat_upload_in_background(
     temp_path: str,
     unique_name: str,
@@ -91,28 +275,36 @@ def process_chat_upload_in_background(
     media_id: int,
     session_id: str,
     filename: str,
+    placeholder_seq: int = None,
 ):
-    db = next(get_db())
+    """
+    `temp_path` is None when the upload was a duplicate of an already analyzed
+    file (`media_id` then points at that record): only the chat part runs.
+    """
+    db = SessionLocal()
     try:
-        # 1. Upload & Analyze
-        drive_data = drive_service.upload_to_drive(
-            temp_path, unique_name, file_content_type
-        )
-        analysis_text = ai_service.analyze_medical_image(temp_path)
-
-        # 2. Update Media DB
-        media_record = (
-            db.query(models.MedicalMedia)
-            .filter(models.MedicalMedia.id == media_id)
-            .first()
-        )
-        if media_record:
-            media_record.drive_file_id = drive_data["file_id"]
-            media_record.drive_view_link = (
-                f"http://127.0.0.1:8000/media/view/{media_id}"
+        media_record = media_service.get_media(db, media_id)
+        if not media_record:
+            media_service.remove_temp_file(temp_path)
+            return
+
+        if temp_path:
+            # 1. Upload & Analyze (raising here lets the queue retry)
+            media_service.store_pending_upload(
+                db, media_record, temp_path, unique_name, file_content_type
             )
+            analysis_text = ai_service.analyze_medical_image(temp_path)
+
+            # 2. Update Media DB
             media_record.transcript = analysis_text
+            media_record.processing_status = "ready"
             db.commit()
+            media_service.remove_temp_file(temp_path)
+            events_service.publish(
+                media_record.patient_id, "media.ready", media_id=media_id
+            )
+        else:
+            analysis_text = media_record.transcript
 
         # 3. Inject the result into the Chat History
         history = (
@@ -134,35 +326,35 @@ def process_chat_upload_in_background(
                 "file_url": media_record.drive_view_link,
             }
 
-            # Remove the "processing" message we added earlier, append the real one
-            current_messages = list(history.messages) if history.messages else []
-            if current_messages and current_messages[-1].get("status") == "processing":
-                current_messages.pop()
+            # Turn the "processing" message we added earlier into the real one
+            _replace_placeholder(db, history.id, placeholder_seq, file_message)
+            db.commit()
+            events_service.publish(
+                history.patient_id, "chat.updated", session_id=session_id
+            )
 
-            current_messages.append(file_message)
             try:
                 ai_reply = ai_service.get_ai_response(
-                    current_messages,
-                    "I have just uploaded the file above. Please review the extracted details or visual analysis, acknowledge them, and ask me any necessary follow-up questions to continue our consultation."
+                    new_user_message="I have just uploaded the file above. Please review the extracted details or visual analysis, acknowledge them, and ask me any necessary follow-up questions to continue our consultation.",
+                    **context_service.build_context(db, history),
+                )
+                chat_service.append_messages(
+                    db, history.id, {"sender": "ai", "text": ai_reply}
+                )
+                db.commit()
+                _queue_context_fold(db, history)
+                events_service.publish(
+                    history.patient_id, "chat.ai_replied", session_id=session_id
                 )
-                current_messages.append({"sender": "ai", "text": ai_reply})
             except Exception as ai_err:
                 print(f"AI Failed to reply to uploaded file: {ai_err}")
-            history.messages = current_messages
-            flag_modified(history, "messages")
-            db.commit()
 
-    except Exception as e:
-        print(f"Background Chat Upload Error: {e}")
     finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
         db.close()
 
 
 @router.post("/upload")
 async def upload_chat_attachment(
-    background_tasks: BackgroundTasks,  # <-- Inject BackgroundTasks
     file: UploadFile = File(...),
     session_id: str = Form(...),
     db: Session = Depends(get_db),
@@ -180,24 +372,33 @@ async def upload_chat_attachment(
 
     file_ext = file.filename.split(".")[-1]
     unique_name = f"chat_upload_{uuid.uuid4()}.{file_ext}"
-    temp_path = f"temp_{unique_name}"
-
-    # 1. Save locally instantly
-    with open(temp_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    # 2. Create placeholder in Media DB
-    new_media = models.MedicalMedia(
-        patient_id=secure_user_id,
-        file_name=file.filename,
-        file_type="image",
-        drive_file_id="processing...",
-        drive_view_link="",
-        transcript="Analyzing file...",
+
+    # 1. Spill to managed temp dir — Gemini analysis needs a real file after we return
+    temp_path, content_sha256 = await run_in_threadpool(
+        storage_service.spill_to_temp, file.file, f".{file_ext}"
     )
-    db.add(new_media)
-    db.commit()
-    db.refresh(new_media)
+
+    # 2. Reuse an identical, already analyzed upload — or create a placeholder
+    duplicate = media_service.find_duplicate_media(db, secure_user_id, content_sha256)
+    if duplicate:
+        os.remove(temp_path)
+        temp_path = None
+        media_id = duplicate.id
+    else:
+        new_media = models.MedicalMedia(
+            patient_id=secure_user_id,
+            file_name=file.filename,
+            file_type="image",
+            drive_file_id="processing...",
+            drive_view_link="",
+            transcript="Analyzing file...",
+            processing_status="processing",
+            content_sha256=content_sha256,
+        )
+        db.add(new_media)
+        db.commit()
+        db.refresh(new_media)
+        media_id = new_media.id
 
     # 3. Create temporary "Processing" message in Chat History
     history = (
@@ -206,33 +407,33 @@ async def upload_chat_attachment(
         .first()
     )
     if not history:
-        history = models.ChatHistory(
-            patient_id=secure_user_id, session_id=session_id, messages=[]
-        )
+        history = models.ChatHistory(patient_id=secure_user_id, session_id=session_id)
         db.add(history)
         db.commit()
 
-    current_messages = list(history.messages) if history.messages else []
-    current_messages.append(
+    (placeholder,) = chat_service.append_messages(
+        db,
+        history.id,
         {
             "sender": "system",
             "text": f"Uploading and analyzing {file.filename} in the background...",
             "status": "processing",
-        }
+        },
     )
-    history.messages = current_messages
-    flag_modified(history, "messages")
+    placeholder_seq = placeholder.seq
     db.commit()
 
-    # 4. Queue the task
-    background_tasks.add_task(
-        process_chat_upload_in_background,
+    # 4. Queue the durable background job (picked up by worker.py)
+    job_queue.enqueue(
+        db,
+        "chat.analyze_upload",
         temp_path=temp_path,
         unique_name=unique_name,
         file_content_type=file.content_type,
-        media_id=new_media.id,
+        media_id=media_id,
         session_id=session_id,
         filename=file.filename,
+        placeholder_seq=placeholder_seq,
     )
 
     # 5. Instantly return
@@ -251,24 +452,18 @@ async def voice_to_text_endpoint(
     current_user: schemas.TokenData = Depends(get_current_user),
 ):
     """Takes audio, transcribes it via Gemini, and returns text instantly. Does NOT save to DB."""
-    file_ext = file.filename.split(".")[-1]
-    unique_name = f"temp_voice_{uuid.uuid4()}.{file_ext}"
-
     try:
-        with open(unique_name, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        # Send directly to your AI service for transcription
-        transcription_text = ai_service.transcribe_audio(unique_name)
-
-        if os.path.exists(unique_name):
-            os.remove(unique_name)
-
+        # Voice notes are small: read them off the spooled upload without
+        # blocking the event loop, then hand Gemini the bytes from memory
+        audio = io.BytesIO(await file.read())
+        transcription_text = await ai_service.transcribe_audio_async(
+            audio, (file.content_type or "audio/webm").split(";")[0]
+        )
         return {"text": transcription_text}
 
+    except ai_service.AIOverloadedError as e:
+        raise _too_many_requests(e)
     except Exception as e:
-        if os.path.exists(unique_name):
-            os.remove(unique_name)
         raise HTTPException(
             status_code=500, detail=f"Voice transcription failed: {str(e)}"
         )
@@ -1,15 +1,26 @@
 # backend/routers/doctor.py
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from sqlalchemy.orm import Session
-from sqlalchemy.orm.attributes import flag_modified
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Response
+from sqlalchemy import (
+    select,
+    literal,
+    union_all,
+    tuple_,
+    true,
+    func,
+    and_,
+    or_,
+)
+from sqlalchemy.orm import Session, load_only, selectinload
+from typing import List, Optional
 from datetime import datetime
 import uuid
 import audit_service
+import chat_service
+import events_service
 import models
 import schemas
 import pdf_generation_service
-import drive_service
+from storage_service import storage
 import email_service
 from db import get_db
 from security import get_current_doctor
@@ -24,28 +35,325 @@ router = APIRouter(
 
 @router.get("/patients/", response_model=List[schemas.UserRead])
 def get_all_patients(
+    response: Response,
     skip: int = 0,
     limit: int = 50,
+    after_id: Optional[int] = None,
     db: Session = Depends(get_db),
 ):
-    patients = (
+    """
+    Patients in id order. Page with `after_id` (the X-Next-Cursor header of
+    the previous page); `skip` still works but gets slower the deeper it goes.
+    """
+    query = (
         db.query(models.User)
+        # Only what UserRead serializes; profiles come in one extra SELECT
+        # for the whole page instead of one lazy load per patient
+        .options(
+            load_only(models.User.id, models.User.email, models.User.role),
+            selectinload(models.User.profile),
+        )
         .filter(models.User.role == models.UserRole.PATIENT)
-        .offset(skip)
-        .limit(limit)
-        .all()
+        .order_by(models.User.id)
     )
+    if after_id is not None:
+        query = query.filter(models.User.id > after_id)
+    else:
+        query = query.offset(skip)
+
+    patients = query.limit(limit).all()
+    if len(patients) == limit:
+        response.headers["X-Next-Cursor"] = str(patients[-1].id)
     return patients
 
 
+# Dashboard "highest priority patients" list, sent with the queue's first page
+TOP_PRIORITY_PATIENTS = 5
+
+
+def _parse_triage_cursor(cursor: str):
+    try:
+        priority, patient_id = cursor.split("|", 1)
+        return int(priority), int(patient_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid triage queue cursor")
+
+
+def _triage_stats(db: Session) -> dict:
+    total_sessions, unreviewed, average = db.execute(
+        select(
+            func.count(models.ChatHistory.id),
+            func.count().filter(~models.ChatHistory.reviewed),
+            func.avg(models.ChatHistory.priority_score),
+        ).where(models.ChatHistory.summary.isnot(None))
+    ).one()
+    total_patients = db.execute(
+        select(func.count(models.User.id)).where(
+            models.User.role == models.UserRole.PATIENT
+        )
+    ).scalar()
+    return {
+        "total_patients": total_patients,
+        "total_sessions": total_sessions,
+        "unreviewed_sessions": unreviewed,
+        "average_priority": float(average) if average is not None else None,
+    }
+
+
+def _top_priority_patients(db: Session, limit: int) -> list:
+    """Patients with the highest priority in any summarized session."""
+    history = models.ChatHistory
+    per_patient = (
+        select(
+            history.patient_id,
+            func.max(history.priority_score).label("max_priority"),
+            func.count().label("session_count"),
+        )
+        .where(history.summary.isnot(None))
+        .group_by(history.patient_id)
+        .having(func.max(history.priority_score) > 0)
+        .subquery()
+    )
+    rows = db.execute(
+        select(
+            per_patient,
+            models.User.email,
+            models.Profile.full_name,
+            models.Profile.profile_pic_drive_id,
+        )
+        .join(models.User, models.User.id == per_patient.c.patient_id)
+        .outerjoin(models.Profile, models.Profile.user_id == models.User.id)
+        .order_by(per_patient.c.max_priority.desc(), per_patient.c.patient_id)
+        .limit(limit)
+    ).mappings().all()
+    return [
+        {
+            "patient_id": row["patient_id"],
+            "email": row["email"],
+            "full_name": row["full_name"],
+            "has_profile_pic": bool(row["profile_pic_drive_id"]),
+            "max_priority": row["max_priority"],
+            "session_count": row["session_count"],
+        }
+        for row in rows
+    ]
+
+
+@router.get("/triage-queue", response_model=schemas.TriageQueueRead)
+def get_triage_queue(
+    limit: int = 50,
+    after: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_doctor: schemas.TokenData = Depends(get_current_doctor),
+):
+    """
+    Every patient with their latest triage summary, highest priority first,
+    in one query (replaces fetching /patients/{id}/summaries per patient).
+    Page with `after` = the previous page's next_cursor.
+    """
+    audit_service.log_action(
+        db=db,
+        actor_id=current_doctor.user_id,
+        patient_id=None,
+        action="VIEWED_TRIAGE_QUEUE",
+    )
+
+    history = models.ChatHistory
+    per_patient = dict(partition_by=history.patient_id)
+
+    # Rank each patient's summarized sessions, newest first, and compute the
+    # per-patient aggregates in the same pass
+    ranked = (
+        select(
+            history.patient_id,
+            history.id.label("chat_id"),
+            history.session_id,
+            history.created_at,
+            history.priority_score,
+            history.red_flags_present,
+            history.summary["red_flags"].as_string().label("red_flags"),
+            history.summary["chief_complaint"].as_string().label("chief_complaint"),
+            history.summary["summary_note"].as_string().label("summary_note"),
+            history.reviewed,
+            func.row_number()
+            .over(order_by=(history.created_at.desc(), history.id.desc()), **per_patient)
+            .label("rn"),
+            func.count().over(**per_patient).label("session_count"),
+            func.max(history.priority_score).over(**per_patient).label("max_priority"),
+            func.count()
+            .filter(~history.reviewed)
+            .over(**per_patient)
+            .label("unreviewed_count"),
+        )
+        .where(history.summary.isnot(None))
+        .subquery()
+    )
+    latest = select(ranked).where(ranked.c.rn == 1).subquery()
+
+    sort_priority = func.coalesce(latest.c.priority_score, 0)
+    query = (
+        select(
+            models.User.id.label("patient_id"),
+            models.User.email,
+            models.Profile.full_name,
+            models.Profile.profile_pic_drive_id,
+            latest,
+            sort_priority.label("sort_priority"),
+        )
+        .select_from(models.User)
+        .outerjoin(models.Profile, models.Profile.user_id == models.User.id)
+        .outerjoin(latest, latest.c.patient_id == models.User.id)
+        .where(models.User.role == models.UserRole.PATIENT)
+    )
+    if after:
+        after_priority, after_id = _parse_triage_cursor(after)
+        query = query.where(
+            or_(
+                sort_priority < after_priority,
+                and_(sort_priority == after_priority, models.User.id > after_id),
+            )
+        )
+    rows = db.execute(
+        query.order_by(sort_priority.desc(), models.User.id.asc()).limit(limit)
+    ).mappings().all()
+
+    items = [
+        {
+            "patient_id": row["patient_id"],
+            "email": row["email"],
+            "full_name": row["full_name"],
+            "has_profile_pic": bool(row["profile_pic_drive_id"]),
+            "latest_chat_id": row["chat_id"],
+            "latest_session_id": row["session_id"],
+            "latest_summary_at": row["created_at"],
+            "priority_score": row["priority_score"],
+            "red_flags": row["red_flags"],
+            "red_flags_present": bool(row["red_flags_present"]),
+            "reviewed": bool(row["reviewed"]),
+            "chief_complaint": row["chief_complaint"],
+            "summary_note": row["summary_note"],
+            "session_count": row["session_count"] or 0,
+            "max_priority": row["max_priority"],
+            "unreviewed_count": row["unreviewed_count"] or 0,
+        }
+        for row in rows
+    ]
+
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = f"{rows[-1]['sort_priority']}|{rows[-1]['patient_id']}"
+
+    return {
+        "items": items,
+        "next_cursor": next_cursor,
+        "stats": None if after else _triage_stats(db),
+        "top_priority": None if after else _top_priority_patients(db, TOP_PRIORITY_PATIENTS),
+    }
+
+
+@router.get(
+    "/triage-queue/unreviewed", response_model=List[schemas.UnreviewedSession]
+)
+def get_unreviewed_sessions(
+    limit: int = 50,
+    db: Session = Depends(get_db),
+    current_doctor: schemas.TokenData = Depends(get_current_doctor),
+):
+    """The most urgent summarized sessions no doctor has reviewed yet."""
+    audit_service.log_action(
+        db=db,
+        actor_id=current_doctor.user_id,
+        patient_id=None,
+        action="VIEWED_TRIAGE_QUEUE",
+    )
+
+    history = models.ChatHistory
+    # Matches ix_chat_history_unreviewed_priority, so this reads `limit` index entries
+    rows = db.execute(
+        select(
+            history.id.label("chat_id"),
+            history.session_id,
+            history.patient_id,
+            history.created_at,
+            history.priority_score,
+            history.red_flags_present,
+            history.summary["chief_complaint"].as_string().label("chief_complaint"),
+        )
+        .where(history.summary.isnot(None), ~history.reviewed)
+        .order_by(history.priority_score.desc().nulls_last(), history.created_at.desc())
+        .limit(limit)
+    ).mappings().all()
+    return rows
+
+
+# Timeline item types, and their tie-break order when created_at is equal
+TIMELINE_KINDS = {"triage_summary": 0, "medical_record": 1}
+TIMELINE_ID_PREFIXES = {"triage_summary": "chat", "medical_record": "file"}
+
+
+def _timeline_cursor(created_at: datetime, kind: str, item_id: int) -> str:
+    return f"{created_at.isoformat()}|{TIMELINE_ID_PREFIXES[kind]}_{item_id}"
+
+
+def _parse_timeline_cursor(cursor: str):
+    """"<created_at ISO>|chat_12" -> (created_at, kind rank, 12)"""
+    try:
+        created_at, item = cursor.rsplit("|", 1)
+        prefix, item_id = item.split("_", 1)
+        kind = next(k for k, p in TIMELINE_ID_PREFIXES.items() if p == prefix)
+        return datetime.fromisoformat(created_at), TIMELINE_KINDS[kind], int(item_id)
+    except (ValueError, StopIteration):
+        raise HTTPException(status_code=400, detail="Invalid timeline cursor")
+
+
+def _timeline_branch(model, rank: int, patient_id: int, cursor, fetch: int, *filters):
+    """
+    (kind, item_id, created_at) of one table's newest rows after `cursor`.
+    Pages are ordered by (created_at, kind, id) DESC; since `rank` is fixed per
+    branch, the keyset condition reduces to something the
+    (patient_id, created_at) index can answer.
+    """
+    if cursor:
+        c_created, c_rank, c_id = cursor
+        if rank < c_rank:
+            after = model.created_at <= c_created
+        elif rank == c_rank:
+            after = tuple_(model.created_at, model.id) < tuple_(c_created, c_id)
+        else:
+            after = model.created_at < c_created
+    else:
+        after = true()
+
+    newest = (
+        select(
+            literal(rank).label("kind"),
+            model.id.label("item_id"),
+            model.created_at.label("created_at"),
+        )
+        .where(model.patient_id == patient_id, after, *filters)
+        .order_by(model.created_at.desc(), model.id.desc())
+        .limit(fetch)
+        .subquery()
+    )
+    return select(newest)
+
+
 @router.get("/patients/{patient_id}/summaries")
 def get_patient_timeline(
     patient_id: int,
+    response: Response,
     skip: int = 0,
     limit: int = 20,
+    before: Optional[str] = None,
+    item_type: Optional[str] = Query(None, alias="type"),
     db: Session = Depends(get_db),
     current_doctor: schemas.TokenData = Depends(get_current_doctor),
 ):
+    """
+    Newest-first timeline of triage summaries and files. Page with `before`
+    (the X-Next-Cursor header of the previous page); `skip` still works but
+    gets slower the deeper it goes. `type` limits it to one kind of item.
+    """
     audit_service.log_action(
         db=db,
         actor_id=current_doctor.user_id,
@@ -53,55 +361,122 @@ def get_patient_timeline(
         action="VIEWED_PATIENT_TIMELINE",
     )
 
-    sessions = (
-        db.query(models.ChatHistory)
-        .filter(models.ChatHistory.patient_id == patient_id)
-        .all()
-    )
-    files = (
-        db.query(models.MedicalMedia)
-        .filter(models.MedicalMedia.patient_id == patient_id)
-        .all()
-    )
+    if item_type is not None and item_type not in TIMELINE_KINDS:
+        raise HTTPException(status_code=400, detail="Unknown timeline item type")
 
-    timeline = []
+    cursor = _parse_timeline_cursor(before) if before else None
+    offset = 0 if cursor else skip
+    fetch = offset + limit
 
-    for session in sessions:
-        if session.summary:
-            priority = (
-                session.summary.get("priority_score", 0)
-                if isinstance(session.summary, dict)
-                else 0
+    # 1. One UNION ALL over both tables, ids and sort keys only
+    branches = []
+    if item_type in (None, "triage_summary"):
+        branches.append(
+            _timeline_branch(
+                models.ChatHistory,
+                TIMELINE_KINDS["triage_summary"],
+                patient_id,
+                cursor,
+                fetch,
+                models.ChatHistory.summary.isnot(None),
+            )
+        )
+    if item_type in (None, "medical_record"):
+        branches.append(
+            _timeline_branch(
+                models.MedicalMedia,
+                TIMELINE_KINDS["medical_record"],
+                patient_id,
+                cursor,
+                fetch,
             )
+        )
+
+    timeline_q = union_all(*branches).subquery()
+    page = db.execute(
+        select(timeline_q)
+        .order_by(
+            timeline_q.c.created_at.desc(),
+            timeline_q.c.kind.desc(),
+            timeline_q.c.item_id.desc(),
+        )
+        .offset(offset)
+        .limit(limit)
+    ).all()
+
+    # 2. Load just the columns the items show, for this page only
+    chat_ids = [r.item_id for r in page if r.kind == TIMELINE_KINDS["triage_summary"]]
+    file_ids = [r.item_id for r in page if r.kind == TIMELINE_KINDS["medical_record"]]
+    sessions, files = {}, {}
+    if chat_ids:
+        sessions = {
+            s.id: s
+            for s in db.query(models.ChatHistory)
+            .options(
+                load_only(
+                    models.ChatHistory.id,
+                    models.ChatHistory.created_at,
+                    models.ChatHistory.summary,
+                    models.ChatHistory.priority_score,
+                )
+            )
+            .filter(models.ChatHistory.id.in_(chat_ids))
+        }
+    if file_ids:
+        files = {
+            f.id: f
+            for f in db.query(models.MedicalMedia)
+            .options(
+                load_only(
+                    models.MedicalMedia.id,
+                    models.MedicalMedia.created_at,
+                    models.MedicalMedia.file_name,
+                    models.MedicalMedia.file_type,
+                    models.MedicalMedia.transcript,
+                    models.MedicalMedia.drive_view_link,
+                )
+            )
+            .filter(models.MedicalMedia.id.in_(file_ids))
+        }
+
+    timeline = []
+    for row in page:
+        if row.kind == TIMELINE_KINDS["triage_summary"]:
+            session = sessions[row.item_id]
             timeline.append(
                 {
                     "type": "triage_summary",
                     "id": f"chat_{session.id}",
                     "title": "AI Triage Assessment",
                     "created_at": session.created_at,
-                    "priority_score": priority,
+                    "priority_score": session.priority_score or 0,
                     "content": session.summary,
                 }
             )
+        else:
+            f = files[row.item_id]
+            timeline.append(
+                {
+                    "type": "medical_record",
+                    "id": f"file_{f.id}",
+                    "title": f.file_name,
+                    "created_at": f.created_at,
+                    "priority_score": None,
+                    "content": {
+                        "file_type": f.file_type,
+                        "transcript": f.transcript,
+                        "url": f.drive_view_link,
+                    },
+                }
+            )
 
-    for f in files:
-        timeline.append(
-            {
-                "type": "medical_record",
-                "id": f"file_{f.id}",
-                "title": f.file_name,
-                "created_at": f.created_at,
-                "priority_score": None,
-                "content": {
-                    "file_type": f.file_type,
-                    "transcript": f.transcript,
-                    "url": f.drive_view_link,
-                },
-            }
+    if len(page) == limit:
+        last = page[-1]
+        kind = next(k for k, rank in TIMELINE_KINDS.items() if rank == last.kind)
+        response.headers["X-Next-Cursor"] = _timeline_cursor(
+            last.created_at, kind, last.item_id
         )
-
-    timeline.sort(key=lambda x: x["created_at"], reverse=True)
-    return timeline[skip : skip + limit]
+    return timeline
 
 
 @router.get("/patients/{patient_id}/chat/{chat_id}")
@@ -154,9 +529,7 @@ def create_prescription(
         raise HTTPException(status_code=404, detail="Session not found")
 
     # Mark session as reviewed
-    if history_record.summary and isinstance(history_record.summary, dict):
-        history_record.summary["reviewed"] = True
-        flag_modified(history_record, "summary")
+    chat_service.mark_reviewed(history_record)
 
     patient = (
         db.query(models.User)
@@ -179,8 +552,8 @@ def create_prescription(
         follow_up_days=request.follow_up_days,
     )
 
-    # Upload to Drive
-    drive_data = drive_service.upload_to_drive(file_path, filename, "application/pdf")
+    # Upload to storage
+    drive_data = storage.upload(file_path, filename, "application/pdf")
 
     # Save to Database
     new_media = models.MedicalMedia(
@@ -203,11 +576,16 @@ def create_prescription(
         f"Doctor has issued a prescription. It is now available in your 'My Files' tab.\n"
         f"A follow-up check-in has been scheduled for {request.follow_up_days} days from now."
     )
-    messages = history_record.messages if history_record.messages else []
-    messages.append({"sender": "ai", "text": follow_up_msg})
-    history_record.messages = messages
-    flag_modified(history_record, "messages")
+    chat_service.append_messages(
+        db, history_record.id, {"sender": "ai", "text": follow_up_msg}
+    )
     db.commit()
+    events_service.publish(
+        patient.id,
+        "prescription.issued",
+        session_id=request.session_id,
+        media_id=new_media.id,
+    )
 
     # FIX: Read PDF into memory FIRST, then delete the file
     # This is critical on Render — ephemeral filesystem means the file may be gone
@@ -0,0 +1,40 @@
+# backend/routers/events.py
+import asyncio
+
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect
+
+import events_service
+from security import get_current_user
+
+router = APIRouter(tags=["Live Events"])
+
+# Keeps proxies from closing an idle socket and notices dead clients
+KEEPALIVE_SECONDS = 25
+
+
+@router.websocket("/ws/events")
+async def events_socket(websocket: WebSocket, token: str = Query(...)):
+    """
+    Pushes the current user's events as JSON: {"event": "...", ...ids}.
+    Browsers can't set an Authorization header on a WebSocket, hence ?token=.
+    """
+    try:
+        current_user = get_current_user(token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    queue = events_service.bus.subscribe(current_user.user_id)
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                await websocket.send_json({"event": "ping"})
+                continue
+            await websocket.send_json({"event": message["event"], **message["data"]})
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        events_service.bus.unsubscribe(current_user.user_id, queue)
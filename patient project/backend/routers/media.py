@@ -6,67 +6,71 @@ from fastapi import (
     UploadFile,
     File,
     Form,
-    BackgroundTasks,
+    Request,
 )
-from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-import shutil
+from collections import OrderedDict
+import hashlib
 import os
 import uuid
 
 import models
 import schemas
 import ai_service
-import drive_service
-from db import get_db
+import storage_service
+import media_service
+import job_queue
+import events_service
+from storage_service import storage
+import delivery_service
+import http_cache
+from db import get_db, SessionLocal
 from security import get_current_user
 
 router = APIRouter(tags=["Media & Files"])
 
 
+def _audio_failed(error: str, media_id: int, temp_path: str, **_):
+    media_service.mark_media_failed(
+        media_id, f"ERROR PROCESSING AUDIO: {error}", temp_path
+    )
+
+
+@job_queue.job_handler(
+    "media.transcribe_audio", concurrency=2, on_failure=_audio_failed
+)
 def process_audio_in_background(
     temp_path: str, unique_name: str, file_content_type: str, media_id: int
 ):
-    db = next(get_db())
+    db = SessionLocal()
     try:
-        # 1. Upload & Transcribe
-        drive_data = drive_service.upload_to_drive(
-            temp_path, unique_name, file_content_type
+        media_record = media_service.get_media(db, media_id)
+        if not media_record:
+            # Deleted while queued — nothing left to do
+            media_service.remove_temp_file(temp_path)
+            return
+
+        # 1. Upload & Transcribe (raising here lets the queue retry)
+        media_service.store_pending_upload(
+            db, media_record, temp_path, unique_name, file_content_type
         )
         transcription_text = ai_service.transcribe_audio(temp_path)
 
         # 2. Update DB
-        media_record = (
-            db.query(models.MedicalMedia)
-            .filter(models.MedicalMedia.id == media_id)
-            .first()
-        )
-        if media_record:
-            media_record.drive_file_id = drive_data["file_id"]
-            media_record.drive_view_link = (
-                f"http://127.0.0.1:8000/media/view/{media_id}"
-            )
-            media_record.transcript = transcription_text
-            db.commit()
-    except Exception as e:
-        print(f"Background Audio Error: {e}")
-        media_record = (
-            db.query(models.MedicalMedia)
-            .filter(models.MedicalMedia.id == media_id)
-            .first()
+        media_record.transcript = transcription_text
+        media_record.processing_status = "ready"
+        db.commit()
+        media_service.remove_temp_file(temp_path)
+        events_service.publish(
+            media_record.patient_id, "media.ready", media_id=media_id
         )
-        if media_record:
-            media_record.transcript = f"ERROR PROCESSING AUDIO: {str(e)}"
-            db.commit()
     finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
         db.close()
 
 
 @router.post("/transcribe/")
 async def transcribe_audio_endpoint(
-    background_tasks: BackgroundTasks,  # <-- Inject BackgroundTasks
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
     current_user: schemas.TokenData = Depends(get_current_user),
@@ -74,11 +78,21 @@ async def transcribe_audio_endpoint(
     secure_user_id = current_user.user_id
     file_ext = file.filename.split(".")[-1]
     unique_name = f"audio_{uuid.uuid4()}.{file_ext}"
-    temp_path = f"temp_{unique_name}"
 
-    # 1. Save file locally instantly
-    with open(temp_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # 1. Spill to managed temp dir — transcription needs a real file after we return
+    temp_path, content_sha256 = await run_in_threadpool(
+        storage_service.spill_to_temp, file.file, f".{file_ext}"
+    )
+
+    # Same recording uploaded before? Reuse its stored file and transcript.
+    duplicate = media_service.find_duplicate_media(db, secure_user_id, content_sha256)
+    if duplicate:
+        os.remove(temp_path)
+        return {
+            "media_id": duplicate.id,
+            "message": "This audio was already uploaded. Showing the existing transcript.",
+            "status": "done",
+        }
 
     # 2. Create placeholder in DB
     new_media = models.MedicalMedia(
@@ -88,14 +102,17 @@ async def transcribe_audio_endpoint(
         drive_file_id="processing...",
         drive_view_link="",
         transcript="Audio is being transcribed. Please wait...",  # Temporary
+        processing_status="processing",
+        content_sha256=content_sha256,
     )
     db.add(new_media)
     db.commit()
     db.refresh(new_media)
 
-    # 3. Queue the background task
-    background_tasks.add_task(
-        process_audio_in_background,
+    # 3. Queue the durable background job (picked up by worker.py)
+    job_queue.enqueue(
+        db,
+        "media.transcribe_audio",
         temp_path=temp_path,
         unique_name=unique_name,
         file_content_type=file.content_type,
@@ -130,16 +147,34 @@ def delete_media(
         )
 
     if media_item.drive_file_id and media_item.drive_file_id != "local_error":
-        drive_service.delete_file_from_drive(media_item.drive_file_id)
+        storage.delete(media_item.drive_file_id)
 
     db.delete(media_item)
     db.commit()
     return {"detail": "File deleted successfully"}
 
 
+@router.get("/media/{media_id}/status", response_model=schemas.MediaStatusRead)
+def get_media_status(
+    media_id: int,
+    db: Session = Depends(get_db),
+    current_user: schemas.TokenData = Depends(get_current_user),
+):
+    """Cheap per-file poll for background processing, instead of re-listing every file."""
+    media = media_service.get_media(db, media_id)
+    if not media:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    if media.patient_id != current_user.user_id and current_user.role != "doctor":
+        raise HTTPException(status_code=403, detail="Not authorized to view this file")
+
+    return media
+
+
 @router.get("/media/view/{media_id}")
 def view_media_proxy(
     media_id: int,
+    request: Request,
     db: Session = Depends(get_db),
     current_user: schemas.TokenData = Depends(get_current_user),
 ):
@@ -153,74 +188,69 @@ def view_media_proxy(
     if media.patient_id != current_user.user_id and current_user.role != "doctor":
         raise HTTPException(status_code=403, detail="Not authorized to view this file")
 
-    file_stream = drive_service.get_file_stream(media.drive_file_id)
-    if not file_stream:
-        raise HTTPException(
-            status_code=500, detail="Could not retrieve file from Cloud"
-        )
-
     mime_type = "application/pdf"
     if media.file_type == "audio":
         mime_type = "audio/webm"
     elif media.file_type == "image" or media.file_type == "image_ocr":
         mime_type = "image/jpeg"
 
-    return StreamingResponse(file_stream, media_type=mime_type)
+    # The Drive file ID changes whenever the underlying bytes change,
+    # so it (plus the row id) is enough to validate the client's copy.
+    return delivery_service.serve_file(
+        request,
+        media.drive_file_id,
+        mime_type,
+        etag=http_cache.make_etag(media.id, media.drive_file_id),
+        last_modified=media.created_at,
+    )
+
+
+def _ocr_failed(error: str, media_id: int, temp_path: str, **_):
+    media_service.mark_media_failed(
+        media_id, f"ERROR PROCESSING FILE: {error}", temp_path
+    )
 
 
+@job_queue.job_handler(
+    "media.analyze_document", concurrency=2, on_failure=_ocr_failed
+)
 def process_ocr_in_background(
     temp_path: str, unique_name: str, file_content_type: str, media_id: int
 ):
-    # We need a new database session just for this background worker
-    db = next(get_db())
+    # Each job gets its own database session
+    db = SessionLocal()
 
     try:
-        # 1. Upload to Drive
-        drive_data = drive_service.upload_to_drive(
-            temp_path, unique_name, file_content_type
+        media_record = media_service.get_media(db, media_id)
+        if not media_record:
+            media_service.remove_temp_file(temp_path)
+            return
+
+        # 1. Upload to storage
+        media_service.store_pending_upload(
+            db, media_record, temp_path, unique_name, file_content_type
         )
-        if not drive_data:
-            raise Exception("Drive upload failed")
 
         # 2. Analyze with Gemini
         analysis_result = ai_service.analyze_medical_image(temp_path)
 
         # 3. Update the database record with the results
-        media_record = (
-            db.query(models.MedicalMedia)
-            .filter(models.MedicalMedia.id == media_id)
-            .first()
-        )
-        if media_record:
-            media_record.drive_file_id = drive_data["file_id"]
-            media_record.drive_view_link = (
-                f"http://127.0.0.1:8000/media/view/{media_id}"
-            )
-            media_record.transcript = analysis_result
-            db.commit()
+        media_record.transcript = analysis_result
+        media_record.processing_status = "ready"
+        db.commit()
 
-    except Exception as e:
-        print(f"Background OCR Error: {e}")
-        # Mark as failed in DB so the user knows
-        media_record = (
-            db.query(models.MedicalMedia)
-            .filter(models.MedicalMedia.id == media_id)
-            .first()
+        # 4. Clean up the temp file
+        media_service.remove_temp_file(temp_path)
+        events_service.publish(
+            media_record.patient_id, "media.ready", media_id=media_id
         )
-        if media_record:
-            media_record.transcript = f"ERROR PROCESSING FILE: {str(e)}"
-            db.commit()
 
     finally:
-        # 4. Clean up the temp file
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
         db.close()
 
 
 @router.post("/ocr/analyze")
 async def analyze_medical_document(
-    background_tasks: BackgroundTasks,  # <-- Inject BackgroundTasks here
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
     current_user: schemas.TokenData = Depends(get_current_user),
@@ -237,11 +267,21 @@ async def analyze_medical_document(
 
     file_ext = file.filename.split(".")[-1]
     unique_name = f"ocr_{uuid.uuid4()}.{file_ext}"
-    temp_path = f"temp_{unique_name}"
 
-    # 1. Save the file locally (Super fast)
-    with open(temp_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # 1. Spill to managed temp dir — Gemini analysis needs a real file after we return
+    temp_path, content_sha256 = await run_in_threadpool(
+        storage_service.spill_to_temp, file.file, f".{file_ext}"
+    )
+
+    # Same document uploaded before? Reuse its stored file and analysis.
+    duplicate = media_service.find_duplicate_media(db, secure_user_id, content_sha256)
+    if duplicate:
+        os.remove(temp_path)
+        return {
+            "id": duplicate.id,
+            "message": "This file was already uploaded. Showing the existing analysis.",
+            "status": "done",
+        }
 
     # 2. Create a "Placeholder" record in the database (Super fast)
     new_media = models.MedicalMedia(
@@ -251,14 +291,17 @@ async def analyze_medical_document(
         drive_file_id="processing...",  # Temporary
         drive_view_link="",
         transcript="File is being analyzed. Please refresh in a few seconds...",  # Temporary
+        processing_status="processing",
+        content_sha256=content_sha256,
     )
     db.add(new_media)
     db.commit()
     db.refresh(new_media)
 
     # 3. Hand off the heavy lifting to the background worker
-    background_tasks.add_task(
-        process_ocr_in_background,
+    job_queue.enqueue(
+        db,
+        "media.analyze_document",
         temp_path=temp_path,
         unique_name=unique_name,
         file_content_type=file.content_type,
@@ -283,39 +326,43 @@ async def upload_generic_media(
 
     file_ext = file.filename.split(".")[-1]
     unique_name = f"upload_{uuid.uuid4()}.{file_ext}"
-    temp_path = f"temp_{unique_name}"
 
     try:
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
         mime_type = file.content_type
-        drive_data = drive_service.upload_to_drive(temp_path, unique_name, mime_type)
 
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        # Piped straight from the request body into storage — no temp copy,
+        # and hashed on the way through rather than in a second pass
+        body = storage_service.HashingReader(file.file)
+        drive_data = await run_in_threadpool(
+            storage.upload_stream, body, unique_name, mime_type
+        )
 
         if not drive_data:
             raise HTTPException(
                 status_code=500, detail="Failed to upload to Cloud Storage"
             )
 
-        new_media = models.MedicalMedia(
-            patient_id=secure_user_id,
-            file_name=file.filename,
-            file_type="image" if "image" in mime_type else "document",
-            drive_file_id=drive_data["file_id"],
-            drive_view_link="",
-            transcript="User Uploaded Record",
+        content_sha256 = body.hexdigest()
+        duplicate = media_service.find_duplicate_media(
+            db, secure_user_id, content_sha256
+        )
+        if duplicate:
+            # Same bytes already stored for this patient: drop the new copy
+            await run_in_threadpool(storage.delete, drive_data["file_id"])
+            return {
+                "id": duplicate.id,
+                "file_url": f"/media/view/{duplicate.id}",
+                "message": "File already uploaded",
+            }
+
+        new_media = _create_uploaded_media(
+            db,
+            secure_user_id,
+            file.filename,
+            mime_type,
+            drive_data["file_id"],
+            content_sha256=content_sha256,
         )
-
-        db.add(new_media)
-        db.commit()
-        db.refresh(new_media)
-
-        # new_media.drive_view_link = f"http://127.0.0.1:8000/media/view/{new_media.id}"
-        new_media.drive_view_link = f"/media/view/{new_media.id}"
-        db.commit()
 
         return {
             "id": new_media.id,
@@ -323,7 +370,289 @@ async def upload_generic_media(
             "message": "Upload successful",
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
         raise HTTPException(status_code=500, detail=str(e))
+
+
+def _create_uploaded_media(
+    db: Session,
+    patient_id: int,
+    file_name: str,
+    mime_type: str,
+    file_id: str,
+    content_sha256: str = None,
+):
+    new_media = models.MedicalMedia(
+        patient_id=patient_id,
+        file_name=file_name,
+        file_type="image" if "image" in mime_type else "document",
+        drive_file_id=file_id,
+        drive_view_link="",
+        transcript="User Uploaded Record",
+        content_sha256=content_sha256,
+    )
+
+    db.add(new_media)
+    db.commit()
+    db.refresh(new_media)
+
+    new_media.drive_view_link = f"/media/view/{new_media.id}"
+    db.commit()
+    return new_media
+
+
+# --- RESUMABLE (CHUNKED) UPLOADS ---
+# 1. POST /media/uploads/                -> opens a session, returns upload_id
+# 2. PUT  /media/uploads/{upload_id}     -> body = raw bytes, header
+#                                           "Content-Range: bytes start-end/total"
+# 3. GET  /media/uploads/{upload_id}     -> how many bytes are committed (to resume)
+# Every chunk except the last must be a multiple of chunk_granularity bytes.
+def _upload_session_read(session: models.UploadSession, file_url: str = None):
+    return schemas.UploadSessionRead(
+        upload_id=session.id,
+        total_size=session.total_size,
+        received_bytes=session.received_bytes or 0,
+        chunk_granularity=storage_service.UPLOAD_CHUNK_GRANULARITY,
+        complete=session.media_id is not None,
+        media_id=session.media_id,
+        file_url=file_url,
+    )
+
+
+def _get_upload_session(db: Session, upload_id: str, user_id: int):
+    session = (
+        db.query(models.UploadSession)
+        .filter(models.UploadSession.id == upload_id)
+        .first()
+    )
+    if not session or session.patient_id != user_id:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    if session.backend != storage.name:
+        raise HTTPException(
+            status_code=410, detail="Upload session belongs to another storage backend"
+        )
+    return session
+
+
+# Running SHA-256 of each resumable upload, fed as PUT /media/uploads/{id}
+# forwards its chunks: upload_id -> [bytes hashed, sha256]. hashlib can't save
+# its state to the upload_sessions row, so it lives in this process; an upload
+# that finishes elsewhere (another worker, or after a restart) is hashed by
+# reading the stored file back once.
+UPLOAD_DIGESTS_MAX = 256
+_upload_digests = OrderedDict()
+
+
+def _start_upload_digest(upload_id: str):
+    _upload_digests[upload_id] = [0, hashlib.sha256()]
+    _upload_digests.move_to_end(upload_id)
+    while len(_upload_digests) > UPLOAD_DIGESTS_MAX:
+        _upload_digests.popitem(last=False)
+
+
+def _hash_committed(upload_id: str, offset: int, data: bytes, committed: int):
+    """Adds the part of `data` (sent at `offset`) that storage actually kept."""
+    entry = _upload_digests.get(upload_id)
+    if entry is None:
+        return
+    kept = committed - offset
+    if entry[0] != offset or not 0 <= kept <= len(data):
+        # Out of step with what storage holds; fall back to reading it back
+        _upload_digests.pop(upload_id, None)
+        return
+    entry[1].update(memoryview(data)[:kept])
+    entry[0] = committed
+
+
+def _upload_sha256(upload_id: str, file_id: str, total_size: int):
+    entry = _upload_digests.pop(upload_id, None)
+    if entry and entry[0] == total_size:
+        return entry[1].hexdigest()
+
+    try:
+        file_stream = storage.stream(file_id)
+        return storage_service.hash_stream(file_stream) if file_stream else None
+    except Exception as e:
+        print(f"Resumable upload hash error: {e}")
+        return None
+
+
+def _finish_upload(db: Session, session: models.UploadSession, committed: int, file_id):
+    session.received_bytes = committed
+    if file_id and session.media_id is None:
+        content_sha256 = _upload_sha256(session.id, file_id, session.total_size)
+        duplicate = media_service.find_duplicate_media(
+            db, session.patient_id, content_sha256
+        )
+        if duplicate:
+            # Same bytes already stored for this patient: drop the new copy
+            storage.delete(file_id)
+            session.media_id = duplicate.id
+        else:
+            new_media = _create_uploaded_media(
+                db,
+                session.patient_id,
+                session.file_name,
+                session.mime_type,
+                file_id,
+                content_sha256=content_sha256,
+            )
+            session.media_id = new_media.id
+    db.commit()
+
+
+@router.post("/media/uploads/", response_model=schemas.UploadSessionRead)
+def start_resumable_upload(
+    request: schemas.UploadSessionCreate,
+    db: Session = Depends(get_db),
+    current_user: schemas.TokenData = Depends(get_current_user),
+):
+    if request.total_size <= 0:
+        raise HTTPException(status_code=400, detail="total_size must be positive")
+
+    file_ext = request.file_name.split(".")[-1]
+    unique_name = f"upload_{uuid.uuid4()}.{file_ext}"
+
+    try:
+        backend_session = storage.start_resumable(
+            unique_name, request.mime_type, request.total_size
+        )
+    except Exception as e:
+        print(f"Resumable upload start error: {e}")
+        raise HTTPException(
+            status_code=500, detail="Could not start upload with Cloud Storage"
+        )
+
+    session = models.UploadSession(
+        id=uuid.uuid4().hex,
+        patient_id=current_user.user_id,
+        file_name=request.file_name,
+        mime_type=request.mime_type,
+        total_size=request.total_size,
+        received_bytes=0,
+        backend=storage.name,
+        backend_session=backend_session,
+    )
+    db.add(session)
+    db.commit()
+    db.refresh(session)
+    return _upload_session_read(session)
+
+
+@router.get("/media/uploads/{upload_id}", response_model=schemas.UploadSessionRead)
+def get_resumable_upload(
+    upload_id: str,
+    db: Session = Depends(get_db),
+    current_user: schemas.TokenData = Depends(get_current_user),
+):
+    session = _get_upload_session(db, upload_id, current_user.user_id)
+
+    # A finished upload whose file was since deleted has media_id cleared;
+    # don't ask the backend again and re-create the record
+    if session.media_id is None and session.received_bytes < session.total_size:
+        # The backend is the source of truth for what actually got persisted
+        try:
+            committed, file_id = storage.resumable_offset(
+                session.backend_session, session.total_size
+            )
+        except Exception as e:
+            print(f"Resumable upload status error: {e}")
+            raise HTTPException(status_code=410, detail="Upload session expired")
+        _finish_upload(db, session, committed, file_id)
+
+    file_url = f"/media/view/{session.media_id}" if session.media_id else None
+    return _upload_session_read(session, file_url)
+
+
+def _parse_content_range(header: str):
+    # "bytes 0-8388607/52428800"
+    try:
+        unit, _, spec = header.strip().partition(" ")
+        byte_range, _, total = spec.partition("/")
+        start, _, end = byte_range.partition("-")
+        if unit != "bytes":
+            raise ValueError()
+        return int(start), int(end), int(total)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Range header")
+
+
+@router.put("/media/uploads/{upload_id}", response_model=schemas.UploadSessionRead)
+async def upload_resumable_chunk(
+    upload_id: str,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: schemas.TokenData = Depends(get_current_user),
+):
+    session = _get_upload_session(db, upload_id, current_user.user_id)
+    if session.media_id is not None:
+        return _upload_session_read(session, f"/media/view/{session.media_id}")
+
+    start, end, total = _parse_content_range(request.headers.get("content-range", ""))
+    length = end - start + 1
+    is_last = end + 1 == session.total_size
+
+    if total != session.total_size or length <= 0 or end >= session.total_size:
+        raise HTTPException(status_code=400, detail="Content-Range does not match upload")
+    if start != session.received_bytes:
+        # Client is out of sync — tell it where to resume from
+        raise HTTPException(
+            status_code=409,
+            detail=f"Expected chunk starting at byte {session.received_bytes}",
+        )
+    if not is_last and length % storage_service.UPLOAD_CHUNK_GRANULARITY:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Chunks must be a multiple of {storage_service.UPLOAD_CHUNK_GRANULARITY} bytes",
+        )
+
+    if start == 0:
+        _start_upload_digest(session.id)
+
+    # Forward the body to storage in fixed-size pieces as it arrives, so memory
+    # stays bounded by UPLOAD_CHUNK_SIZE whatever size the client chunk is.
+    offset = start
+    file_id = None
+    buffer = bytearray()
+
+    async def forward(data: bytes):
+        expected = offset + len(data)
+        committed, new_file_id = await run_in_threadpool(
+            storage.put_chunk, session.backend_session, offset, data, total
+        )
+        await run_in_threadpool(_hash_committed, session.id, offset, data, committed)
+        # A short write means the backend kept fewer bytes than we sent; stop
+        # here and let the client resend from `received_bytes`.
+        return committed, new_file_id, committed != expected
+
+    short_write = False
+    try:
+        async for piece in request.stream():
+            buffer.extend(piece)
+            if offset + len(buffer) > end + 1:
+                raise HTTPException(
+                    status_code=400, detail="Body is longer than Content-Range"
+                )
+            while len(buffer) >= storage_service.UPLOAD_CHUNK_SIZE and not short_write:
+                data = bytes(buffer[: storage_service.UPLOAD_CHUNK_SIZE])
+                del buffer[: storage_service.UPLOAD_CHUNK_SIZE]
+                offset, file_id, short_write = await forward(data)
+            if short_write:
+                break
+
+        if buffer and not short_write:
+            offset, file_id, _ = await forward(bytes(buffer))
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Resumable upload chunk error: {e}")
+        raise HTTPException(status_code=502, detail="Cloud Storage rejected the chunk")
+    finally:
+        # Whatever was committed before a failure still counts when resuming
+        if offset != start or file_id:
+            await run_in_threadpool(_finish_upload, db, session, offset, file_id)
+
+    file_url = f"/media/view/{session.media_id}" if session.media_id else None
+    return _upload_session_read(session, file_url)
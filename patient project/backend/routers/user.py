@@ -1,20 +1,23 @@
 # backend/routers/user.py
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session, joinedload
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func
+from sqlalchemy.orm import Session, joinedload, selectinload
 from typing import List
-import shutil
-import os
 import uuid
 
 import models
 import schemas
-import drive_service
+from storage_service import storage
+import delivery_service
+import http_cache
 from db import get_db
 from security import get_current_user
 
 router = APIRouter(prefix="/users", tags=["Users & Profiles"])
 
+PREVIEW_CHARS = 200
+
 
 @router.post("/me/profile/", response_model=schemas.ProfileRead)
 def create_or_update_profile(
@@ -66,12 +69,146 @@ def get_patient_chat_sessions(
     sessions = (
         db.query(models.ChatHistory)
         .filter(models.ChatHistory.patient_id == current_user.user_id)
+        # All sessions' messages in one extra query instead of one per session
+        .options(selectinload(models.ChatHistory.message_rows))
         .order_by(models.ChatHistory.created_at.desc())
         .all()
     )
     return sessions
 
 
+@router.get("/me/chats/sync", response_model=schemas.ChatSyncResponse)
+def sync_patient_chat_sessions(
+    request: Request,
+    response: Response,
+    since: int = 0,
+    db: Session = Depends(get_db),
+    current_user: schemas.TokenData = Depends(get_current_user),
+):
+    """
+    Sessions and messages changed after version `since` (0 = everything).
+    Answers 304 when nothing changed since the client's last sync.
+
+    A version is the xmin of a transaction snapshot: every transaction below
+    it had finished, so rows written by anything still running — including a
+    write that commits after a newer one the client has already seen — have
+    change_xid >= version and come back on the next sync. Re-sent rows are
+    idempotent for the client.
+    """
+    snapshot_xmin = db.query(
+        func.txid_snapshot_xmin(func.txid_current_snapshot())
+    ).scalar()
+
+    sessions = (
+        db.query(models.ChatHistory)
+        .filter(
+            models.ChatHistory.patient_id == current_user.user_id,
+            models.ChatHistory.change_xid >= since,
+        )
+        .order_by(models.ChatHistory.created_at.desc())
+        .all()
+    )
+    messages = (
+        db.query(models.ChatMessage, models.ChatHistory.session_id)
+        .join(models.ChatMessage.chat)
+        .filter(
+            models.ChatHistory.patient_id == current_user.user_id,
+            models.ChatMessage.change_xid >= since,
+        )
+        .order_by(models.ChatMessage.chat_id, models.ChatMessage.seq)
+        .all()
+    )
+
+    etag = http_cache.make_etag(
+        "chat_sync",
+        current_user.user_id,
+        since,
+        *((s.id, s.change_seq) for s in sessions),
+        *((m.chat_id, m.seq, m.change_seq) for m, _ in messages),
+    )
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if http_cache.is_not_modified(request.headers, etag, None):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+
+    return {
+        # Staying on `since` when nothing changed keeps the next poll a 304
+        "version": snapshot_xmin if sessions or messages else since,
+        "sessions": sessions,
+        "messages": [
+            {**m.to_dict(), "session_id": session_id} for m, session_id in messages
+        ],
+    }
+
+
+@router.get("/me/chats/index", response_model=List[schemas.ChatSessionIndexItem])
+def get_patient_chat_index(
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user: schemas.TokenData = Depends(get_current_user),
+):
+    """Every session with previews but no message bodies. 304 when unchanged."""
+    # change_seq only ever grows, so (count, sum) changes whenever any session
+    # (or, through it, any message) changes — even if it commits out of order
+    count, total = (
+        db.query(
+            func.count(models.ChatHistory.id),
+            func.coalesce(func.sum(models.ChatHistory.change_seq), 0),
+        )
+        .filter(models.ChatHistory.patient_id == current_user.user_id)
+        .one()
+    )
+    etag = http_cache.make_etag("chat_index", current_user.user_id, count, total)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if http_cache.is_not_modified(request.headers, etag, None):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+
+    sessions = (
+        db.query(models.ChatHistory)
+        .filter(models.ChatHistory.patient_id == current_user.user_id)
+        .order_by(models.ChatHistory.created_at.desc())
+        .all()
+    )
+    chat_ids = [s.id for s in sessions]
+    preview = func.substr(models.ChatMessage.text, 1, PREVIEW_CHARS)
+
+    first_patient = dict(
+        db.query(models.ChatMessage.chat_id, preview)
+        .filter(
+            models.ChatMessage.chat_id.in_(chat_ids),
+            models.ChatMessage.sender == "patient",
+        )
+        .distinct(models.ChatMessage.chat_id)
+        .order_by(models.ChatMessage.chat_id, models.ChatMessage.seq)
+        .all()
+    )
+    last = dict(
+        db.query(models.ChatMessage.chat_id, preview)
+        .filter(
+            models.ChatMessage.chat_id.in_(chat_ids),
+            models.ChatMessage.sender != "system",
+        )
+        .distinct(models.ChatMessage.chat_id)
+        .order_by(models.ChatMessage.chat_id, models.ChatMessage.seq.desc())
+        .all()
+    )
+
+    return [
+        {
+            "session_id": s.session_id,
+            "summary": s.summary,
+            "created_at": s.created_at,
+            "message_count": s.message_count,
+            "change_seq": s.change_seq,
+            "first_patient_message": first_patient.get(s.id),
+            "last_message": last.get(s.id),
+        }
+        for s in sessions
+    ]
+
+
 @router.get("/me/profile/", response_model=schemas.ProfileRead)
 def get_user_profile(
     db: Session = Depends(get_db),
@@ -89,6 +226,7 @@ def get_user_profile(
 
 @router.get("/me/profile-pic/")
 def get_my_profile_pic(
+    request: Request,
     db: Session = Depends(get_db),
     current_user: schemas.TokenData = Depends(get_current_user),
 ):
@@ -106,16 +244,15 @@ def get_my_profile_pic(
     if not db_profile or not db_profile.profile_pic_drive_id:
         raise HTTPException(status_code=404, detail="No profile picture set")
 
-    file_stream = drive_service.get_file_stream(db_profile.profile_pic_drive_id)
-    if not file_stream:
-        raise HTTPException(
-            status_code=404, detail="Could not retrieve profile picture from storage"
-        )
-
-    return StreamingResponse(
-        file_stream,
-        media_type="image/jpeg",
-        headers={"Cache-Control": "no-cache"},  # Don't cache — always serve fresh
+    # no-cache + ETag: the browser always revalidates (so a new picture shows up
+    # immediately) but an unchanged picture costs a 304 instead of a download.
+    return delivery_service.serve_file(
+        request,
+        db_profile.profile_pic_drive_id,
+        "image/jpeg",
+        etag=http_cache.make_etag("profile_pic", db_profile.profile_pic_drive_id),
+        not_found_status=404,
+        not_found_detail="Could not retrieve profile picture from storage",
     )
 
 
@@ -132,14 +269,11 @@ async def upload_profile_picture(
 
     file_ext = file.filename.split(".")[-1]
     unique_name = f"profile_pic_{user_id}_{uuid.uuid4().hex[:8]}.{file_ext}"
-    temp_path = f"temp_{unique_name}"
 
     try:
-        with open(temp_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        drive_data = drive_service.upload_to_drive(
-            temp_path, unique_name, file.content_type
+        # Piped straight from the request body into storage — no temp copy
+        drive_data = await run_in_threadpool(
+            storage.upload_stream, file.file, unique_name, file.content_type
         )
         if not drive_data:
             raise HTTPException(
@@ -163,10 +297,10 @@ async def upload_profile_picture(
             db.commit()
             db.refresh(db_profile)
 
-        # Delete old picture from Drive to save space
+        # Delete old picture from storage to save space
         if db_profile.profile_pic_drive_id:
             try:
-                drive_service.delete_file_from_drive(db_profile.profile_pic_drive_id)
+                storage.delete(db_profile.profile_pic_drive_id)
             except Exception as e:
                 print(f"Note: Could not delete old profile picture: {e}")
 
@@ -181,14 +315,11 @@ async def upload_profile_picture(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-
 
 @router.get("/{user_id}/profile-pic/")
 def get_user_profile_pic(
     user_id: int,
+    request: Request,
     db: Session = Depends(get_db),
     current_user: schemas.TokenData = Depends(get_current_user),
 ):
@@ -210,16 +341,13 @@ def get_user_profile_pic(
     if not db_profile or not db_profile.profile_pic_drive_id:
         raise HTTPException(status_code=404, detail="No profile picture set")
 
-    file_stream = drive_service.get_file_stream(db_profile.profile_pic_drive_id)
-    if not file_stream:
-        raise HTTPException(
-            status_code=404, detail="Could not retrieve profile picture"
-        )
-
-    return StreamingResponse(
-        file_stream,
-        media_type="image/jpeg",
-        headers={"Cache-Control": "no-cache"},
+    return delivery_service.serve_file(
+        request,
+        db_profile.profile_pic_drive_id,
+        "image/jpeg",
+        etag=http_cache.make_etag("profile_pic", db_profile.profile_pic_drive_id),
+        not_found_status=404,
+        not_found_detail="Could not retrieve profile picture",
     )
 
 
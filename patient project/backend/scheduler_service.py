@@ -0,0 +1,230 @@
+# backend/scheduler_service.py
+"""
+Periodic jobs (appointment completion, audit log upkeep, ...), run by exactly
+one process however many API workers are started.
+
+Every API process ticks the same APScheduler schedule, but a job only runs in
+the current leader. Leadership is a Postgres session advisory lock held on a
+dedicated connection (SCHEDULER_LEADER_LOCK=postgres, the default), so it also
+works across hosts, and passes to another process within
+SCHEDULER_LEADER_RETRY_SECONDS if the leader dies. SCHEDULER_LEADER_LOCK=file
+uses an flock on SCHEDULER_LOCK_FILE instead (single host, no database
+needed for the election).
+
+Jobs are added with `register()`. A run that is still going when the next tick
+comes is skipped rather than stacked, and every job keeps run/failure/timing
+counters for /admin/metrics.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from db import engine
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+SCHEDULER_LEADER_LOCK = os.getenv("SCHEDULER_LEADER_LOCK", "postgres").lower()
+SCHEDULER_LOCK_FILE = os.getenv("SCHEDULER_LOCK_FILE", "/tmp/patient_portal_scheduler.lock")
+SCHEDULER_LEADER_RETRY_SECONDS = float(os.getenv("SCHEDULER_LEADER_RETRY_SECONDS", "15"))
+# Arbitrary, but shared by every process of this app
+LEADER_LOCK_KEY = 7_204_312
+
+
+class PostgresLeaderLock:
+    """Session-level pg_try_advisory_lock on a connection kept out of the pool."""
+
+    def __init__(self):
+        self._conn = None
+
+    def try_acquire(self) -> bool:
+        pooled = engine.raw_connection()
+        pooled.detach()
+        conn = pooled.dbapi_connection
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_lock(%s)", (LEADER_LOCK_KEY,))
+                acquired = cursor.fetchone()[0]
+        except Exception:
+            pooled.close()
+            raise
+        if not acquired:
+            pooled.close()
+            return False
+        self._conn = pooled
+        return True
+
+    def still_held(self) -> bool:
+        # The lock lives exactly as long as the connection
+        try:
+            with self._conn.dbapi_connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except Exception:
+            self.release()
+            return False
+
+    def release(self):
+        if self._conn:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+
+class FileLeaderLock:
+    """flock on a local file: leader election between processes on one host."""
+
+    def __init__(self, path: str):
+        self._path = path
+        self._file = None
+
+    def try_acquire(self) -> bool:
+        if fcntl is None:
+            # No flock here: a single process is assumed
+            return True
+        lock_file = open(self._path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        return True
+
+    def still_held(self) -> bool:
+        return True
+
+    def release(self):
+        if self._file:
+            self._file.close()  # closing drops the flock
+            self._file = None
+
+
+class ScheduledJob:
+    def __init__(self, name: str, func, interval: dict):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.running = threading.Lock()
+        self.runs = 0
+        self.failures = 0
+        self.skipped_overlap = 0
+        self.last_started_at = None
+        self.last_duration_ms = None
+        self.max_duration_ms = 0.0
+        self.last_error = None
+
+    def metrics(self) -> dict:
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped_overlap": self.skipped_overlap,
+            "last_started_at": self.last_started_at,
+            "last_duration_ms": self.last_duration_ms,
+            "max_duration_ms": self.max_duration_ms,
+            "last_error": self.last_error,
+        }
+
+
+class Scheduler:
+    def __init__(self):
+        self._scheduler = BackgroundScheduler()
+        self._jobs = {}
+        self._lock = (
+            FileLeaderLock(SCHEDULER_LOCK_FILE)
+            if SCHEDULER_LEADER_LOCK == "file"
+            else PostgresLeaderLock()
+        )
+        self._stop = threading.Event()
+        self._election = None
+        self.is_leader = False
+
+    def register(self, name: str, func, **interval):
+        """Runs `func()` every `interval` (APScheduler interval kwargs, e.g. minutes=1)."""
+        job = ScheduledJob(name, func, interval)
+        self._jobs[name] = job
+        self._scheduler.add_job(
+            self._run,
+            "interval",
+            args=(job,),
+            id=name,
+            # Let an overlapping tick reach _run, so it's counted as skipped
+            max_instances=2,
+            coalesce=True,
+            **interval,
+        )
+
+    def _run(self, job: ScheduledJob):
+        if not self.is_leader:
+            return
+        if not job.running.acquire(blocking=False):
+            job.skipped_overlap += 1
+            return
+
+        started = time.monotonic()
+        job.last_started_at = datetime.now(timezone.utc).isoformat()
+        try:
+            job.func()
+            job.last_error = None
+        except Exception as e:
+            job.failures += 1
+            job.last_error = str(e)
+            print(f"Scheduled job {job.name} error: {e}")
+        finally:
+            duration_ms = round((time.monotonic() - started) * 1000, 1)
+            job.runs += 1
+            job.last_duration_ms = duration_ms
+            job.max_duration_ms = max(job.max_duration_ms, duration_ms)
+            job.running.release()
+
+    def _elect(self):
+        try:
+            if self.is_leader:
+                if not self._lock.still_held():
+                    self.is_leader = False
+                    print(f"Scheduler: process {os.getpid()} lost leadership")
+            elif self._lock.try_acquire():
+                self.is_leader = True
+                print(f"Scheduler: process {os.getpid()} is the leader")
+        except Exception as e:
+            print(f"Scheduler leader election error: {e}")
+
+    def _election_loop(self):
+        while not self._stop.wait(SCHEDULER_LEADER_RETRY_SECONDS):
+            self._elect()
+
+    def start(self):
+        self._stop.clear()
+        self._elect()
+        self._election = threading.Thread(
+            target=self._election_loop, name="scheduler-election", daemon=True
+        )
+        self._election.start()
+        self._scheduler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._scheduler.shutdown()
+        if self._election:
+            self._election.join(timeout=SCHEDULER_LEADER_RETRY_SECONDS + 1)
+            self._election = None
+        self.is_leader = False
+        self._lock.release()
+
+    def metrics(self) -> dict:
+        return {
+            "is_leader": self.is_leader,
+            "leader_lock": SCHEDULER_LEADER_LOCK,
+            "jobs": {name: job.metrics() for name, job in self._jobs.items()},
+        }
+
+
+scheduler = Scheduler()
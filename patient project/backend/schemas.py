@@ -61,22 +61,88 @@ class MediaRead(BaseModel):
     file_type: str
     drive_view_link: Optional[str] = None
     transcript: Optional[str] = None
+    processing_status: Optional[str] = None
     created_at: datetime
 
     class Config:
         from_attributes = True
 
 
+class MediaStatusRead(BaseModel):
+    id: int
+    processing_status: Optional[str] = None
+    transcript: Optional[str] = None
+    drive_view_link: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+
+class UploadSessionCreate(BaseModel):
+    file_name: str
+    mime_type: str
+    total_size: int
+
+
+class UploadSessionRead(BaseModel):
+    upload_id: str
+    total_size: int
+    received_bytes: int
+    chunk_granularity: int
+    complete: bool
+    media_id: Optional[int] = None
+    file_url: Optional[str] = None
+
+
+class ChatMessageRead(BaseModel):
+    seq: int
+    sender: str
+    text: Optional[str] = None
+    is_file: bool = False
+    file_url: Optional[str] = None
+    status: Optional[str] = None
+    timestamp: Optional[datetime] = None
+
+
 class ChatHistoryRead(BaseModel):
     session_id: str
-    messages: List[dict]
+    messages: List[ChatMessageRead]
+    summary: Optional[Dict[str, Any]] = None
+    created_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
+# --- CHAT SYNC (GET /users/me/chats/sync and /users/me/chats/index) ---
+class ChatSessionMeta(BaseModel):
+    session_id: str
     summary: Optional[Dict[str, Any]] = None
     created_at: Optional[datetime] = None
+    message_count: int = 0
+    change_seq: int
 
     class Config:
         from_attributes = True
 
 
+class ChatSessionIndexItem(ChatSessionMeta):
+    # Previews so a session list can be drawn without any message bodies
+    first_patient_message: Optional[str] = None
+    last_message: Optional[str] = None
+
+
+class ChatSyncMessage(ChatMessageRead):
+    session_id: str
+
+
+class ChatSyncResponse(BaseModel):
+    # Pass back as ?since= on the next sync
+    version: int
+    sessions: List[ChatSessionMeta]
+    messages: List[ChatSyncMessage]
+
+
 # --- CHAT INPUT ---
 class ChatRequest(BaseModel):
     # user_id: int
@@ -84,6 +150,64 @@ class ChatRequest(BaseModel):
     message: str
 
 
+# --- DOCTOR TRIAGE QUEUE ---
+class TriageQueueItem(BaseModel):
+    patient_id: int
+    email: str
+    full_name: Optional[str] = None
+    has_profile_pic: bool = False
+    # From the patient's latest summarized session (all None if there is none)
+    latest_chat_id: Optional[int] = None
+    latest_session_id: Optional[str] = None
+    latest_summary_at: Optional[datetime] = None
+    priority_score: Optional[int] = None
+    red_flags: Optional[str] = None
+    red_flags_present: bool = False
+    reviewed: bool = False
+    chief_complaint: Optional[str] = None
+    summary_note: Optional[str] = None
+    # Across all of the patient's summarized sessions
+    session_count: int = 0
+    max_priority: Optional[int] = None
+    unreviewed_count: int = 0
+
+
+class TriageQueueStats(BaseModel):
+    total_patients: int
+    total_sessions: int
+    unreviewed_sessions: int
+    average_priority: Optional[float] = None
+
+
+class TriagePriorityPatient(BaseModel):
+    patient_id: int
+    email: str
+    full_name: Optional[str] = None
+    has_profile_pic: bool = False
+    max_priority: int
+    session_count: int = 0
+
+
+class TriageQueueRead(BaseModel):
+    items: List[TriageQueueItem]
+    # Pass as ?after= for the next page; None on the last page
+    next_cursor: Optional[str] = None
+    # Only on the first page
+    stats: Optional[TriageQueueStats] = None
+    # Only on the first page: highest max_priority across every patient
+    top_priority: Optional[List[TriagePriorityPatient]] = None
+
+
+class UnreviewedSession(BaseModel):
+    chat_id: int
+    session_id: str
+    patient_id: int
+    created_at: datetime
+    priority_score: Optional[int] = None
+    red_flags_present: bool = False
+    chief_complaint: Optional[str] = None
+
+
 # --- DOCTOR PRESCRIPTION INPUT (NEW) ---
 class PrescriptionRequest(BaseModel):
     session_id: str
@@ -128,7 +252,8 @@ class AppointmentRead(BaseModel):
 class AuditLogRead(BaseModel):
     id: int
     actor_id: int
-    patient_id: int
+    # None for actions not about one patient (e.g. VIEWED_TRIAGE_QUEUE)
+    patient_id: Optional[int] = None
     action: str
     resource_type: Optional[str] = None
     resource_id: Optional[str] = None
@@ -91,3 +91,13 @@ def get_current_doctor(current_user: schemas.TokenData = Depends(get_current_use
             detail="You do not have permission to perform this action. Doctors only.",
         )
     return current_user
+
+
+def get_current_admin(current_user: schemas.TokenData = Depends(get_current_user)):
+    """Same as get_current_doctor, for the 'ADMIN' role."""
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You do not have permission to perform this action. Admins only.",
+        )
+    return current_user
@@ -0,0 +1,326 @@
+# backend/storage_service.py
+"""
+Storage backends for uploaded files.
+
+Every router goes through `storage` (selected by STORAGE_BACKEND) instead of
+calling drive_service directly, so the whole pipeline can run against a local
+directory for offline development and load tests:
+
+    STORAGE_BACKEND=drive   (default) Google Drive, fronted by the blob cache
+    STORAGE_BACKEND=local   Sharded directory under LOCAL_STORAGE_DIR
+"""
+import os
+import re
+import hashlib
+import shutil
+import tempfile
+import uuid
+from datetime import datetime, timezone
+
+import blob_cache
+import drive_service
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "drive").lower()
+LOCAL_STORAGE_DIR = os.getenv(
+    "LOCAL_STORAGE_DIR", os.path.join(BASE_DIR, "local_storage")
+)
+
+# Managed scratch space for uploads that an AI step needs as a real file path.
+# Everything else is piped straight from the request into the backend.
+UPLOAD_TMP_DIR = os.getenv(
+    "UPLOAD_TMP_DIR", os.path.join(tempfile.gettempdir(), "patient_portal_uploads")
+)
+
+LOCAL_READ_CHUNK_SIZE = 256 * 1024
+# Client-driven resumable uploads must send chunks in multiples of this
+# (Drive's own constraint, applied to every backend so clients behave the same).
+UPLOAD_CHUNK_GRANULARITY = drive_service.UPLOAD_CHUNK_GRANULARITY
+UPLOAD_CHUNK_SIZE = drive_service.UPLOAD_CHUNK_SIZE
+
+
+class StorageBackend:
+    """Interface shared by all backends. File IDs are opaque strings stored in the DB."""
+
+    name = "base"
+    # Blob cache whose counters should be updated when a local copy is served
+    cache = None
+
+    def upload(self, file_path: str, file_name: str, mime_type: str):
+        """Stores a local file. Returns {"file_id", "view_link"} or None on failure."""
+        raise NotImplementedError
+
+    def upload_stream(self, fileobj, file_name: str, mime_type: str):
+        """Stores the contents of a file-like object without a temp copy. Same return as upload()."""
+        raise NotImplementedError
+
+    def start_resumable(self, file_name: str, mime_type: str, total_size: int) -> str:
+        """Opens a resumable upload and returns an opaque session reference."""
+        raise NotImplementedError
+
+    def put_chunk(self, session_ref: str, offset: int, data: bytes, total_size: int):
+        """Writes bytes at `offset`. Returns (committed_offset, file_id or None until complete)."""
+        raise NotImplementedError
+
+    def resumable_offset(self, session_ref: str, total_size: int):
+        """Returns (committed_offset, file_id or None) for an open resumable upload."""
+        raise NotImplementedError
+
+    def stream(self, file_id: str):
+        """Returns an iterator over the whole file's bytes, or None."""
+        raise NotImplementedError
+
+    def read_range(self, file_id: str, start: int, end: int):
+        """Returns an iterator over bytes start..end (inclusive), or None."""
+        raise NotImplementedError
+
+    def delete(self, file_id: str):
+        raise NotImplementedError
+
+    def stat(self, file_id: str):
+        """Returns {"size", "mime_type", "modified_time"} or None if the file is missing."""
+        raise NotImplementedError
+
+    def local_path(self, file_id: str):
+        """Path of a readable local copy if one exists (lets us use FileResponse), else None."""
+        return None
+
+
+class DriveStorage(StorageBackend):
+    name = "drive"
+
+    def __init__(self, cache: blob_cache.BlobCache):
+        self.cache = cache
+
+    def upload(self, file_path, file_name, mime_type):
+        return drive_service.upload_to_drive(file_path, file_name, mime_type)
+
+    def upload_stream(self, fileobj, file_name, mime_type):
+        return drive_service.upload_stream_to_drive(fileobj, file_name, mime_type)
+
+    def start_resumable(self, file_name, mime_type, total_size):
+        return drive_service.start_resumable_upload(file_name, mime_type, total_size)
+
+    def put_chunk(self, session_ref, offset, data, total_size):
+        return drive_service.upload_resumable_chunk(session_ref, offset, data, total_size)
+
+    def resumable_offset(self, session_ref, total_size):
+        return drive_service.get_resumable_offset(session_ref, total_size)
+
+    def stream(self, file_id):
+        file_stream = drive_service.get_file_stream(file_id)
+        if file_stream is None:
+            return None
+        return self.cache.tee(file_id, file_stream)
+
+    def read_range(self, file_id, start, end):
+        return drive_service.get_file_range_stream(file_id, start, end)
+
+    def delete(self, file_id):
+        drive_service.delete_file_from_drive(file_id)
+        self.cache.invalidate(file_id)
+
+    def stat(self, file_id):
+        return drive_service.get_file_metadata(file_id)
+
+    def local_path(self, file_id):
+        return self.cache.get_path(file_id)
+
+
+class LocalStorage(StorageBackend):
+    """Files live at <root>/<id[0:2]>/<id[2:4]>/<id> so no directory grows too large."""
+
+    name = "local"
+    _ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, file_id: str):
+        # IDs come from our own DB, but never let one escape the storage root
+        if not file_id or not self._ID_PATTERN.match(file_id):
+            return None
+        return os.path.join(self.root, file_id[:2], file_id[2:4], file_id)
+
+    def upload(self, file_path, file_name, mime_type):
+        with open(file_path, "rb") as f:
+            return self.upload_stream(f, file_name, mime_type)
+
+    def upload_stream(self, fileobj, file_name, mime_type):
+        file_id = uuid.uuid4().hex
+        path = self._path(file_id)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(f"{path}.part", "wb") as out:
+                shutil.copyfileobj(fileobj, out, UPLOAD_CHUNK_SIZE)
+            os.replace(f"{path}.part", path)
+            return {"file_id": file_id, "view_link": ""}
+        except Exception as e:
+            print(f"Local storage upload error: {e}")
+            return None
+
+    def _partial_path(self, session_ref: str):
+        if not self._ID_PATTERN.match(session_ref or ""):
+            raise ValueError("Invalid upload session")
+        return os.path.join(self.root, ".partial", session_ref)
+
+    def start_resumable(self, file_name, mime_type, total_size):
+        session_ref = uuid.uuid4().hex
+        path = self._partial_path(session_ref)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "wb").close()
+        return session_ref
+
+    def put_chunk(self, session_ref, offset, data, total_size):
+        path = self._partial_path(session_ref)
+        committed = os.path.getsize(path)
+        if offset != committed:
+            return committed, None
+
+        with open(path, "ab") as f:
+            f.write(data)
+        committed += len(data)
+
+        if committed < total_size:
+            return committed, None
+
+        # The partial file becomes the stored file — the session ref doubles as its ID
+        final_path = self._path(session_ref)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(path, final_path)
+        return committed, session_ref
+
+    def resumable_offset(self, session_ref, total_size):
+        path = self._partial_path(session_ref)
+        if os.path.exists(path):
+            return os.path.getsize(path), None
+        if self.local_path(session_ref):
+            return total_size, session_ref
+        raise ValueError("Upload session not found")
+
+    def stream(self, file_id):
+        return self.read_range(file_id, 0, None)
+
+    def read_range(self, file_id, start, end):
+        path = self.local_path(file_id)
+        if not path:
+            return None
+        return iter_file_range(path, start, end)
+
+    def delete(self, file_id):
+        path = self._path(file_id)
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def stat(self, file_id):
+        path = self.local_path(file_id)
+        if not path:
+            return None
+        st = os.stat(path)
+        return {
+            "size": st.st_size,
+            "mime_type": None,
+            "modified_time": datetime.fromtimestamp(
+                st.st_mtime, tz=timezone.utc
+            ).isoformat(),
+        }
+
+    def local_path(self, file_id):
+        path = self._path(file_id)
+        if path and os.path.exists(path):
+            return path
+        return None
+
+
+def iter_file_range(path: str, start: int, end=None):
+    """Yields bytes start..end (inclusive, or to EOF if end is None) of a local file."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            size = LOCAL_READ_CHUNK_SIZE
+            if remaining is not None:
+                size = min(size, remaining)
+            chunk = f.read(size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def spill_to_temp(fileobj, suffix: str = ""):
+    """
+    Copies an upload into UPLOAD_TMP_DIR and returns (path, sha256_hex), hashing
+    the bytes on the way through. Only for steps that genuinely need a file on
+    disk after the request is gone (e.g. Gemini analysis in a background job);
+    the caller is responsible for removing it.
+    """
+    os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_TMP_DIR, f"{uuid.uuid4().hex}{suffix}")
+    digest = hashlib.sha256()
+    with open(path, "wb") as out:
+        while True:
+            chunk = fileobj.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+    return path, digest.hexdigest()
+
+
+class HashingReader:
+    """
+    Read-through wrapper that SHA-256s a file-like object while a backend
+    uploads it, so the bytes are only read once. Backends may seek back and
+    re-read (Drive resends a failed chunk); only bytes past the furthest point
+    read so far are hashed, so the digest stays that of the file.
+    """
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._digest = hashlib.sha256()
+        self._hashed = 0
+
+    def read(self, size=-1):
+        start = self._fileobj.tell()
+        if start > self._hashed:
+            # Skipped ahead: hash the bytes in between so the digest has no hole
+            self._fileobj.seek(self._hashed)
+            self.read(start - self._hashed)
+        chunk = self._fileobj.read(size)
+        end = start + len(chunk)
+        if end > self._hashed:
+            self._digest.update(chunk[self._hashed - start :])
+            self._hashed = end
+        return chunk
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._fileobj.seek(offset, whence)
+
+    def tell(self):
+        return self._fileobj.tell()
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+
+def hash_stream(chunks) -> str:
+    """SHA-256 of an iterator of byte chunks (e.g. storage.stream(file_id))."""
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_storage() -> StorageBackend:
+    if STORAGE_BACKEND == "local":
+        return LocalStorage(LOCAL_STORAGE_DIR)
+    if STORAGE_BACKEND == "drive":
+        return DriveStorage(blob_cache.cache)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+
+
+storage = get_storage()
@@ -0,0 +1,18 @@
+# backend/tests/conftest.py
+import os
+import sys
+import tempfile
+
+# db.py builds its engine at import time; nothing here needs Postgres. A file
+# rather than :memory:, so endpoints that hand the session to a worker thread
+# see the same database.
+os.environ.setdefault(
+    "DATABASE_URL",
+    "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="test_db_"), "test.db"),
+)
+os.environ.setdefault("gemini_api_key", "test")
+# Uploads go to a throwaway directory rather than Google Drive
+os.environ.setdefault("STORAGE_BACKEND", "local")
+os.environ.setdefault("LOCAL_STORAGE_DIR", tempfile.mkdtemp(prefix="test_storage_"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,177 @@
+# backend/tests/test_media_uploads.py
+"""Media uploads against the local storage backend."""
+import asyncio
+import hashlib
+import io
+import os
+
+import pytest
+from fastapi import Request, UploadFile
+from sqlalchemy import event
+from starlette.datastructures import Headers
+
+import models
+import schemas
+import storage_service
+from db import SessionLocal, engine
+from routers import media
+from storage_service import storage
+
+
+@pytest.fixture
+def db():
+    tables = [
+        models.User.__table__,
+        models.MedicalMedia.__table__,
+        models.UploadSession.__table__,
+    ]
+    # Enforce foreign keys like Postgres does (SQLite ignores them by default)
+    enable_fks = lambda conn, _: conn.execute("PRAGMA foreign_keys=ON")  # noqa: E731
+    event.listen(engine, "connect", enable_fks)
+    engine.dispose()
+    models.Base.metadata.create_all(engine, tables=tables)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        models.Base.metadata.drop_all(engine, tables=tables)
+        event.remove(engine, "connect", enable_fks)
+        engine.dispose()
+
+
+@pytest.fixture
+def patient(db):
+    user = models.User(email="uploader@example.com", role=models.UserRole.PATIENT)
+    db.add(user)
+    db.commit()
+    return schemas.TokenData(user_id=user.id, role=models.UserRole.PATIENT)
+
+
+def _put_chunk(db, patient, upload_id: str, body: bytes, content_range: str):
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    request = Request(
+        {
+            "type": "http",
+            "method": "PUT",
+            "headers": [(b"content-range", content_range.encode())],
+        },
+        receive,
+    )
+    return asyncio.run(
+        media.upload_resumable_chunk(
+            upload_id=upload_id, request=request, db=db, current_user=patient
+        )
+    )
+
+
+def _resumable_upload(
+    db, patient, body: bytes, chunk_size: int = None, between_chunks=None
+) -> schemas.UploadSessionRead:
+    started = media.start_resumable_upload(
+        schemas.UploadSessionCreate(
+            file_name="report.pdf", mime_type="application/pdf", total_size=len(body)
+        ),
+        db=db,
+        current_user=patient,
+    )
+    chunk_size = chunk_size or len(body)
+    for start in range(0, len(body), chunk_size):
+        if start and between_chunks:
+            between_chunks(started.upload_id)
+        end = min(start + chunk_size, len(body)) - 1
+        result = _put_chunk(
+            db, patient, started.upload_id, body[start : end + 1],
+            f"bytes {start}-{end}/{len(body)}",
+        )
+    return result
+
+
+def test_delete_resumably_uploaded_file(db, patient):
+    finished = _resumable_upload(db, patient, b"%PDF-1.4 lab results")
+    assert finished.complete
+
+    media.delete_media(finished.media_id, db=db, current_user=patient)
+
+    assert db.get(models.MedicalMedia, finished.media_id) is None
+    session = db.get(models.UploadSession, finished.upload_id)
+    db.refresh(session)
+    assert session.media_id is None
+
+    # Polling the finished session must not bring the deleted file back
+    status = media.get_resumable_upload(
+        finished.upload_id, db=db, current_user=patient
+    )
+    assert status.media_id is None
+    assert db.query(models.MedicalMedia).count() == 0
+
+
+def _stored_files() -> int:
+    return sum(
+        len(files)
+        for root, _, files in os.walk(storage.root)
+        if ".partial" not in root
+    )
+
+
+def _upload(db, patient, body: bytes):
+    file = UploadFile(
+        io.BytesIO(body),
+        filename="report.pdf",
+        headers=Headers({"content-type": "application/pdf"}),
+    )
+    return asyncio.run(media.upload_generic_media(file=file, db=db, current_user=patient))
+
+
+def test_generic_upload_hashes_while_streaming_and_dedups(db, patient):
+    body = b"%PDF-1.4 " + bytes(range(256)) * 4096
+
+    first = _upload(db, patient, body)
+    stored = db.get(models.MedicalMedia, first["id"])
+    assert stored.content_sha256 == hashlib.sha256(body).hexdigest()
+
+    files = _stored_files()
+    again = _upload(db, patient, body)
+    assert again["id"] == first["id"]
+    assert again["message"] == "File already uploaded"
+    # The second copy was written, then removed once it matched
+    assert _stored_files() == files
+    assert db.query(models.MedicalMedia).count() == 1
+
+
+GRANULARITY = storage_service.UPLOAD_CHUNK_GRANULARITY
+LARGE_BODY = bytes(range(256)) * (GRANULARITY // 256) * 3 + b"tail"
+
+
+def test_resumable_upload_stores_content_hash(db, patient, monkeypatch):
+    # Hashed as the chunks were forwarded, without reading the file back
+    monkeypatch.setattr(storage, "stream", None)
+    finished = _resumable_upload(db, patient, LARGE_BODY, chunk_size=GRANULARITY)
+
+    stored = db.get(models.MedicalMedia, finished.media_id)
+    assert stored.content_sha256 == hashlib.sha256(LARGE_BODY).hexdigest()
+
+
+def test_resumable_upload_finished_by_another_process_is_hashed(db, patient):
+    # A restart between chunks loses the running digest; the stored file is read back
+    finished = _resumable_upload(
+        db, patient, LARGE_BODY, chunk_size=GRANULARITY,
+        between_chunks=lambda upload_id: media._upload_digests.pop(upload_id, None),
+    )
+
+    stored = db.get(models.MedicalMedia, finished.media_id)
+    assert stored.content_sha256 == hashlib.sha256(LARGE_BODY).hexdigest()
+
+
+def test_resumable_upload_of_a_duplicate_reuses_the_existing_file(db, patient):
+    first = _upload(db, patient, LARGE_BODY)
+
+    files = _stored_files()
+    finished = _resumable_upload(db, patient, LARGE_BODY, chunk_size=GRANULARITY)
+
+    assert finished.complete
+    assert finished.media_id == first["id"]
+    assert _stored_files() == files
+    assert db.query(models.MedicalMedia).count() == 1
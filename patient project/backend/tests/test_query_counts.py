@@ -0,0 +1,81 @@
+# backend/tests/test_query_counts.py
+"""
+Catches N+1 regressions: the number of SQL statements an endpoint runs must
+not grow with the number of rows it returns.
+"""
+import pytest
+from fastapi import Response
+from sqlalchemy import event
+
+import models
+import schemas
+from db import SessionLocal, engine
+from routers import doctor
+
+
+@pytest.fixture
+def db():
+    # Only the tables these tests touch (the chat tables use a Postgres sequence)
+    tables = [models.User.__table__, models.Profile.__table__]
+    models.Base.metadata.create_all(engine, tables=tables)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        models.Base.metadata.drop_all(engine, tables=tables)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(engine, "before_cursor_execute", self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(engine, "before_cursor_execute", self)
+
+
+def _add_patients(db, count: int):
+    first = db.query(models.User).count()
+    for i in range(first, first + count):
+        user = models.User(email=f"patient{i}@example.com", role=models.UserRole.PATIENT)
+        db.add(user)
+        db.flush()
+        db.add(
+            models.Profile(
+                user_id=user.id,
+                full_name=f"Patient {i}",
+                contact_no="555-0100",
+                address="1 Test Street",
+                blood_group="O+",
+            )
+        )
+    db.commit()
+
+
+def _patients_page_queries(db) -> int:
+    db.expire_all()
+    with QueryCounter() as queries:
+        patients = doctor.get_all_patients(
+            response=Response(), skip=0, limit=50, after_id=None, db=db
+        )
+        # Serializing is where lazy-loaded profiles used to cost a query each
+        [schemas.UserRead.model_validate(p) for p in patients]
+    return queries.count
+
+
+def test_get_all_patients_query_count_is_constant(db):
+    _add_patients(db, 2)
+    few = _patients_page_queries(db)
+
+    _add_patients(db, 30)
+    many = _patients_page_queries(db)
+
+    # Patients, then every profile of the page in one selectinload query
+    assert few == many == 2
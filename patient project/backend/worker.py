@@ -0,0 +1,68 @@
+# backend/worker.py
+"""
+Background job worker. Run it next to the API server:
+
+    python worker.py
+
+Each process runs JOB_CONCURRENCY_<TYPE> threads per registered job type
+(see job_queue.py). Scale out by starting more processes, on this host or any
+host that shares the database and UPLOAD_TMP_DIR.
+"""
+import os
+import signal
+import threading
+import multiprocessing
+
+import job_queue
+
+# Importing the routers registers their @job_handler functions
+from routers import media, chat  # noqa: F401
+
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))
+
+
+def run_worker():
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+
+    threads = []
+    for job_type, handler in job_queue.handlers.items():
+        for i in range(handler.concurrency):
+            thread = threading.Thread(
+                target=job_queue.work_loop,
+                args=(job_type, stop_event),
+                name=f"{job_type}-{i}",
+                daemon=True,
+            )
+            thread.start()
+            threads.append(thread)
+        print(f"Worker {os.getpid()}: {handler.concurrency} thread(s) for '{job_type}'")
+
+    # Wait in small steps so the signal handlers get a chance to run
+    while not stop_event.is_set():
+        stop_event.wait(1)
+
+    print(f"Worker {os.getpid()}: finishing in-flight jobs...")
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == "__main__":
+    if WORKER_PROCESSES <= 1:
+        run_worker()
+    else:
+        processes = [
+            multiprocessing.Process(target=run_worker) for _ in range(WORKER_PROCESSES)
+        ]
+        for process in processes:
+            process.start()
+
+        # Forward shutdown to the children so they drain gracefully
+        def _stop(*_):
+            for process in processes:
+                process.terminate()
+
+        signal.signal(signal.SIGTERM, _stop)
+        for process in processes:
+            process.join()
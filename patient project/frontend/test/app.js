@@ -11,6 +11,7 @@ const App = (() => {
     MAX_FILE_SIZE: 25 * 1024 * 1024,
     TOAST_DURATION: 4000,
     POLL_INTERVAL: 6000,
+    EVENTS_RECONNECT_DELAY: 5000,
     DEBOUNCE_MS: 300,
   });
 
@@ -31,6 +32,9 @@ const App = (() => {
     modalFile: null,
     confirmResolver: null,
     pollTimer: null,
+    chatVersion: 0, // last /users/me/chats/sync version merged into state.sessions
+    chatSyncEtag: null,
+    eventSocket: null, // /ws/events — while open, polling is switched off
     abortControllers: new Map(),
     patientSummariesCache: {},
     hasProfilePic: false,
@@ -405,6 +409,7 @@ const App = (() => {
     showScreen("dashboard");
     loadDashboard();
     loadProfile();
+    connectEvents();
   }
 
   function handleLogout(expired = false) {
@@ -412,6 +417,8 @@ const App = (() => {
     state.user = null;
     state.currentSessionId = null;
     state.sessions = [];
+    state.chatVersion = 0;
+    state.chatSyncEtag = null;
     state.files = [];
     state.patients = [];
     state.selectedPatientId = null;
@@ -423,6 +430,7 @@ const App = (() => {
 
     // Stop background tasks
     stopPolling();
+    disconnectEvents();
     state.abortControllers.forEach((c) => c.abort());
     state.abortControllers.clear();
 
@@ -558,11 +566,10 @@ const App = (() => {
 
   async function loadPatientDashboard() {
     try {
-      const [sessRes, filesRes] = await Promise.allSettled([
-        api("/users/me/chats/", { _abortKey: "dash-chats" }),
+      const [, filesRes] = await Promise.allSettled([
+        syncSessions(),
         api("/users/me/media/", { _abortKey: "dash-media" }),
       ]);
-      if (sessRes.status === "fulfilled" && sessRes.value.ok) state.sessions = await sessRes.value.json();
       if (filesRes.status === "fulfilled" && filesRes.value.ok) state.files = await filesRes.value.json();
 
       // Session count
@@ -613,15 +620,11 @@ const App = (() => {
         badge.style.display = "";
       }
 
-      // 1. FETCH SUMMARIES AND APPOINTMENTS IN PARALLEL
-      const summaryPromises = state.patients.map((p) =>
-        apiJSON(`/doctor/patients/${p.id}/summaries`).catch(() => [])
-      );
-      const apptPromise = apiJSON("/appointments/doctor").catch(() => []);
-
-      const [allSummaries, appts] = await Promise.all([
-        Promise.all(summaryPromises),
-        apptPromise
+      // 1. FETCH TRIAGE QUEUE AND APPOINTMENTS IN PARALLEL
+      // (one request for every patient's latest summary + the stat totals)
+      const [queue, appts] = await Promise.all([
+        apiJSON("/doctor/triage-queue").catch(() => ({ items: [], stats: null })),
+        apiJSON("/appointments/doctor").catch(() => [])
       ]);
 
       // 2. SORT APPOINTMENTS BY DATE/TIME
@@ -657,47 +660,25 @@ const App = (() => {
           return timeB - timeA; // Past/Cancelled: Most recent first (Descending)
         }
       });
-      // Cache for later use
-      state.patients.forEach((p, i) => {
-        state.patientSummariesCache[p.id] = allSummaries[i];
-      });
-
-      // Aggregate stats
-      let totalSessions = 0;
-      let totalPriority = 0;
-      let priorityCount = 0;
-      let pendingCount = 0;
-      let highPriorityPatients = [];
-
-      allSummaries.forEach((sessions, idx) => {
-        const patient = state.patients[idx];
-        // Only count triage_summary type items (not file records)
-        const triageSessions = sessions.filter((s) => s.type === "triage_summary");
-        totalSessions += triageSessions.length;
-
-        let patientMaxPriority = 0;
-
-        triageSessions.forEach((s) => {
-          const score = s.priority_score || s.content?.priority_score;
-          if (score) {
-            totalPriority += score;
-            priorityCount++;
-            if (score > patientMaxPriority) patientMaxPriority = score;
-          }
-          // Count as pending if no reviewed flag in content
-          if (!s.content?.reviewed) {
-            pendingCount++;
-          }
-        });
+      // Aggregate stats (computed server-side over all summarized sessions)
+      const stats = queue.stats || {};
+      const totalSessions = stats.total_sessions || 0;
+      const pendingCount = stats.unreviewed_sessions || 0;
+      const avgPriority = stats.average_priority;
+
+      if (stats.total_patients != null) {
+        document.getElementById("statDocPatients").textContent = stats.total_patients;
+      }
 
-        if (patientMaxPriority > 0) {
-          highPriorityPatients.push({
-            ...patient,
-            maxPriority: patientMaxPriority,
-            sessionCount: triageSessions.length,
-          });
-        }
-      });
+      // Highest max_priority over every patient, not just this page of the queue
+      const highPriorityPatients = (queue.top_priority || []).map((item) => ({
+        id: item.patient_id,
+        email: item.email,
+        profile: { full_name: item.full_name },
+        hasProfilePic: item.has_profile_pic,
+        maxPriority: item.max_priority,
+        sessionCount: item.session_count,
+      }));
 
       // 3. CALCULATE TODAY'S PENDING APPOINTMENTS
       const currentDate = new Date();
@@ -756,18 +737,17 @@ const App = (() => {
       } else {
         console.log("❌ ERROR: statDocAppointments element not found!");
       }
-      if (statPriority) statPriority.textContent = priorityCount
-        ? (totalPriority / priorityCount).toFixed(1)
+      if (statPriority) statPriority.textContent = avgPriority != null
+        ? avgPriority.toFixed(1)
         : "\u2014";
 
-      // Render patients sorted by priority
-      highPriorityPatients.sort((a, b) => b.maxPriority - a.maxPriority);
+      // Render patients by priority (already sorted by the server)
       renderDoctorRecentPatients(
         highPriorityPatients.length
           ? highPriorityPatients.slice(0, 5)
           : state.patients.slice(0, 5)
       );
-      renderDoctorRecentActivity(allSummaries);
+      renderDoctorRecentActivity(queue.items);
 
     } catch (err) {
       if (err.name !== "AbortError") console.error("Doctor dashboard error:", err);
@@ -784,7 +764,7 @@ const App = (() => {
     el.innerHTML = patients.map((p) => {
       const name = p.profile?.full_name || p.email || "Unknown";
       const initial = name[0]?.toUpperCase() || "?";
-      const hasPic = !!p.profile?.profile_pic_drive_id;
+      const hasPic = p.hasProfilePic ?? !!p.profile?.profile_pic_drive_id;
 
       // Variables from your original code
       const score = p.maxPriority;
@@ -809,21 +789,23 @@ const App = (() => {
     // Trigger image loading for this list
     loadListAvatars(el);
   }
-  function renderDoctorRecentActivity(allSummaries) {
+  function renderDoctorRecentActivity(queueItems) {
     const el = $("#recentFiles");
 
-    // Flatten all sessions with patient info, sort by date
-    const allSessions = [];
-    allSummaries.forEach((sessions, idx) => {
-      const patient = state.patients[idx];
-      sessions.forEach((s) => {
-        allSessions.push({
-          ...s,
-          patientName: patient?.profile?.full_name || patient?.email || "Unknown",
-          patientId: patient?.id,
-        });
-      });
-    });
+    // Each patient's latest summarized session, sort by date
+    const allSessions = queueItems
+      .filter((item) => item.latest_chat_id)
+      .map((item) => ({
+        id: `chat_${item.latest_chat_id}`,
+        created_at: item.latest_summary_at,
+        priority_score: item.priority_score,
+        content: {
+          summary_note: item.summary_note,
+          chief_complaint: item.chief_complaint,
+        },
+        patientName: item.full_name || item.email || "Unknown",
+        patientId: item.patient_id,
+      }));
 
     // Sort by created_at descending
     allSessions.sort((a, b) => {
@@ -998,7 +980,7 @@ const App = (() => {
     el.innerHTML = '<div style="text-align:center;padding:20px"><span class="spinner"></span></div>';
 
     try {
-      const data = await apiJSON(`/doctor/patients/${patientId}/summaries`);
+      const data = await apiJSON(`/doctor/patients/${patientId}/summaries?type=triage_summary`);
 
       // Cache for chat viewer
       state.patientSummariesCache[patientId] = data;
@@ -1296,14 +1278,65 @@ const App = (() => {
   // ═══════════════════════════════════════
   async function loadSessions() {
     try {
-      const res = await api("/users/me/chats/", { _abortKey: "load-sessions" });
-      if (res.ok) state.sessions = await res.json();
+      const changed = await syncSessions();
       renderSessionList();
+      // Refresh the open chat if e.g. an upload finished analyzing — but never
+      // while a reply is being sent/streamed into it
+      if (changed.has(state.currentSessionId) && !state.isSending) {
+        const s = state.sessions.find((x) => x.session_id === state.currentSessionId);
+        renderMessages(s.messages);
+        if (s.summary) appendSummaryCard(s.summary);
+      }
     } catch (err) {
       if (err.name !== "AbortError") console.error(err);
     }
   }
 
+  // Fetches only what changed since the last sync (304 when nothing did) and
+  // merges it into state.sessions. Returns the set of changed session ids.
+  async function syncSessions() {
+    const headers = {};
+    if (state.chatSyncEtag) headers["If-None-Match"] = state.chatSyncEtag;
+    const res = await api(`/users/me/chats/sync?since=${state.chatVersion}`, {
+      headers,
+      cache: "no-store",
+      _abortKey: "chat-sync",
+    });
+    if (res.status === 304 || !res.ok) return new Set();
+
+    const data = await res.json();
+    state.chatSyncEtag = res.headers.get("ETag");
+    state.chatVersion = data.version;
+    return mergeChatChanges(data);
+  }
+
+  function mergeChatChanges({ sessions, messages }) {
+    const byId = new Map(state.sessions.map((s) => [s.session_id, s]));
+    const changed = new Set();
+
+    sessions.forEach((meta) => {
+      const s = byId.get(meta.session_id);
+      if (s) Object.assign(s, meta);
+      else byId.set(meta.session_id, { ...meta, messages: [] });
+      changed.add(meta.session_id);
+    });
+
+    messages.forEach((m) => {
+      const s = byId.get(m.session_id);
+      if (!s) return;
+      const i = s.messages.findIndex((x) => x.seq === m.seq);
+      if (i >= 0) s.messages[i] = m;
+      else s.messages.push(m);
+      changed.add(m.session_id);
+    });
+
+    changed.forEach((id) => byId.get(id)?.messages.sort((a, b) => a.seq - b.seq));
+    state.sessions = [...byId.values()].sort(
+      (a, b) => new Date(b.created_at || 0) - new Date(a.created_at || 0)
+    );
+    return changed;
+  }
+
   function renderSessionList() {
     const el = $("#sessionList");
     if (!state.sessions.length) {
@@ -1474,23 +1507,17 @@ const App = (() => {
     showTypingIndicator();
 
     try {
-      const res = await api("/chat/", {
+      const res = await api("/chat/stream", {
         method: "POST",
-        body: JSON.stringify({ user_id: 1, session_id: state.currentSessionId, message: msg }),
+        body: JSON.stringify({ session_id: state.currentSessionId, message: msg }),
       });
-      const data = await res.json();
-      removeTypingIndicator();
-      console.log("[Chat] Response:", data);
 
       if (res.ok) {
-        const reply = data.response || data.reply || data.message || data.answer || data.text || (typeof data === "string" ? data : null);
-        if (reply) {
-          appendMessage({ sender: "ai", text: reply });
-        } else {
-          appendMessage({ sender: "ai", text: JSON.stringify(data, null, 2) });
-        }
+        await readChatStream(res);
         loadSessions().catch(() => { });
       } else {
+        const data = await res.json();
+        removeTypingIndicator();
         appendMessage({ sender: "system", text: `Error: ${parseApiError(data)}` });
       }
     } catch (err) {
@@ -1505,6 +1532,51 @@ const App = (() => {
     }
   }
 
+  // Renders a /chat/stream Server-Sent Events reply token by token
+  async function readChatStream(res) {
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let replyText = "";
+    let bubble = null;
+
+    const showReply = (text) => {
+      if (!bubble) {
+        removeTypingIndicator();
+        appendMessage({ sender: "ai", text: "" });
+        bubble = $("#chatMessages").lastElementChild.querySelector(".msg-bubble");
+      }
+      bubble.innerHTML = formatMessageText(text);
+      const el = $("#chatMessages");
+      el.scrollTop = el.scrollHeight;
+    };
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let sep;
+      while ((sep = buffer.indexOf("\n\n")) !== -1) {
+        const raw = buffer.slice(0, sep);
+        buffer = buffer.slice(sep + 2);
+        const event = (raw.match(/^event: (.*)$/m) || [])[1];
+        const data = JSON.parse((raw.match(/^data: (.*)$/m) || [])[1] || "{}");
+
+        if (event === "token") {
+          replyText += data.text;
+          showReply(replyText);
+        } else if (event === "done") {
+          showReply(data.response);
+        } else if (event === "error") {
+          removeTypingIndicator();
+          appendMessage({ sender: "system", text: `Error: ${data.detail}` });
+        }
+      }
+    }
+    removeTypingIndicator();
+  }
+
   async function handleChatFileUpload(input) {
     if (!input.files[0]) return;
     if (!state.currentSessionId) { toast("Start a session first", "error"); input.value = ""; return; }
@@ -1531,6 +1603,7 @@ const App = (() => {
   // ═══════════════════════════════════════
   function startPolling() {
     stopPolling();
+    if (eventsConnected()) return; // pushed over /ws/events instead
     state.pollTimer = setInterval(() => {
       if (state.currentScreen === "chat") loadSessions().catch(() => { });
     }, CONFIG.POLL_INTERVAL);
@@ -1540,6 +1613,55 @@ const App = (() => {
     if (state.pollTimer) { clearInterval(state.pollTimer); state.pollTimer = null; }
   }
 
+  // ═══════════════════════════════════════
+  // LIVE EVENTS (WebSocket)
+  // ═══════════════════════════════════════
+  function eventsConnected() {
+    return state.eventSocket?.readyState === WebSocket.OPEN;
+  }
+
+  function connectEvents() {
+    if (!state.token || state.eventSocket) return;
+    const url = `${CONFIG.API_BASE.replace(/^http/, "ws")}/ws/events?token=${encodeURIComponent(state.token)}`;
+    const ws = new WebSocket(url);
+    state.eventSocket = ws;
+
+    ws.onopen = () => {
+      // Catch up on anything missed while disconnected, then stop polling
+      stopPolling();
+      refreshAfterEvent({ event: "resync" });
+    };
+    ws.onmessage = (e) => {
+      try { refreshAfterEvent(JSON.parse(e.data)); } catch (err) { console.error(err); }
+    };
+    ws.onclose = () => {
+      if (state.eventSocket !== ws) return; // replaced or logged out
+      state.eventSocket = null;
+      if (state.currentScreen === "chat") startPolling();
+      if (state.files.some(isFileProcessing)) setTimeout(pollProcessingFiles, CONFIG.POLL_INTERVAL);
+      if (state.token) setTimeout(connectEvents, CONFIG.EVENTS_RECONNECT_DELAY);
+    };
+  }
+
+  function disconnectEvents() {
+    const ws = state.eventSocket;
+    state.eventSocket = null;
+    if (ws) ws.close();
+  }
+
+  function refreshAfterEvent(msg) {
+    const isPatient = (state.user?.role || "patient") === "patient";
+    if (!isPatient || msg.event === "ping") return;
+
+    const chatChanged = ["chat.updated", "chat.ai_replied", "prescription.issued", "resync"].includes(msg.event);
+    const filesChanged = ["media.ready", "media.failed", "prescription.issued", "resync"].includes(msg.event);
+
+    if (state.currentScreen === "dashboard" && msg.event !== "resync") loadDashboard();
+    if (chatChanged && state.currentScreen === "chat") loadSessions();
+    if (filesChanged && state.currentScreen === "files") loadFiles();
+    if (msg.event === "prescription.issued") toast("Your doctor issued a new prescription", "success");
+  }
+
 
   // ═══════════════════════════════════════
   // APPOINTMENTS DATA
@@ -1672,7 +1794,7 @@ const App = (() => {
     }
     el.innerHTML = state.files.map((f) => {
       const info = getFileTypeInfo(f);
-      const isProc = f.transcript?.includes("being analyzed") || f.drive_file_id === "processing...";
+      const isProc = isFileProcessing(f);
       const hasTr = f.transcript && f.transcript !== "User Uploaded Record" && !isProc;
       return `<div class="file-card" role="listitem" data-action="view-file" data-file-id="${f.id}" tabindex="0">
           <div class="file-card-actions">
@@ -1688,9 +1810,36 @@ const App = (() => {
         </div>`;
     }).join("");
 
-    const processing = state.files.some((f) => f.drive_file_id === "processing...");
+    const processing = state.files.some(isFileProcessing);
     $("#processingBanner").classList.toggle("visible", processing);
-    if (processing) setTimeout(loadFiles, CONFIG.POLL_INTERVAL);
+    if (processing && !eventsConnected()) setTimeout(pollProcessingFiles, CONFIG.POLL_INTERVAL);
+  }
+
+  function isFileProcessing(f) {
+    if (f.processing_status) return f.processing_status === "processing";
+    return f.transcript?.includes("being analyzed") || f.drive_file_id === "processing...";
+  }
+
+  // Only ask about the files that are still processing instead of re-listing everything
+  async function pollProcessingFiles() {
+    const pending = state.files.filter(isFileProcessing);
+    if (!pending.length) return;
+    let changed = false;
+    await Promise.all(pending.map(async (f) => {
+      try {
+        const res = await api(`/media/${f.id}/status`);
+        if (!res.ok) return;
+        const status = await res.json();
+        if (status.processing_status !== f.processing_status) {
+          Object.assign(f, status);
+          changed = true;
+        }
+      } catch (err) {
+        console.error(err);
+      }
+    }));
+    if (changed) renderFiles();
+    else if (!eventsConnected()) setTimeout(pollProcessingFiles, CONFIG.POLL_INTERVAL);
   }
 
   async function deleteFile(id) {
@@ -2390,7 +2539,7 @@ const App = (() => {
         try {
           const [doctors, sessions] = await Promise.allSettled([
             apiJSON("/users/doctors/"),       // new lightweight endpoint
-            apiJSON("/users/me/chats/"),
+            apiJSON("/users/me/chats/index"),
           ]);
 
           // Build doctor dropdown — show name (email fallback), store id as value
@@ -2408,9 +2557,8 @@ const App = (() => {
           if (sessions.status === "fulfilled" && sessions.value.length) {
             sessionOptions = '<option value="">Select a session</option>' +
               sessions.value.map(s => {
-                const firstMsg = s.messages?.find(m => m.sender === "patient");
-                const label = firstMsg
-                  ? getSessionDisplayName(firstMsg.text)
+                const label = s.first_patient_message
+                  ? getSessionDisplayName(s.first_patient_message)
                   : `Session ${formatDate(s.created_at)}`;
                 return `<option value="${esc(s.session_id)}">${esc(label)}</option>`;
               }).join('');